@@ -0,0 +1,200 @@
+# Copyright (c) 2020 Louis Wouters
+# The PostProcessingPlugin is released under the terms of the AGPLv3 or higher.
+import json
+import math
+import re
+from array import array
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from . import GCodeParser
+
+try:
+    import numpy
+except ImportError:  # The estimate is computed in plain Python instead.
+    numpy = None
+
+#   A G0/G1 move, G90/G91 or G92, with the words of the command (without the comment) in the second group.
+_COMMAND_PATTERN = re.compile("^G(0|1|9[012])(?![0-9])([^;\n]*)", re.MULTILINE)
+
+DEFAULT_COEFFICIENTS = {
+    "acceleration": 500.0,  # mm/s², of moves that extrude
+    "travel_acceleration": 500.0,  # mm/s², of moves that don't extrude
+    "print_factor": 1.0,  # multiplies the time of moves that extrude
+    "travel_factor": 1.0,  # multiplies the time of moves that don't extrude
+    "layer_overhead": 0.0,  # seconds added to every layer, e.g. for layer changes and cooling
+    "feedrate": 1500.0  # mm/min, until the g-code sets a feedrate
+}  # type: Dict[str, float]
+
+
+#   Position, feedrate and positioning mode (G90/G91) at the end of the moves that were estimated so far.
+class EtaState:
+    __slots__ = ("x", "y", "z", "feedrate", "relative")
+
+    def __init__(self, feedrate: float) -> None:
+        self.x = 0.0
+        self.y = 0.0
+        self.z = 0.0
+        self.feedrate = feedrate
+        self.relative = False
+
+
+#   The G0/G1 moves and G92 commands of a layer, as parallel lists in the order of the layer.
+#   Coordinates and feedrates that a command doesn't set are NaN. G92 only sets the position, it doesn't move.
+class _Commands:
+    __slots__ = ("x", "y", "z", "feedrate", "relative", "moving", "extruding", "ends")
+
+    def __init__(self) -> None:
+        self.x = []  # type: List[float]
+        self.y = []  # type: List[float]
+        self.z = []  # type: List[float]
+        self.feedrate = []  # type: List[float]
+        self.relative = []  # type: List[bool]
+        self.moving = []  # type: List[bool]
+        self.extruding = []  # type: List[bool]
+        self.ends = []  # type: List[int]  # Offsets in the layer just after the commands.
+
+
+#   Parses the commands of a layer that move the print head or set its position, following G90/G91 from the state.
+def _parseCommands(layer: str, state: EtaState) -> _Commands:
+    commands = _Commands()
+    relative = state.relative
+    nan = math.nan
+    for match in _COMMAND_PATTERN.finditer(layer):
+        code = match.group(1)
+        if code == "90" or code == "91":
+            relative = code == "91"
+            continue
+        words = GCodeParser.parseWords(match.group(2))
+        commands.x.append(GCodeParser.toNumber(words["X"], nan) if "X" in words else nan)
+        commands.y.append(GCodeParser.toNumber(words["Y"], nan) if "Y" in words else nan)
+        commands.z.append(GCodeParser.toNumber(words["Z"], nan) if "Z" in words else nan)
+        feedrate = GCodeParser.toNumber(words["F"], nan) if "F" in words else nan
+        commands.feedrate.append(feedrate if feedrate > 0 else nan)
+        commands.relative.append(relative and code != "92")
+        commands.moving.append(code != "92")
+        commands.extruding.append(code == "1" and "E" in words)
+        commands.ends.append(match.end())
+    state.relative = relative
+    return commands
+
+
+#   Estimates the printing time of layers from their own moves.
+#
+#   Every G0/G1 move takes its distance at its feedrate, with a trapezoid speed profile: the move accelerates from
+#   standstill to the feedrate and decelerates back at the acceleration of the printer, or only reaches a lower top
+#   speed if it is too short for that. Moves that extrude and travel moves have their own acceleration and a factor
+#   that corrects the rest of the difference with the printer, which are the calibration coefficients of the model.
+#   Moves that only extrude or retract are not counted. Relative positioning (G91, e.g. in the purge lines of
+#   FilamentChangeAtStart) and positions set with G92 are followed.
+#   The commands are parsed in Python; with NumPy the positions, distances, feedrates and times of all moves of a layer
+#   are then computed at once.
+class EtaModel:
+    def __init__(self, coefficients: Optional[Dict[str, Any]] = None) -> None:
+        self._coefficients = dict(DEFAULT_COEFFICIENTS)
+        for key, value in (coefficients or {}).items():
+            if key not in DEFAULT_COEFFICIENTS:
+                raise ValueError("Unknown calibration coefficient " + key)
+            self._coefficients[key] = float(value)
+        for key in ("acceleration", "travel_acceleration", "feedrate"):
+            if self._coefficients[key] <= 0:
+                raise ValueError("Calibration coefficient {key} must be positive".format(key = key))
+
+    #   Loads the calibration coefficients of a printer from a JSON file, e.g. {"acceleration": 1000, "print_factor": 1.1}.
+    @classmethod
+    def load(cls, path: str) -> "EtaModel":
+        with open(path) as f:
+            return cls(json.load(f))
+
+    def getCoefficients(self) -> Dict[str, float]:
+        return dict(self._coefficients)
+
+    def createState(self) -> EtaState:
+        return EtaState(self._coefficients["feedrate"])
+
+    #   Estimates the time of every layer in seconds. The layers must be given in printing order.
+    def estimateLayers(self, layers: Iterable[str]) -> array:
+        state = self.createState()
+        return array("d", (self.estimateLayer(layer, state) for layer in layers))
+
+    #   Estimates the time of a single layer in seconds, starting from (and updating) the state after the previous layer.
+    def estimateLayer(self, layer: str, state: EtaState) -> float:
+        _, times = self.estimateMoves(layer, state)
+        moves_time = float(numpy.sum(times)) if numpy is not None else sum(times)
+        return moves_time + self._coefficients["layer_overhead"]
+
+    #   Estimates the time of every move of a layer that takes time, starting from (and updating) the state after the
+    #   previous layer. Returns the offsets in the layer just after these moves and their times in seconds, without
+    #   the layer overhead. With NumPy the times are an array, otherwise a list.
+    def estimateMoves(self, layer: str, state: EtaState) -> Tuple[List[int], Sequence[float]]:
+        commands = _parseCommands(layer, state)
+        if numpy is not None:
+            return self._estimateMovesVectorized(commands, state)
+        return self._estimateMoves(commands, state)
+
+    def _estimateMoves(self, commands: _Commands, state: EtaState) -> Tuple[List[int], List[float]]:
+        coefficients = self._coefficients
+        ends = []  # type: List[int]
+        times = []  # type: List[float]
+        x, y, z, feedrate = state.x, state.y, state.z, state.feedrate
+        for index, relative in enumerate(commands.relative):
+            if commands.feedrate[index] == commands.feedrate[index]:  # Not NaN.
+                feedrate = commands.feedrate[index]
+            new_x, new_y, new_z = x, y, z
+            if commands.x[index] == commands.x[index]:
+                new_x = x + commands.x[index] if relative else commands.x[index]
+            if commands.y[index] == commands.y[index]:
+                new_y = y + commands.y[index] if relative else commands.y[index]
+            if commands.z[index] == commands.z[index]:
+                new_z = z + commands.z[index] if relative else commands.z[index]
+            distance = math.sqrt((new_x - x) ** 2 + (new_y - y) ** 2 + (new_z - z) ** 2)
+            x, y, z = new_x, new_y, new_z
+            if distance <= 0 or not commands.moving[index]:
+                continue
+
+            extrudes = commands.extruding[index]
+            acceleration = coefficients["acceleration"] if extrudes else coefficients["travel_acceleration"]
+            speed = feedrate / 60
+            if distance >= speed * speed / acceleration:  # Reaches the feedrate.
+                time = distance / speed + speed / acceleration
+            else:
+                time = 2 * math.sqrt(distance / acceleration)
+            ends.append(commands.ends[index])
+            times.append(time * (coefficients["print_factor"] if extrudes else coefficients["travel_factor"]))
+        state.x, state.y, state.z, state.feedrate = x, y, z, feedrate
+        return ends, times
+
+    #   The same as _estimateMoves, for all commands at once. The position along every axis follows from the last
+    #   command before it that set the axis to an absolute value, plus the relative moves since.
+    def _estimateMovesVectorized(self, commands: _Commands, state: EtaState) -> Tuple[List[int], Any]:
+        if not commands.ends:
+            return [], numpy.zeros(0)
+        coefficients = self._coefficients
+        positions = [_resolveAxis(numpy.array(values), relative, start)
+                     for values, relative, start in ((commands.x, commands.relative, state.x), (commands.y, commands.relative, state.y), (commands.z, commands.relative, state.z))]
+        feedrate = _resolveAxis(numpy.array(commands.feedrate), numpy.zeros(len(commands.ends), dtype = bool), state.feedrate)
+        distance = numpy.sqrt(sum(numpy.diff(position, prepend = start) ** 2 for position, start in zip(positions, (state.x, state.y, state.z))))
+        state.x, state.y, state.z = (float(position[-1]) for position in positions)
+        state.feedrate = float(feedrate[-1])
+
+        counted = (distance > 0) & numpy.array(commands.moving)
+        distance = distance[counted]
+        speed = feedrate[counted] / 60
+        extrudes = numpy.array(commands.extruding)[counted]
+        acceleration = numpy.where(extrudes, coefficients["acceleration"], coefficients["travel_acceleration"])
+        time = numpy.where(distance >= speed * speed / acceleration,
+                           distance / speed + speed / acceleration,
+                           2 * numpy.sqrt(distance / acceleration))
+        time *= numpy.where(extrudes, coefficients["print_factor"], coefficients["travel_factor"])
+        return numpy.array(commands.ends)[counted].tolist(), time
+
+
+#   Position along an axis after every command: the last absolute value that was set before it (or the start
+#   position), plus the relative values since. Values that aren't set are NaN.
+def _resolveAxis(values: Any, relative: Any, start: float) -> Any:
+    is_set = ~numpy.isnan(values)
+    absolute = is_set & ~numpy.asarray(relative, dtype = bool)
+    offsets = numpy.cumsum(numpy.where(is_set & ~absolute, values, 0.0))
+    command_indices = numpy.arange(len(values))
+    last_absolute = numpy.maximum.accumulate(numpy.where(absolute, command_indices, -1))
+    base = numpy.where(last_absolute >= 0, values[last_absolute] - offsets[last_absolute], start)
+    return base + offsets
@@ -0,0 +1,267 @@
+# Copyright (c) 2020 Louis Wouters
+# The PostProcessingPlugin is released under the terms of the AGPLv3 or higher.
+import struct
+import zlib
+from typing import Dict, Iterable, Iterator, List, Optional
+
+#   Compact output formats for the post-processed g-code.
+#
+#   MeatPack packs the 15 most common characters of g-code into 4 bits each, so two characters take a single byte.
+#   Other bytes of the UTF-8 text follow in full after a 4-bit marker; 0xFF never occurs in UTF-8, so the data can't
+#   be mistaken for the 0xFF 0xFF that starts a command. Comments and whitespace around the code are removed, as
+#   the firmware ignores them anyway. A stream starts with the command that enables packing in the firmware.
+#
+#   The block format follows the layout of binary g-code (bgcode): a file header, followed by g-code blocks of at most
+#   block_size bytes. Every block has a header with its type, compression and size, the encoding of its data, the
+#   (compressed) data and a CRC32 checksum. Blocks can be compressed with zlib and their data can be MeatPacked.
+#   It is not bgcode itself: only g-code blocks are written, without the metadata blocks that bgcode requires, so the
+#   files have a magic of their own ("GCBK" instead of "GCDE") and printers don't mistake them for bgcode files.
+#
+#   The encoders are fed the sections one at a time and return the bytes that are complete, so the output can be
+#   written while the g-code is still being processed. decode restores the (minified, for MeatPack) g-code.
+
+MEATPACK_SIGNAL = b"\xff\xff"
+MEATPACK_ENABLE_PACKING = 0xfb
+MEATPACK_DISABLE_PACKING = 0xfa
+_MEATPACK_CHARACTERS = b"0123456789. \nGX"
+_MEATPACK_FULL_WIDTH = 0b1111
+_meatpack_codes = {character: code for code, character in enumerate(_MEATPACK_CHARACTERS)}  # type: Dict[int, int]
+
+BLOCK_MAGIC = b"GCBK"
+BLOCK_VERSION = 1
+BLOCK_CHECKSUM_CRC32 = 1
+BLOCK_TYPE_GCODE = 1
+COMPRESSION_NONE = 0
+COMPRESSION_DEFLATE = 1
+ENCODING_NONE = 0
+ENCODING_MEATPACK = 1
+_FILE_HEADER = struct.Struct("<4sIH")
+_BLOCK_HEADER = struct.Struct("<HHI")
+_COMPRESSED_SIZE = struct.Struct("<I")
+_BLOCK_PARAMETERS = struct.Struct("<H")
+_CHECKSUM = struct.Struct("<I")
+
+
+#   Removes comments, whitespace around the code and empty lines from g-code.
+def minify(text: str) -> str:
+    lines = []
+    for line in text.split("\n"):
+        comment = line.find(";")
+        if comment != -1:
+            line = line[:comment]
+        line = line.strip()
+        if line:
+            lines.append(line)
+    return "".join(line + "\n" for line in lines)
+
+
+#   Base class of the encoders.
+class GCodeEncoder:
+    #   Encodes the next section and returns the bytes that are ready to be written, possibly none.
+    def encode(self, section: str) -> bytes:
+        raise NotImplementedError()
+
+    #   Returns the rest of the output after the last section.
+    def finish(self) -> bytes:
+        return b""
+
+    def encodeStream(self, sections: Iterable[str]) -> Iterator[bytes]:
+        for section in sections:
+            encoded = self.encode(section)
+            if encoded:
+                yield encoded
+        encoded = self.finish()
+        if encoded:
+            yield encoded
+
+
+class MeatPackEncoder(GCodeEncoder):
+    #   \param signal Whether to start with the command that enables packing, as firmware needs it. Blocks of the
+    #   block format leave it out.
+    def __init__(self, signal: bool = True) -> None:
+        self._started = not signal
+        self._pending = b""  # A byte that waits for the next one to be packed into a byte with it.
+        self._partial_line = ""  # The end of the last section if it doesn't end with a newline.
+
+    def encode(self, section: str) -> bytes:
+        output = bytearray()
+        if not self._started:
+            output += MEATPACK_SIGNAL + bytes([MEATPACK_ENABLE_PACKING])
+            self._started = True
+        text = self._partial_line + section
+        end_of_lines = text.rfind("\n") + 1
+        self._partial_line = text[end_of_lines:]
+        text = self._pending + minify(text[:end_of_lines]).encode("utf-8")
+        if len(text) % 2:
+            text, self._pending = text[:-1], text[-1:]
+        else:
+            self._pending = b""
+        _packPairs(text, output)
+        return bytes(output)
+
+    #   The last character is packed with an empty line, which the firmware ignores.
+    def finish(self) -> bytes:
+        partial_line, self._partial_line = self._partial_line, ""
+        output = bytearray(self.encode(partial_line + "\n") if partial_line else b"")
+        if not self._started:
+            output += MEATPACK_SIGNAL + bytes([MEATPACK_ENABLE_PACKING])
+            self._started = True
+        if self._pending:
+            _packPairs(self._pending + b"\n", output)
+            self._pending = b""
+        return bytes(output)
+
+
+def _packPairs(text: bytes, output: bytearray) -> None:
+    codes = _meatpack_codes
+    for position in range(0, len(text), 2):
+        first, second = text[position], text[position + 1]
+        first_code = codes.get(first, _MEATPACK_FULL_WIDTH)
+        second_code = codes.get(second, _MEATPACK_FULL_WIDTH)
+        output.append(first_code | second_code << 4)
+        if first_code == _MEATPACK_FULL_WIDTH:
+            output.append(first)
+        if second_code == _MEATPACK_FULL_WIDTH:
+            output.append(second)
+
+
+#   Restores the minified g-code from MeatPacked bytes.
+def decodeMeatPack(data: bytes) -> str:
+    text = bytearray()
+    packing = False
+    position = 0
+    while position < len(data):
+        if data[position:position + 2] == MEATPACK_SIGNAL:
+            command = data[position + 2] if position + 2 < len(data) else None
+            if command == MEATPACK_ENABLE_PACKING:
+                packing = True
+            elif command == MEATPACK_DISABLE_PACKING:
+                packing = False
+            position += 3
+            continue
+        byte = data[position]
+        position += 1
+        if not packing:
+            text.append(byte)
+            continue
+        for code in (byte & 0b1111, byte >> 4):
+            if code == _MEATPACK_FULL_WIDTH:
+                text.append(data[position])
+                position += 1
+            else:
+                text.append(_MEATPACK_CHARACTERS[code])
+    text = text.decode("utf-8")
+    return text[:-1] if text.endswith("\n\n") else text  # The empty line that completes the last byte.
+
+
+class BlockEncoder(GCodeEncoder):
+    #   \param compress Whether to compress the blocks with zlib.
+    #   \param meatpack Whether to MeatPack the g-code in the blocks.
+    #   \param block_size Maximum size of the g-code in a block, before encoding. Sections are not split, so a single
+    #   section that is larger gets a block of its own.
+    def __init__(self, compress: bool = True, meatpack: bool = False, block_size: int = 65536) -> None:
+        self._compress = compress
+        self._meatpack = meatpack
+        self._block_size = block_size
+        self._started = False
+        self._pending = []  # type: List[str]
+        self._pending_size = 0
+
+    def encode(self, section: str) -> bytes:
+        output = bytearray()
+        if not self._started:
+            output += _FILE_HEADER.pack(BLOCK_MAGIC, BLOCK_VERSION, BLOCK_CHECKSUM_CRC32)
+            self._started = True
+        # Blocks end at the end of a line, so every block can be decoded on its own.
+        if self._pending and self._pending_size + len(section) > self._block_size and self._pending[-1].endswith("\n"):
+            output += self._encodeBlock()
+        self._pending.append(section)
+        self._pending_size += len(section)
+        return bytes(output)
+
+    def finish(self) -> bytes:
+        output = bytearray()
+        if not self._started:
+            output += _FILE_HEADER.pack(BLOCK_MAGIC, BLOCK_VERSION, BLOCK_CHECKSUM_CRC32)
+            self._started = True
+        if self._pending:
+            output += self._encodeBlock()
+        return bytes(output)
+
+    def _encodeBlock(self) -> bytes:
+        text = "".join(self._pending)
+        self._pending = []
+        self._pending_size = 0
+        if self._meatpack:
+            data = b"".join(MeatPackEncoder(signal = False).encodeStream([text]))
+        else:
+            data = text.encode("utf-8")
+
+        if self._compress:
+            compressed = zlib.compress(data)
+            header = _BLOCK_HEADER.pack(BLOCK_TYPE_GCODE, COMPRESSION_DEFLATE, len(data)) + _COMPRESSED_SIZE.pack(len(compressed))
+            data = compressed
+        else:
+            header = _BLOCK_HEADER.pack(BLOCK_TYPE_GCODE, COMPRESSION_NONE, len(data))
+        block = header + _BLOCK_PARAMETERS.pack(ENCODING_MEATPACK if self._meatpack else ENCODING_NONE) + data
+        return block + _CHECKSUM.pack(zlib.crc32(block))
+
+
+#   Restores the g-code from the block format. Blocks of other types than g-code are skipped.
+def decodeBlocks(data: bytes) -> str:
+    magic, _, checksum_type = _FILE_HEADER.unpack_from(data, 0)
+    if magic != BLOCK_MAGIC:
+        raise ValueError("Not a g-code block file")
+    sections = []  # type: List[str]
+    position = _FILE_HEADER.size
+    while position < len(data):
+        block_start = position
+        block_type, compression, size = _BLOCK_HEADER.unpack_from(data, position)
+        position += _BLOCK_HEADER.size
+        stored_size = size
+        if compression != COMPRESSION_NONE:
+            stored_size, = _COMPRESSED_SIZE.unpack_from(data, position)
+            position += _COMPRESSED_SIZE.size
+        encoding, = _BLOCK_PARAMETERS.unpack_from(data, position)
+        position += _BLOCK_PARAMETERS.size
+        block_data = data[position:position + stored_size]
+        position += stored_size
+        if checksum_type == BLOCK_CHECKSUM_CRC32:
+            checksum, = _CHECKSUM.unpack_from(data, position)
+            if checksum != zlib.crc32(data[block_start:position]):
+                raise ValueError("Checksum mismatch in the block at byte {position}".format(position = block_start))
+            position += _CHECKSUM.size
+        if block_type != BLOCK_TYPE_GCODE:
+            continue
+
+        if compression == COMPRESSION_DEFLATE:
+            block_data = zlib.decompress(block_data)
+        elif compression != COMPRESSION_NONE:
+            raise ValueError("Unsupported compression {compression}".format(compression = compression))
+        if encoding == ENCODING_MEATPACK:
+            sections.append(decodeMeatPack(MEATPACK_SIGNAL + bytes([MEATPACK_ENABLE_PACKING]) + block_data))
+        else:
+            sections.append(block_data.decode("utf-8"))
+    return "".join(sections)
+
+
+#   Restores the g-code from the output of any of the encoders.
+def decode(data: bytes) -> str:
+    if data.startswith(BLOCK_MAGIC):
+        return decodeBlocks(data)
+    if data.startswith(MEATPACK_SIGNAL):
+        return decodeMeatPack(data)
+    return data.decode("utf-8")
+
+
+#   Names of the output formats, for createEncoder.
+FORMATS = ("meatpack", "blocks", "blocks-meatpack")
+
+
+#   Creates the encoder of an output format. compress only applies to the block formats.
+def createEncoder(output_format: str, compress: bool = True, block_size: Optional[int] = None) -> GCodeEncoder:
+    if output_format == "meatpack":
+        return MeatPackEncoder()
+    if output_format in ("blocks", "blocks-meatpack"):
+        return BlockEncoder(compress = compress, meatpack = output_format == "blocks-meatpack", block_size = block_size or 65536)
+    raise ValueError("Unknown output format {output_format}, available formats are {formats}".format(output_format = output_format, formats = ", ".join(FORMATS)))
@@ -0,0 +1,92 @@
+# Copyright (c) 2020 Louis Wouters
+# The PostProcessingPlugin is released under the terms of the AGPLv3 or higher.
+from typing import Any, Dict, Optional
+
+from .GCodeParser import toNumber
+
+#   Words are written in this order, followed by any other words in the order they were added.
+_WORD_ORDER = ("G", "M", "T", "S", "F", "X", "Y", "Z", "E")
+
+
+#   A line of g-code that is parsed once, can be modified any number of times and is serialized once.
+#
+#   The values of the words are kept as the text they were parsed from until they are replaced, so words that are not
+#   modified are written back exactly as they were read. Numbers that are put in are written with str(), unless a
+#   number of decimals is configured for their letter, e.g. decimals = {"E": 5} writes E as "E1.23450".
+class GCodeLine:
+    __slots__ = ("_words", "comment", "_decimals")
+
+    #   \param words Dict of letter -> value. The line takes ownership of the dict.
+    #   \param comment The comment of the line, including the ";".
+    #   \param decimals Dict of letter -> number of decimals to write numbers of that letter with.
+    def __init__(self, words: Optional[Dict[str, Any]] = None, comment: str = "", decimals: Optional[Dict[str, int]] = None) -> None:
+        self._words = words if words is not None else {}  # type: Dict[str, Any]
+        self.comment = comment
+        self._decimals = decimals
+
+    #   Parses a line of g-code.
+    #   \param words Values that take precedence over the values in the line, e.g. the keyword parameters of
+    #   Script.putValue. The line takes ownership of the dict.
+    @classmethod
+    def parse(cls, line: str, words: Optional[Dict[str, Any]] = None, decimals: Optional[Dict[str, int]] = None) -> "GCodeLine":
+        if words is None:
+            words = {}
+        comment = ""
+        comment_start = line.find(";")
+        if comment_start != -1:
+            comment = line[comment_start:]
+            line = line[:comment_start]  # Strip the comment.
+
+        for part in line.split(" "):
+            if part == "":
+                continue
+            parameter = part[0]
+            if parameter not in words:
+                words[parameter] = part[1:]
+        return cls(words, comment, decimals)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._words
+
+    #   Returns the value of a word as a number, or the default if the line doesn't have it.
+    def get(self, key: str, default = None) -> Any:
+        value = self._words.get(key)
+        if value is None:
+            return default
+        if isinstance(value, str):
+            return toNumber(value, default)
+        return value
+
+    def set(self, key: str, value: Any) -> None:
+        self._words[key] = value
+
+    def remove(self, key: str) -> None:
+        self._words.pop(key, None)
+
+    #   Produces the line of g-code.
+    def serialize(self) -> str:
+        words = self._words
+        line_parts = []
+        # First add these parameters in order
+        for parameter in _WORD_ORDER:
+            if parameter in words:
+                line_parts.append(parameter + self._formatValue(parameter, words[parameter]))
+        # Then add the rest of the parameters
+        for parameter, value in words.items():
+            if parameter not in _WORD_ORDER:
+                line_parts.append(parameter + self._formatValue(parameter, value))
+
+        # If there was a comment, put it back in.
+        if self.comment != "":
+            line_parts.append(self.comment)
+        return " ".join(line_parts)
+
+    def _formatValue(self, parameter: str, value: Any) -> str:
+        if isinstance(value, str):
+            return value
+        if self._decimals is not None and parameter in self._decimals and isinstance(value, (int, float)) and not isinstance(value, bool):
+            return "{:.{}f}".format(value, self._decimals[parameter])
+        return str(value)
+
+    def __str__(self) -> str:
+        return self.serialize()
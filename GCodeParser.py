@@ -0,0 +1,65 @@
+# Copyright (c) 2020 Louis Wouters
+# The PostProcessingPlugin is released under the terms of the AGPLv3 or higher.
+import re
+from typing import Any, Dict, Pattern, Tuple
+
+#   A word of g-code is a letter followed by a number, e.g. "X100" or "E-0.5".
+#   The letter must not be part of a longer word, so the "t" in "M117 Print10" is not a word.
+_NUMBER = "(-?[0-9]+\\.?[0-9]*)"
+_WORD_PATTERN = re.compile("(?<![A-Za-z])([A-Za-z])" + _NUMBER)
+
+#   Precompiled patterns to find a single word, per letter.
+_word_patterns = {}  # type: Dict[str, Pattern[str]]
+
+
+def _getWordPattern(key: str) -> Pattern[str]:
+    pattern = _word_patterns.get(key)
+    if pattern is None:
+        pattern = re.compile("(?<![A-Za-z])" + re.escape(key) + _NUMBER)
+        _word_patterns[key] = pattern
+    return pattern
+
+
+#   Position where the code of a line ends, i.e. where the comment starts.
+def _codeEnd(line: str) -> int:
+    end = line.find(";")
+    return end if end != -1 else len(line)
+
+
+#   Converts the number of a word to an int if possible and to a float otherwise.
+#   Text with a decimal point can never be an int, so it is converted to a float right away.
+def toNumber(text: str, default = None) -> Any:
+    try:
+        return float(text) if "." in text else int(text)
+    except ValueError:  # Not a plain number, but it may still be a float such as "1e3".
+        try:
+            return float(text)
+        except ValueError:  # Not a number at all.
+            return default
+
+
+#   Parses the words of a line of g-code into a dict of letter -> number text, ignoring the comment.
+#   If a letter occurs more than once, the first word is used.
+#   When parsing "G1 X100 E0.5 ; comment" this returns {"G": "1", "X": "100", "E": "0.5"}.
+def parseWords(line: str) -> Dict[str, str]:
+    # The dict is built from the last word to the first, so the first word of a letter wins.
+    return dict(reversed(_WORD_PATTERN.findall(line, 0, _codeEnd(line))))
+
+
+#   Finds the value of a single word in a line of g-code.
+#   When requesting key = X from line "G1 X100" the value 100 is returned.
+def getValue(line: str, key: str, default = None) -> Any:
+    if key not in line:
+        return default
+    pattern = _word_patterns.get(key) or _getWordPattern(key)
+    match = pattern.search(line, 0, _codeEnd(line))
+    if match is None:
+        return default
+    return toNumber(match.group(1), default)
+
+
+#   Finds the values of several words in a line of g-code, parsing the line only once.
+#   When requesting keys = "XYE" from line "G1 X100 E0.5" the tuple (100, None, 0.5) is returned.
+def getValues(line: str, keys: str, default = None) -> Tuple[Any, ...]:
+    words = parseWords(line)
+    return tuple([toNumber(words[key], default) if key in words else default for key in keys])
@@ -0,0 +1,101 @@
+# Copyright (c) 2020 Louis Wouters
+# The PostProcessingPlugin is released under the terms of the AGPLv3 or higher.
+import hashlib
+import pickle
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional, Tuple, TYPE_CHECKING
+
+from .SectionEdit import SectionEdit
+
+if TYPE_CHECKING:
+    from .Script import Script
+
+#   (context key, layer counter, text of the layer before processing)
+LayerKey = Tuple[Hashable, int, str]
+
+
+#   Cache of the layers processed by layer-local scripts, so post-processing the same g-code again only processes
+#   the layers that changed.
+#
+#   The output of a layer-local script only depends on the layer counter, the text of the layer and the context of
+#   the script (see Script.getLayerContext), which holds its settings. A layer is looked up by its text itself rather
+#   than by a digest of it: the hash of the text is computed once per string and a hit is confirmed by comparing the
+#   text, so two different layers are never mixed up. The context is reduced to a digest once per run.
+#   The cache holds at most max_bytes characters of layer text; the least recently used layers are evicted first.
+#   Changing a setting of a script changes its context, so that script processes all layers again, but scripts that
+#   run before it and layers that come out of it unchanged are still served from the cache. A setting that changes
+#   the output of every layer, such as the speed factor of ShowProgress, therefore saves nothing for that script.
+#   Scripts with layer hooks, such as ChangeTemperatureDuringPrint, are never cached; when one of them changes a
+#   single layer, the layer-local scripts after it only process that layer again.
+#   Enable the cache with Script.setLayerCache or the environment variable CURA_POST_PROCESSING_LAYER_CACHE.
+class LayerCache:
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024) -> None:
+        self._max_bytes = max_bytes
+        self._entries = OrderedDict()  # type: OrderedDict[LayerKey, str]
+        self._size = 0
+        self._hit_count = 0
+        self._miss_count = 0
+
+    #   Returns a key for the context of a script, or None if the context can't be pickled, in which case the layers
+    #   of the script are not cached.
+    @staticmethod
+    def getContextKey(script: "Script", context: Dict[str, Any]) -> Optional[Hashable]:
+        try:
+            digest = hashlib.sha1(pickle.dumps(context)).digest()
+        except (pickle.PicklingError, AttributeError, TypeError):
+            return None
+        process_layer = type(script).processLayer
+        return process_layer.__module__, process_layer.__qualname__, digest
+
+    def get(self, context_key: Hashable, layer_counter: int, text: str) -> Optional[str]:
+        key = (context_key, layer_counter, text)
+        output = self._entries.get(key)
+        if output is None:
+            self._miss_count += 1
+            return None
+        self._entries.move_to_end(key)
+        self._hit_count += 1
+        return output
+
+    def put(self, context_key: Hashable, layer_counter: int, text: str, output: str) -> None:
+        key = (context_key, layer_counter, text)
+        if key in self._entries:
+            return
+        size = LayerCache._entrySize(text, output)
+        if size > self._max_bytes:
+            return
+        self._entries[key] = output
+        self._size += size
+        while self._size > self._max_bytes:
+            (_, _, evicted_text), evicted_output = self._entries.popitem(last = False)
+            self._size -= LayerCache._entrySize(evicted_text, evicted_output)
+
+    #   Processes a layer of a layer-local script, or takes the result from the cache.
+    def processLayer(self, script: "Script", context_key: Optional[Hashable], layer_counter: int, layer: SectionEdit, context: Dict[str, Any]) -> None:
+        if context_key is None:
+            script.processLayer(layer_counter, layer, context)
+            return
+        text = layer.getText()
+        output = self.get(context_key, layer_counter, text)
+        if output is not None:
+            layer.setText(output)
+            return
+        script.processLayer(layer_counter, layer, context)
+        self.put(context_key, layer_counter, text, layer.getText())
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._size = 0
+
+    def getSize(self) -> int:
+        return self._size
+
+    def getHitCount(self) -> int:
+        return self._hit_count
+
+    def getMissCount(self) -> int:
+        return self._miss_count
+
+    @staticmethod
+    def _entrySize(text: str, output: str) -> int:
+        return len(text) if output is text else len(text) + len(output)
@@ -0,0 +1,94 @@
+# Copyright (c) 2020 Louis Wouters
+# The PostProcessingPlugin is released under the terms of the AGPLv3 or higher.
+from array import array
+from typing import Iterator, List, Optional
+
+from .LineView import LineView
+
+_LAYER_PREFIX = ";LAYER:"
+_LAYER_COUNT_PREFIX = ";LAYER_COUNT:"
+_TIME_PREFIX = ";TIME:"
+_TIME_ELAPSED_PREFIX = ";TIME_ELAPSED:"
+
+
+#   Index of the g-code data list that is built in a single pass and shared by all scripts in the chain.
+#
+#   It holds everything the scripts used to look up for themselves: the index of the first layer section, the
+#   layer count and the total time from the start code, the index of every layer section in the data list and
+#   the ;TIME_ELAPSED: value at the end of every layer.
+#   The ;TIME_ELAPSED: values form a cumulative table of doubles: layers without a ;TIME_ELAPSED: comment carry the
+#   value of the previous layer (0 for the first layer), so the table never decreases and can be searched with bisect.
+class LayerIndex:
+    def __init__(self) -> None:
+        self.first_layer_index = 0
+        self.layer_count = 0
+        self.time_total = 0
+        self.layer_offsets = []  # type: List[int]
+        self.time_elapsed = array("d")
+
+        self._section_count = 0
+        self._found_first_layer = False
+        self._data = None  # type: Optional[List[str]]
+
+    #   Builds the index of a complete data list.
+    @classmethod
+    def build(cls, data: List[str]) -> "LayerIndex":
+        index = cls()
+        for section in data:
+            index.observe(section)
+        index._data = data
+        return index
+
+    #   Adds the next section of the data list to the index.
+    def observe(self, section: str) -> None:
+        section_index = self._section_count
+        self._section_count += 1
+
+        if LayerIndex.isLayer(section):
+            if not self._found_first_layer:
+                self.first_layer_index = section_index
+                self._found_first_layer = True
+            previous_time_elapsed = self.time_elapsed[-1] if self.time_elapsed else 0.0
+            self.layer_offsets.append(section_index)
+            self.time_elapsed.append(_findTimeElapsed(section, previous_time_elapsed))
+        elif not self._found_first_layer:
+            # Only the start code contains the layer count and the total time. The last one of each counts.
+            lines = LineView(section)
+            layer_count_line = lines.lastStartingWith(_LAYER_COUNT_PREFIX)
+            if layer_count_line is not None:
+                self.layer_count = int(layer_count_line.split(":")[1])
+            time_line = lines.lastStartingWith(_TIME_PREFIX)
+            if time_line is not None:
+                self.time_total = int(time_line.split(":")[1])
+
+    #   Whether a section of the data list is a layer.
+    @staticmethod
+    def isLayer(section: str) -> bool:
+        return section.startswith(_LAYER_PREFIX)
+
+    #   Whether the index was built from a complete data list, rather than while streaming.
+    def isComplete(self) -> bool:
+        return self._data is not None
+
+    #   The layer sections of the data list the index was built from, in order. Empty while streaming.
+    def getLayers(self) -> Iterator[str]:
+        if self._data is None:
+            return iter(())
+        return (self._data[offset] for offset in self.layer_offsets)
+
+    #   Number of sections that have been observed.
+    @property
+    def section_count(self) -> int:
+        return self._section_count
+
+    #   Whether this index was built from (the current state of) the given data list.
+    def describes(self, data: List[str]) -> bool:
+        return self._data is data and len(data) == self._section_count
+
+
+#   Finds the value of the last ;TIME_ELAPSED: comment of a layer, searching from the end of the layer.
+def _findTimeElapsed(section: str, default: float) -> float:
+    line = LineView(section).lastStartingWith(_TIME_ELAPSED_PREFIX)
+    if line is None:
+        return default
+    return float(line.split(":")[1])
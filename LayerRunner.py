@@ -0,0 +1,136 @@
+# Copyright (c) 2020 Louis Wouters
+# The PostProcessingPlugin is released under the terms of the AGPLv3 or higher.
+import multiprocessing
+import os
+import pickle
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Dict, List, Optional, TYPE_CHECKING
+
+from UM.Logger import Logger
+
+from .ScriptPipeline import ScriptPipeline
+from .SectionEdit import SectionEdit
+
+if TYPE_CHECKING:
+    from .Script import Script
+
+#   processLayer and context of the script that the worker process is running, set by _initializeWorker.
+_worker_process_layer = None  # type: Optional[Callable[[int, SectionEdit, Dict[str, Any]], None]]
+_worker_context = None  # type: Optional[Dict[str, Any]]
+
+
+def _initializeWorker(process_layer: Callable[[int, SectionEdit, Dict[str, Any]], None], context: Dict[str, Any]) -> None:
+    global _worker_process_layer, _worker_context
+    _worker_process_layer = process_layer
+    _worker_context = context
+
+
+def _processChunk(layer_counters: List[int], layers: List[str]) -> List[str]:
+    processed = []
+    for layer_counter, layer in zip(layer_counters, layers):
+        layer_edit = SectionEdit(layer)
+        _worker_process_layer(layer_counter, layer_edit, _worker_context)
+        processed.append(layer_edit.getText())
+    return processed
+
+
+#   Runs scripts over the layers of a g-code data list, spreading the layers of layer-local scripts over a pool of
+#   worker processes.
+#
+#   The layers are sent to the workers in chunks of consecutive layers and written back into the data list in order,
+#   so the result is the same as that of Script.execute. The context of the script is sent to every worker once.
+#   Scripts that are not layer-local, prints with too few layers to be worth it and scripts or contexts that can't be
+#   sent to another process are executed serially.
+#   With the layer cache of Script.setLayerCache, only the layers that aren't in the cache are sent to the workers.
+#
+#   The workers are forked where the platform can, so they have the plugin package already. A new worker process (the
+#   spawn start method, the only one on Windows) has to import the functions of this module, from the package the
+#   plugin was loaded as. Programs that load the plugin under a name of their own, like the headless runner, must
+#   load it when their main module is imported, since the workers import the main module first. If the workers can't
+#   be started, the layers are processed serially and a warning is logged.
+class LayerRunner:
+    #   \param workers Number of worker processes, by default the number of CPUs. 1 or less executes serially.
+    #   \param chunk_size Number of layers that is sent to a worker at once.
+    #   \param minimum_chunks Minimum number of chunks for the print to be processed in parallel.
+    #   \param start_method Start method of the worker processes, by default fork if the platform has it.
+    def __init__(self, workers: Optional[int] = None, chunk_size: int = 64, minimum_chunks: int = 2, start_method: Optional[str] = None) -> None:
+        self._workers = workers if workers is not None else (os.cpu_count() or 1)
+        self._chunk_size = max(1, chunk_size)
+        self._minimum_chunks = minimum_chunks
+        if start_method is None and "fork" in multiprocessing.get_all_start_methods():
+            start_method = "fork"
+        self._start_method = start_method
+
+    def getWorkers(self) -> int:
+        return self._workers
+
+    #   Executes a chain of scripts over the data list in order and returns the (modified) list.
+    #   The layers of layer-local scripts are processed in parallel, one script after another. The other scripts in
+    #   between are fused into a ScriptPipeline, so they still take a single pass over the layers together.
+    def runScripts(self, scripts: List["Script"], data: List[str]) -> List[str]:
+        fused = []  # type: List[Script]
+        for script in scripts:
+            if self._workers <= 1 or not script.isLayerLocal():
+                fused.append(script)
+                continue
+            if fused:
+                ScriptPipeline(fused).execute(data)
+                fused = []
+            self.run(script, data)
+        if fused:
+            ScriptPipeline(fused).execute(data)
+        return data
+
+    #   Executes a script over the data list and returns the (modified) list.
+    def run(self, script: "Script", data: List[str]) -> List[str]:
+        if self._workers <= 1 or not script.isLayerLocal():
+            return script.execute(data)
+
+        index = script.getLayerIndex(data)
+        layer_offsets = index.layer_offsets[:index.layer_count]
+        if len(layer_offsets) < self._chunk_size * self._minimum_chunks:
+            return script.execute(data)
+
+        process_layer = type(script).processLayer
+        context = script.getLayerContext(index)
+        try:
+            pickle.dumps((process_layer, context))
+        except (pickle.PicklingError, AttributeError, TypeError):  # E.g. a script that was loaded under another name.
+            return script.execute(data)
+
+        layer_cache = script.getLayerCache()
+        context_key = layer_cache.getContextKey(script, context) if layer_cache is not None else None
+        outputs = {}  # type: Dict[int, str]
+        if context_key is not None:
+            for layer_counter, layer_index in enumerate(layer_offsets):
+                output = layer_cache.get(context_key, layer_counter, data[layer_index])
+                if output is not None:
+                    outputs[layer_counter] = output
+        layer_counters = [layer_counter for layer_counter in range(len(layer_offsets)) if layer_counter not in outputs]
+
+        chunks = [layer_counters[start:start + self._chunk_size] for start in range(0, len(layer_counters), self._chunk_size)]
+        if len(chunks) < self._minimum_chunks:  # Too few layers left to process to be worth the workers.
+            processed = []
+            for layer_counter in layer_counters:
+                layer_edit = SectionEdit(data[layer_offsets[layer_counter]])
+                process_layer(layer_counter, layer_edit, context)
+                processed.append(layer_edit.getText())
+        else:
+            try:
+                pool_context = multiprocessing.get_context(self._start_method)
+                with ProcessPoolExecutor(max_workers = self._workers, mp_context = pool_context, initializer = _initializeWorker, initargs = (process_layer, context)) as pool:
+                    futures = [pool.submit(_processChunk, chunk, [data[layer_offsets[layer_counter]] for layer_counter in chunk]) for chunk in chunks]
+                    # Wait for all chunks before writing anything back, so a failing pool leaves the data untouched.
+                    processed = [layer for future in futures for layer in future.result()]
+            except (BrokenProcessPool, OSError) as e:  # No processes available, or they can't import the plugin.
+                Logger.log("w", "Can't process the layers of %s in worker processes, processing them serially: %s", type(script).__name__, e)
+                return script.execute(data)
+
+        for layer_counter, layer in zip(layer_counters, processed):
+            if context_key is not None:
+                layer_cache.put(context_key, layer_counter, data[layer_offsets[layer_counter]], layer)
+            outputs[layer_counter] = layer
+        for layer_counter, layer in outputs.items():
+            data[layer_offsets[layer_counter]] = layer
+        return data
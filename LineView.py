@@ -0,0 +1,112 @@
+# Copyright (c) 2020 Louis Wouters
+# The PostProcessingPlugin is released under the terms of the AGPLv3 or higher.
+from array import array
+from typing import Any, Iterator, Optional, Tuple, Union
+
+
+#   Lazy, read-only view of the lines of a section of g-code.
+#
+#   The lines are found with str.find and str.rfind when they are needed, instead of splitting the whole section into
+#   a list up front. Only the lines that are actually read are copied, so looking for a few lines in a large layer, or
+#   reading it from the end, allocates next to nothing. The lines are the same as those of section.split("\n").
+#   The start offsets of the lines are remembered as far as they were indexed, so indexing forward is cheap too.
+class LineView:
+    __slots__ = ("_text", "_starts", "_complete")
+
+    def __init__(self, text: str) -> None:
+        self._text = text
+        self._starts = array("l", [0])  # Start offsets of the lines that were indexed so far.
+        self._complete = False
+
+    def getText(self) -> str:
+        return self._text
+
+    def __len__(self) -> int:
+        return self._text.count("\n") + 1
+
+    def __iter__(self) -> Iterator[str]:
+        text = self._text
+        start = 0
+        while True:
+            end = text.find("\n", start)
+            if end == -1:
+                yield text[start:]
+                return
+            yield text[start:end]
+            start = end + 1
+
+    def __reversed__(self) -> Iterator[str]:
+        text = self._text
+        end = len(text)
+        while True:
+            start = text.rfind("\n", 0, end)
+            yield text[start + 1:end]
+            if start == -1:
+                return
+            end = start
+
+    #   A line, or a list of lines for a slice.
+    def __getitem__(self, index: Union[int, slice]) -> Any:
+        if isinstance(index, slice):
+            return [self[line_index] for line_index in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        start = self._getStart(index)
+        if start is None:
+            raise IndexError("line index out of range")
+        end = self._text.find("\n", start)
+        return self._text[start:end] if end != -1 else self._text[start:]
+
+    #   Offset of the start of a line, or None if there are fewer lines.
+    def _getStart(self, index: int) -> Optional[int]:
+        if index < 0:
+            return None
+        starts = self._starts
+        while len(starts) <= index and not self._complete:
+            end = self._text.find("\n", starts[-1])
+            if end == -1:
+                self._complete = True
+            else:
+                starts.append(end + 1)
+        return starts[index] if index < len(starts) else None
+
+    #   Offset of the start of the line after the one that contains position, or the length of the text if that is
+    #   the last line.
+    def getNextLineStart(self, position: int) -> int:
+        end = self._text.find("\n", position)
+        return end + 1 if end != -1 else len(self._text)
+
+    #   Lines that start with a prefix, with the offset at which they start, front to back.
+    #   Lines that don't match are never copied.
+    def startingWith(self, prefix: str, start: int = 0) -> Iterator[Tuple[int, str]]:
+        text = self._text
+        if start == 0 and text.startswith(prefix):
+            position = 0
+        else:
+            position = text.find("\n" + prefix, max(0, start - 1))
+            position = position + 1 if position != -1 else -1
+        while position != -1:
+            end = text.find("\n", position)
+            yield position, text[position:end] if end != -1 else text[position:]
+            if end == -1:
+                return
+            position = text.find("\n" + prefix, end)
+            position = position + 1 if position != -1 else -1
+
+    def firstStartingWith(self, prefix: str) -> Optional[str]:
+        for _, line in self.startingWith(prefix):
+            return line
+        return None
+
+    #   The last line that starts with a prefix, found from the end of the text.
+    def lastStartingWith(self, prefix: str) -> Optional[str]:
+        text = self._text
+        position = text.rfind("\n" + prefix)
+        if position != -1:
+            position += 1
+        elif text.startswith(prefix):
+            position = 0
+        else:
+            return None
+        end = text.find("\n", position)
+        return text[position:end] if end != -1 else text[position:]
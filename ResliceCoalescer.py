@@ -0,0 +1,90 @@
+# Copyright (c) 2020 Louis Wouters
+# The PostProcessingPlugin is released under the terms of the AGPLv3 or higher.
+from typing import Any, Callable, Dict, Optional
+
+try:
+    from PyQt6.QtCore import QCoreApplication, QTimer
+except ImportError:
+    try:
+        from PyQt5.QtCore import QCoreApplication, QTimer
+    except ImportError:  # Headless, without an event loop to run a timer on.
+        QCoreApplication = None
+        QTimer = None
+
+_NO_VALUE = object()
+
+
+#   Coalesces bursts of setting changes into a single reslice trigger.
+#
+#   Every change restarts a single-shot timer of `window` seconds on the event loop of the application. When the timer
+#   runs out, the trigger is called once for the whole burst, unless every setting in the burst is back at the value it
+#   had when the last reslice was triggered. Changes that don't result in a trigger of their own are counted as
+#   suppressed. The settings change on the main thread, which runs the event loop, so the trigger is called there too.
+#   The timer is created on the first change and reused for every burst after it. Without an event loop (headless)
+#   every burst ends right away.
+class ResliceCoalescer:
+    #   \param trigger Function that triggers a reslice, called with the key of the last changed setting.
+    #   \param window Number of seconds without changes that ends a burst. 0 or less triggers right away.
+    def __init__(self, trigger: Callable[[str], None], window: float = 0.3) -> None:
+        self._trigger = trigger
+        self._window = window
+        self._timer = None  # type: Optional[QTimer]
+        self._pending = {}  # type: Dict[str, Any]
+        self._pending_changes = 0
+        self._last_key = ""
+        self._applied = {}  # type: Dict[str, Any]
+        self._emitted_count = 0
+        self._suppressed_count = 0
+
+    def getWindow(self) -> float:
+        return self._window
+
+    def setWindow(self, window: float) -> None:
+        self._window = window
+
+    #   Number of reslices that were triggered.
+    def getEmittedCount(self) -> int:
+        return self._emitted_count
+
+    #   Number of changes that didn't trigger a reslice of their own.
+    def getSuppressedCount(self) -> int:
+        return self._suppressed_count
+
+    #   Sets the values the g-code was last sliced with, e.g. the values of the settings after initialization.
+    def setAppliedValues(self, values: Dict[str, Any]) -> None:
+        self._applied.update(values)
+
+    def valueChanged(self, key: str, value: Any) -> None:
+        self._pending[key] = value
+        self._pending_changes += 1
+        self._last_key = key
+        timer = self._getTimer()
+        if timer is None:
+            self.flush()
+        else:
+            timer.start(int(self._window * 1000))  # Restarts the timer if it is running.
+
+    #   Ends the current burst right away.
+    def flush(self) -> None:
+        if self._timer is not None:
+            self._timer.stop()
+        pending, self._pending = self._pending, {}
+        changes, self._pending_changes = self._pending_changes, 0
+        changed = {key: value for key, value in pending.items() if self._applied.get(key, _NO_VALUE) != value}
+        self._applied.update(changed)
+        if not changed:
+            self._suppressed_count += changes
+        else:
+            self._emitted_count += 1
+            self._suppressed_count += changes - 1
+            self._trigger(self._last_key if self._last_key in changed else next(iter(changed)))
+
+    #   The timer that ends a burst, or None if bursts end right away.
+    def _getTimer(self) -> Optional[QTimer]:
+        if self._window <= 0 or QTimer is None or QCoreApplication.instance() is None:
+            return None
+        if self._timer is None:
+            self._timer = QTimer()
+            self._timer.setSingleShot(True)
+            self._timer.timeout.connect(self.flush)
+        return self._timer
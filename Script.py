@@ -1,8 +1,9 @@
 # Copyright (c) 2015 Jaime van Kessel
 # Copyright (c) 2018 Ultimaker B.V.
 # The PostProcessingPlugin is released under the terms of the AGPLv3 or higher.
-from typing import Optional, Any, Dict, TYPE_CHECKING, List
+from typing import Optional, Any, Dict, TYPE_CHECKING, Iterable, Iterator, List, Tuple
 
+from UM.Logger import Logger
 from UM.Signal import Signal, signalemitter
 from UM.i18n import i18nCatalog
 
@@ -14,23 +15,104 @@ from UM.Settings.InstanceContainer import InstanceContainer
 from UM.Settings.DefinitionContainer import DefinitionContainer
 from UM.Settings.ContainerRegistry import ContainerRegistry
 
-import re
 import json
 import collections
+import functools
+import os
+
+from . import GCodeParser
+from .GCodeLine import GCodeLine
+from .LayerCache import LayerCache
+from .LayerIndex import LayerIndex
+from .ResliceCoalescer import ResliceCoalescer
+from .ScriptPipeline import ScriptPipeline
+from .ScriptProfiler import ScriptProfiler
+from . import SectionEdit as SectionEditModule
+from .SectionEdit import SectionEdit
+
 i18n_catalog = i18nCatalog("cura")
 
 if TYPE_CHECKING:
     from UM.Settings.Interfaces import DefinitionContainerInterface
 
 
+#   Wraps the execute of a script, so it is measured by the profiler of Script.setProfiler when one is set.
+#   Scripts that call the execute of their base class are measured once, as a whole.
+#   Afterwards the shared layer index is released once the chain of scripts is done, see releaseLayerIndexLater.
+def _profiledExecute(execute):
+    @functools.wraps(execute)
+    def profiledExecute(self, data):
+        try:
+            profiler = Script._profiler
+            if profiler is None or profiler.isMeasuring():
+                return execute(self, data)
+            result, statistics = profiler.profile(self, execute, data)
+            self.executionProfiled.emit(self, statistics)
+            return result
+        finally:
+            Script.releaseLayerIndexLater()
+    return profiledExecute
+
+
+#   Profiler that is set when Script is loaded if the environment asks for it, so scripts can be profiled in Cura too:
+#   CURA_POST_PROCESSING_PROFILE is the file the statistics are appended to and the optional
+#   CURA_POST_PROCESSING_CPROFILE_DIR the directory for a cProfile dump of every run.
+def _profilerFromEnvironment() -> Optional[ScriptProfiler]:
+    log_file = os.environ.get("CURA_POST_PROCESSING_PROFILE")
+    if not log_file:
+        return None
+    return ScriptProfiler(log_file, os.environ.get("CURA_POST_PROCESSING_CPROFILE_DIR") or None)
+
+
+#   Layer cache that is set when Script is loaded if the environment asks for it: CURA_POST_PROCESSING_LAYER_CACHE is
+#   the size of the cache in MB. The cache only pays off when the same g-code is post-processed again, as Cura does
+#   after every change of a setting of a script.
+def _layerCacheFromEnvironment() -> Optional[LayerCache]:
+    size = os.environ.get("CURA_POST_PROCESSING_LAYER_CACHE")
+    if not size:
+        return None
+    try:
+        max_bytes = int(float(size) * 1024 * 1024)
+    except ValueError:
+        Logger.log("w", "Ignoring CURA_POST_PROCESSING_LAYER_CACHE=%s, it must be a size in MB", size)
+        return None
+    return LayerCache(max_bytes) if max_bytes > 0 else None
+
+
 #  Base class for scripts. All scripts should inherit the script class.
 @signalemitter
 class Script:
+    #   Layer index of the data list that is currently being processed, shared by all scripts in the chain.
+    #   It refers to the data list, so it is released when the chain is done, see releaseLayerIndexLater.
+    _layer_index = None  # type: Optional[LayerIndex]
+
+    #   Parsed setting data per setting data string and definitions per (script key, version), shared by all
+    #   instances so adding a script doesn't parse its settings again. See clearSettingCaches.
+    _setting_data_cache = {}  # type: Dict[str, Dict[str, Any]]
+    _definition_cache = {}  # type: Dict[Tuple[str, int], DefinitionContainerInterface]
+
+    #   Number of seconds without setting changes after which a reslice is triggered.
+    reslice_window = 0.3
+
+    #   Profiler that measures every execute of every script, None (the default) to not measure anything.
+    _profiler = _profilerFromEnvironment()  # type: Optional[ScriptProfiler]
+
+    #   Cache of the layers processed by layer-local scripts, None (the default) to process all layers every time.
+    _layer_cache = _layerCacheFromEnvironment()  # type: Optional[LayerCache]
+
+    #   The execute of every script is wrapped, including that of scripts that override it.
+    def __init_subclass__(cls, **kwargs: Any) -> None:
+        super().__init_subclass__(**kwargs)
+        if "execute" in cls.__dict__:
+            cls.execute = _profiledExecute(cls.__dict__["execute"])
+
     def __init__(self) -> None:
         super().__init__()
         self._stack = None  # type: Optional[ContainerStack]
         self._definition = None  # type: Optional[DefinitionContainerInterface]
         self._instance = None  # type: Optional[InstanceContainer]
+        self._setting_value_cache = {}  # type: Dict[str, Any]
+        self._reslice_coalescer = ResliceCoalescer(self._triggerReslice, Script.reslice_window)
 
     def initialize(self) -> None:
         setting_data = self.getSettingData()
@@ -39,18 +121,22 @@ class Script:
 
         #  Check if the definition of this script already exists. If not, add it to the registry.
         if "key" in setting_data:
-            definitions = ContainerRegistry.getInstance().findDefinitionContainers(id=setting_data["key"])
-            if definitions:
-                # Definition was found
-                self._definition = definitions[0]
-            else:
-                self._definition = DefinitionContainer(setting_data["key"])
-                try:
-                    self._definition.deserialize(json.dumps(setting_data))
-                    ContainerRegistry.getInstance().addContainer(self._definition)
-                except ContainerFormatError:
-                    self._definition = None
-                    return
+            definition_key = (setting_data["key"], setting_data.get("version", 0))
+            self._definition = Script._definition_cache.get(definition_key)
+            if self._definition is None:
+                definitions = ContainerRegistry.getInstance().findDefinitionContainers(id=setting_data["key"])
+                if definitions:
+                    # Definition was found
+                    self._definition = definitions[0]
+                else:
+                    self._definition = DefinitionContainer(setting_data["key"])
+                    try:
+                        self._definition.deserialize(json.dumps(setting_data))
+                        ContainerRegistry.getInstance().addContainer(self._definition)
+                    except ContainerFormatError:
+                        self._definition = None
+                        return
+                Script._definition_cache[definition_key] = self._definition
         if self._definition is None:
             return
         self._stack.addContainer(self._definition)
@@ -60,23 +146,54 @@ class Script:
                                         self._definition.getMetaDataEntry("setting_version", default=0))
         self._stack.addContainer(self._instance)
         self._stack.propertyChanged.connect(self._onPropertyChanged)
+        self._reslice_coalescer.setAppliedValues({key: self._stack.getProperty(key, "value") for key in setting_data.get("settings", {})})
 
         ContainerRegistry.getInstance().addContainer(self._stack)
 
     settingsLoaded = Signal()
     valueChanged = Signal()  # Signal emitted whenever a value of a setting is changed
+    executionProfiled = Signal()  # Signal emitted with the script and the statistics of every profiled execute
+
+    #   Enables profiling of every execute of every script and every stage of a streaming ScriptPipeline, or disables
+    #   it with None.
+    @staticmethod
+    def setProfiler(profiler: Optional[ScriptProfiler]) -> None:
+        Script._profiler = profiler
+
+    @staticmethod
+    def getProfiler() -> Optional[ScriptProfiler]:
+        return Script._profiler
+
+    #   Enables the cache of processed layers for all layer-local scripts, or disables it with None.
+    @staticmethod
+    def setLayerCache(layer_cache: Optional[LayerCache]) -> None:
+        Script._layer_cache = layer_cache
+
+    @staticmethod
+    def getLayerCache() -> Optional[LayerCache]:
+        return Script._layer_cache
 
     def _onPropertyChanged(self, key: str, property_name: str) -> None:
         if property_name == "value":
+            # Other settings may depend on this one, so all cached values are discarded.
+            self._setting_value_cache.clear()
             self.valueChanged.emit()
 
             # Property changed: trigger reslice
-            # To do this we use the global container stack propertyChanged.
             # Re-slicing is necessary for setting changes in this plugin, because the changes
-            # are applied only once per "fresh" gcode
-            global_container_stack = Application.getInstance().getGlobalContainerStack()
-            if global_container_stack is not None:
-                global_container_stack.propertyChanged.emit(key, property_name)
+            # are applied only once per "fresh" gcode. Bursts of changes, e.g. while dragging a spin box,
+            # are coalesced into a single reslice.
+            self._reslice_coalescer.valueChanged(key, self.getSettingValueByKey(key))
+
+    #   To trigger a reslice we use the global container stack propertyChanged.
+    def _triggerReslice(self, key: str) -> None:
+        global_container_stack = Application.getInstance().getGlobalContainerStack()
+        if global_container_stack is not None:
+            global_container_stack.propertyChanged.emit(key, "value")
+
+    #   Returns the coalescer of reslice triggers, e.g. to read how many reslices were triggered and suppressed.
+    def getResliceCoalescer(self) -> ResliceCoalescer:
+        return self._reslice_coalescer
 
     #   Needs to return a dict that can be used to construct a settingcategory file.
     #   See the example script for an example.
@@ -84,11 +201,30 @@ class Script:
     #   Scripts can either override getSettingData directly, or use getSettingDataString
     #   to return a string that will be parsed as json. The latter has the benefit over
     #   returning a dict in that the order of settings is maintained.
+    #   The parsed string is cached, so the returned dict is shared between instances and must not be modified.
     def getSettingData(self) -> Dict[str, Any]:
         setting_data_as_string = self.getSettingDataString()
-        setting_data = json.loads(setting_data_as_string, object_pairs_hook = collections.OrderedDict)
+        setting_data = Script._setting_data_cache.get(setting_data_as_string)
+        if setting_data is None:
+            setting_data = json.loads(setting_data_as_string, object_pairs_hook = collections.OrderedDict)
+            Script._setting_data_cache[setting_data_as_string] = setting_data
         return setting_data
 
+    #   Discards the cached setting data and definitions, of all scripts or of the script with the given key.
+    #   Needed when definitions are removed from the container registry, or when setting data changes at runtime.
+    @staticmethod
+    def clearSettingCaches(key: Optional[str] = None) -> None:
+        if key is None:
+            Script._setting_data_cache.clear()
+            Script._definition_cache.clear()
+            return
+        for setting_data_as_string, setting_data in list(Script._setting_data_cache.items()):
+            if setting_data.get("key") == key:
+                del Script._setting_data_cache[setting_data_as_string]
+        for definition_key in list(Script._definition_cache):
+            if definition_key[0] == key:
+                del Script._definition_cache[definition_key]
+
     def getSettingDataString(self) -> str:
         raise NotImplementedError()
 
@@ -105,27 +241,27 @@ class Script:
         return None
 
     #   Convenience function that retrieves value of a setting from the stack.
+    #   Values are cached until a value in the stack changes.
     def getSettingValueByKey(self, key: str) -> Any:
-        if self._stack is not None:
-            return self._stack.getProperty(key, "value")
-        return None
+        if self._stack is None:
+            return None
+        try:
+            return self._setting_value_cache[key]
+        except KeyError:
+            value = self._stack.getProperty(key, "value")
+            self._setting_value_cache[key] = value
+            return value
 
     #   Convenience function that finds the value in a line of g-code.
     #   When requesting key = x from line "G1 X100" the value 100 is returned.
+    #   Only whole words of g-code are matched, so letters inside comments or texts are never picked up.
     def getValue(self, line: str, key: str, default = None) -> Any:
-        if key not in line or (';' in line and line.find(key) > line.find(';')):
-            return default
-        sub_part = line[line.find(key) + 1:]
-        m = re.search('^-?[0-9]+\.?[0-9]*', sub_part)
-        if m is None:
-            return default
-        try:
-            return int(m.group(0))
-        except ValueError:  # Not an integer.
-            try:
-                return float(m.group(0))
-            except ValueError:  # Not a number at all.
-                return default
+        return GCodeParser.getValue(line, key, default)
+
+    #   Convenience function that finds the values of several keys in a line of g-code, parsing it only once.
+    #   When requesting keys = "XYE" from line "G1 X100 E0.5" the tuple (100, None, 0.5) is returned.
+    def getValues(self, line: str, keys: str, default = None) -> Tuple[Any, ...]:
+        return GCodeParser.getValues(line, keys, default)
 
     #   Convenience function to produce a line of g-code.
     #
@@ -137,40 +273,121 @@ class Script:
     #   followed by any other parameters
     #   \param line The original g-code line that must be modified. If not provided, an entirely new g-code line will be produced.
     #   \return A line of g-code with the desired parameters filled in.
+    #   Scripts that modify many lines can use GCodeLine directly to avoid re-parsing a line for every change.
     def putValue(self, line: str = "", **kwargs) -> str:
-        # Strip the comment.
-        comment = ""
-        if ";" in line:
-            comment = line[line.find(";"):]
-            line = line[:line.find(";")]  # Strip the comment.
-
-        # Parse the original g-code line and add them to kwargs.
-        for part in line.split(" "):
-            if part == "":
-                continue
-            parameter = part[0]
-            if parameter not in kwargs:
-                value = part[1:]
-                kwargs[parameter] = value
-
-        # Start writing the new g-code line.
-        line_parts = list()
-        # First add these parameters in order
-        for parameter in ["G", "M", "T", "S", "F", "X", "Y", "Z", "E"]:
-            if parameter in kwargs:
-                line_parts.append(parameter + str(kwargs.pop(parameter)))
-        # Then add the rest of the parameters
-        for parameter, value in kwargs.items():
-            line_parts.append(parameter + str(value))
-
-        # If there was a comment, put it back in.
-        if comment != "":
-            line_parts.append(comment)
-
-        # Construct the new line
-        return " ".join(line_parts)
+        return GCodeLine.parse(line, kwargs).serialize()
+
+    #   Convenience functions to edit a layer (or any other section of g-code) without splitting it into lines.
+    #   They find the end of the first line once and build the new layer in a single copy.
+    #   Scripts that implement the layer hooks get the same operations on the SectionEdit they are handed.
+    @staticmethod
+    def replaceFirstLine(layer: str, line: str) -> str:
+        return SectionEditModule.replaceFirstLine(layer, line)
+
+    @staticmethod
+    def insertAfterFirstLine(layer: str, text: str) -> str:
+        return SectionEditModule.insertAfterFirstLine(layer, text)
+
+    @staticmethod
+    def appendToLayer(layer: str, text: str) -> str:
+        return SectionEditModule.appendToSection(layer, text)
+
+    #   Returns the layer index of the data list, building it only if no script has indexed this list yet.
+    #   The index stays valid while scripts modify the contents of sections, as long as they don't change the
+    #   structure of the layers. A change in the number of sections is detected automatically, but scripts that
+    #   rewrite ;LAYER:, ;LAYER_COUNT:, ;TIME: or ;TIME_ELAPSED: must call invalidateLayerIndex afterwards.
+    def getLayerIndex(self, data: List[str]) -> LayerIndex:
+        index = Script._layer_index
+        if index is None or not index.describes(data):
+            index = LayerIndex.build(data)
+            Script._layer_index = index
+        return index
+
+    #   Discards the shared layer index, so the next script rebuilds it.
+    @staticmethod
+    def invalidateLayerIndex() -> None:
+        Script._layer_index = None
+
+    #   Discards the shared layer index once the chain of scripts that is running has finished, so the index doesn't
+    #   keep the data list of the last print in memory. Cura runs all scripts of a chain in one go on the main thread,
+    #   so the index is shared by the whole chain and released when control returns to the event loop. Without an
+    #   event loop (headless) it is released right away. Every execute calls this when it returns.
+    @staticmethod
+    def releaseLayerIndexLater() -> None:
+        index = Script._layer_index
+        if index is not None:
+            Application.getInstance().callLater(Script._releaseLayerIndex, index)
+
+    @staticmethod
+    def _releaseLayerIndex(index: LayerIndex) -> None:
+        if Script._layer_index is index:  # Not when another chain has started in the meantime.
+            Script._layer_index = None
 
     #   This is called when the script is executed.
     #   It gets a list of g-code strings and needs to return a (modified) list.
+    #   Scripts that implement executeStream or the layer hooks don't need to override this: the sections are
+    #   streamed through executeStream and written back into the same list.
     def execute(self, data: List[str]) -> List[str]:
+        if type(self).executeStream is Script.executeStream and not self.hasLayerHooks():
+            raise NotImplementedError()
+        data[:] = list(self.executeStream(data))
+        return data
+
+    execute = _profiledExecute(execute)
+
+    #   Streaming counterpart of execute.
+    #   It gets the g-code sections one at a time and yields the (modified) sections, so only the section that is
+    #   being processed has to be in memory. Scripts with layer hooks are run by a ScriptPipeline of their own.
+    #   Scripts that only implement execute are adapted by collecting the sections in a list first.
+    def executeStream(self, sections: Iterable[str]) -> Iterator[str]:
+        if self.hasLayerHooks():
+            yield from ScriptPipeline([self]).executeStream(sections)
+            return
+
+        if type(self).execute is Script.execute:
+            raise NotImplementedError()
+        yield from self.execute(list(sections))
+
+    #   Whether the script implements the layer hooks (onHeader, onLayer and onFooter) or is layer-local, which
+    #   allows ScriptPipeline to run it in the same pass over the layers as other scripts.
+    def hasLayerHooks(self) -> bool:
+        script_type = type(self)
+        return self.isLayerLocal() or script_type.onHeader is not Script.onHeader \
+            or script_type.onLayer is not Script.onLayer or script_type.onFooter is not Script.onFooter
+
+    #   Whether the script needs all layers before it processes the first one, e.g. to look ahead. ScriptPipeline then
+    #   collects the sections of the stage of the script into a list instead of streaming them.
+    def requiresCompleteData(self) -> bool:
+        return False
+
+    #   Layer hook that is called once per pass with the sections before the first layer (the start code), before
+    #   any other hook. The sections can be edited in place.
+    def onHeader(self, sections: List[SectionEdit], index: LayerIndex) -> None:
+        pass
+
+    #   Layer hook that is called for every layer, in order. The layer can be edited in place.
+    def onLayer(self, layer_counter: int, layer: SectionEdit, index: LayerIndex) -> None:
+        pass
+
+    #   Layer hook that is called once per pass with the sections after the last layer (the end code).
+    def onFooter(self, sections: List[SectionEdit], index: LayerIndex) -> None:
+        pass
+
+    #   Whether this script is layer-local: it modifies every layer on its own, using nothing but the layer and a
+    #   context that is prepared once for the whole print. Such scripts implement getLayerContext and processLayer
+    #   instead of the layer hooks, which allows LayerRunner to process their layers in parallel.
+    def isLayerLocal(self) -> bool:
+        return type(self).processLayer is not Script.processLayer
+
+    #   Returns everything processLayer needs, such as the settings and values from the layer index.
+    #   The context must be picklable, since it is sent to the worker processes of LayerRunner. When streaming, the
+    #   lists in the layer index may still grow after this is called, but only for layers after the current one.
+    def getLayerContext(self, index: LayerIndex) -> Dict[str, Any]:
+        return {}
+
+    #   Processes a single layer of a layer-local script by editing it in place. It is called for the layers up to the
+    #   layer count of the start code.
+    #   This must be a static method, so it can run in a worker process without the script and its settings stack.
+    @staticmethod
+    def processLayer(layer_counter: int, layer: SectionEdit, context: Dict[str, Any]) -> None:
         raise NotImplementedError()
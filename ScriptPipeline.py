@@ -0,0 +1,129 @@
+# Copyright (c) 2020 Louis Wouters
+# The PostProcessingPlugin is released under the terms of the AGPLv3 or higher.
+import functools
+from typing import Callable, Iterable, Iterator, List, Optional, TYPE_CHECKING
+
+from .LayerCache import LayerCache
+from .LayerIndex import LayerIndex
+from .SectionEdit import SectionEdit
+
+if TYPE_CHECKING:
+    from .Script import Script
+    from .ScriptProfiler import ScriptProfiler
+
+
+#   Runs an ordered list of scripts over the g-code in a single pass over the layers.
+#
+#   Scripts with layer hooks (see Script.hasLayerHooks) are fused: every layer is handed to the hooks of all of them
+#   in order, as a SectionEdit, so each layer is copied once no matter how many scripts edit it. Scripts without
+#   hooks can't be fused; they split the pipeline into stages that are chained as generators, so there is still only
+#   one pass over the sections.
+#
+#   Stages with a script that requires the complete data (see Script.requiresCompleteData) collect their sections into
+#   a list first, so only those stages hold the whole g-code in memory.
+#
+#   With the profiler of Script.setProfiler, every stage is measured on its own while streaming, unless the pipeline
+#   runs within an execute that is measured as a whole.
+#
+#   The layers of layer-local scripts are served from the layer cache of Script.setLayerCache if one is set. While
+#   streaming the context of a script can still change after the first layer, so the cache is only used for lists.
+#
+#   All fused scripts see the layer index of the input of their stage. Scripts that rewrite ;LAYER_COUNT:, ;TIME: or
+#   ;TIME_ELAPSED: for the scripts after them should therefore not be fused with those scripts.
+class ScriptPipeline:
+    def __init__(self, scripts: List["Script"]) -> None:
+        self._scripts = scripts
+
+    #   Runs the scripts over a list of g-code sections and writes the result back into the same list.
+    def execute(self, data: List[str]) -> List[str]:
+        try:
+            data[:] = list(self.executeStream(data))
+        finally:
+            if self._scripts:
+                self._scripts[0].releaseLayerIndexLater()
+        return data
+
+    def executeStream(self, sections: Iterable[str]) -> Iterator[str]:
+        profiler = self._scripts[0].getProfiler() if self._scripts else None
+        if profiler is not None and profiler.isMeasuring():
+            profiler = None
+        stream = sections
+        fused = []  # type: List[Script]
+        for script in self._scripts:
+            if script.hasLayerHooks():
+                fused.append(script)
+                continue
+            if fused:
+                stream = self._chainStage(profiler, fused, functools.partial(self._executeFused, fused), stream)
+                fused = []
+            stream = self._chainStage(profiler, [script], script.executeStream, stream)
+        if fused:
+            stream = self._chainStage(profiler, fused, functools.partial(self._executeFused, fused), stream)
+        yield from stream
+
+    @staticmethod
+    def _chainStage(profiler: Optional["ScriptProfiler"], scripts: List["Script"], execute_stream: Callable[[Iterable[str]], Iterator[str]], stream: Iterable[str]) -> Iterator[str]:
+        if profiler is None:
+            return execute_stream(stream)
+        return profiler.profileStream(scripts, execute_stream, stream)
+
+    def _executeFused(self, scripts: List["Script"], sections: Iterable[str]) -> Iterator[str]:
+        if not isinstance(sections, list) and any(script.requiresCompleteData() for script in scripts):
+            sections = list(sections)
+        if isinstance(sections, list):
+            index = scripts[0].getLayerIndex(sections)
+            build_index = False
+        else:
+            index = LayerIndex()
+            build_index = True
+
+        header = []  # type: List[SectionEdit]
+        between_layers = []  # type: List[SectionEdit]
+        layer_contexts = []
+        context_keys = []
+        layer_cache = scripts[0].getLayerCache() if not build_index else None
+        layer_counter = -1
+        for section in sections:
+            if build_index:
+                index.observe(section)
+            if not LayerIndex.isLayer(section):
+                if layer_counter == -1:
+                    header.append(SectionEdit(section))
+                else:  # Sections after the last layer are the footer, others are passed on unchanged.
+                    between_layers.append(SectionEdit(section))
+                continue
+
+            if layer_counter == -1:  # First layer: the start code is complete.
+                for script in scripts:
+                    script.onHeader(header, index)
+                yield from (section_edit.getText() for section_edit in header)
+                header = []
+                layer_contexts = [script.getLayerContext(index) if script.isLayerLocal() else None for script in scripts]
+                if layer_cache is not None:
+                    context_keys = [LayerCache.getContextKey(script, context) if context is not None else None
+                                    for script, context in zip(scripts, layer_contexts)]
+            elif between_layers:
+                yield from (section_edit.getText() for section_edit in between_layers)
+                between_layers = []
+
+            layer_counter += 1
+            layer = SectionEdit(section)
+            for script_number, (script, context) in enumerate(zip(scripts, layer_contexts)):
+                if context is None:
+                    script.onLayer(layer_counter, layer, index)
+                elif layer_counter >= index.layer_count:
+                    continue
+                elif layer_cache is not None:
+                    layer_cache.processLayer(script, context_keys[script_number], layer_counter, layer, context)
+                else:
+                    script.processLayer(layer_counter, layer, context)
+            yield layer.getText()
+
+        if layer_counter == -1:  # No layers at all, everything is start code.
+            for script in scripts:
+                script.onHeader(header, index)
+            yield from (section_edit.getText() for section_edit in header)
+        else:
+            for script in scripts:
+                script.onFooter(between_layers, index)
+            yield from (section_edit.getText() for section_edit in between_layers)
@@ -0,0 +1,219 @@
+# Copyright (c) 2020 Louis Wouters
+# The PostProcessingPlugin is released under the terms of the AGPLv3 or higher.
+import cProfile
+import json
+import os
+import time
+import tracemalloc
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Iterable, Iterator, List, Optional, Tuple, TYPE_CHECKING
+
+from UM.Logger import Logger
+
+if TYPE_CHECKING:
+    from .Script import Script
+
+
+def _sizeInBytes(data: List[str]) -> int:
+    return sum(len(section.encode("utf-8")) for section in data)
+
+
+#   Measures what every execute of a script costs, when it is enabled with Script.setProfiler.
+#
+#   For every run it records the wall time, the CPU time, the peak memory allocated while executing (traced with
+#   tracemalloc), the size of the g-code before and after and the number of sections that were modified. The
+#   statistics are logged, kept in memory, emitted with Script.executionProfiled and optionally written to a file with
+#   one JSON object per line. A cProfile dump of every run can be written to a directory as well.
+#   Tracing memory slows the scripts down, so the times are only comparable between runs that are profiled alike.
+#
+#   ScriptPipeline.executeStream measures every stage of the pipeline with profileStream instead, for the scripts of a
+#   fused stage together. The times of a stage don't include the stages before it, but the stages run interleaved, so
+#   their peak memory is that of the whole pipeline since the stage started. Executes that run within a measured run
+#   are part of that run and are not measured on their own.
+class ScriptProfiler:
+    #   \param log_file File the statistics of every run are appended to as JSON lines, or None.
+    #   \param profile_directory Directory for a cProfile dump of every run, or None to not run cProfile.
+    #   \param trace_memory Whether to trace the peak memory with tracemalloc.
+    def __init__(self, log_file: Optional[str] = None, profile_directory: Optional[str] = None, trace_memory: bool = True) -> None:
+        self._log_file = log_file
+        self._profile_directory = profile_directory
+        self._trace_memory = trace_memory
+        self._statistics = []  # type: List[Dict[str, Any]]
+        self._measuring = 0  # Number of runs that are being measured.
+
+    #   Statistics of all runs that were profiled, in order.
+    def getStatistics(self) -> List[Dict[str, Any]]:
+        return list(self._statistics)
+
+    def clearStatistics(self) -> None:
+        self._statistics = []
+
+    #   Whether a run is being measured, which includes any execute it runs.
+    def isMeasuring(self) -> bool:
+        return self._measuring > 0
+
+    #   Executes a script over the data list and returns its result with the statistics of the run.
+    def profile(self, script: "Script", execute: Callable[["Script", List[str]], List[str]], data: List[str]) -> Tuple[List[str], Dict[str, Any]]:
+        script_key = script.getSettingData().get("key", type(script).__name__)
+        sections_before = list(data)  # The script may modify the list in place.
+        input_bytes = _sizeInBytes(sections_before)
+
+        start_tracing, peak_from_now = _startTracing() if self._trace_memory else (False, False)
+        memory_before = tracemalloc.get_traced_memory()[0] if self._trace_memory else 0
+        profiler = cProfile.Profile() if self._profile_directory else None
+
+        self._measuring += 1
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        if profiler is not None:
+            profiler.enable()
+        try:
+            result = execute(script, data)
+        finally:
+            if profiler is not None:
+                profiler.disable()
+            cpu_time = time.process_time() - cpu_start
+            wall_time = time.perf_counter() - wall_start
+            self._measuring -= 1
+            peak_memory = _peakMemory(memory_before, peak_from_now) if self._trace_memory else 0
+            if start_tracing:
+                tracemalloc.stop()
+
+        statistics = {
+            "script": script_key,
+            "stack_id": script.getStackId(),
+            "streamed": False,
+            "wall_time": wall_time,
+            "cpu_time": cpu_time,
+            "peak_memory": max(0, peak_memory),
+            "input_bytes": input_bytes,
+            "output_bytes": _sizeInBytes(result),
+            "sections": len(result),
+            "sections_modified": sum(1 for before, after in zip(sections_before, result) if before is not after and before != after)
+                                 + abs(len(result) - len(sections_before))
+        }  # type: Dict[str, Any]
+        self._dumpProfile(profiler, statistics)
+        self._record(statistics)
+        return result, statistics
+
+    #   Runs a stage of a streaming pipeline over the sections and yields its output, measuring the stage. When the
+    #   stage is done, the statistics are recorded and emitted with the executionProfiled signal of its scripts.
+    #   \param execute_stream Function that chains the stage to an iterable of sections.
+    def profileStream(self, scripts: List["Script"], execute_stream: Callable[[Iterable[str]], Iterator[str]], sections: Iterable[str]) -> Iterator[str]:
+        profiler = cProfile.Profile() if self._profile_directory else None
+        inputs = deque()  # type: Deque[str]  # Sections that went in and didn't come out yet.
+        totals = {"upstream_wall_time": 0.0, "upstream_cpu_time": 0.0, "input_bytes": 0}
+
+        #   Passes the sections on to the stage, without counting the time of the stages before it.
+        def pull() -> Iterator[str]:
+            iterator = iter(sections)
+            while True:
+                if profiler is not None:
+                    profiler.disable()
+                wall_start = time.perf_counter()
+                cpu_start = time.process_time()
+                try:
+                    section = next(iterator)
+                except StopIteration:
+                    return
+                finally:
+                    totals["upstream_cpu_time"] += time.process_time() - cpu_start
+                    totals["upstream_wall_time"] += time.perf_counter() - wall_start
+                    if profiler is not None:
+                        profiler.enable()
+                inputs.append(section)
+                totals["input_bytes"] += len(section.encode("utf-8"))
+                yield section
+
+        start_tracing, peak_from_now = _startTracing() if self._trace_memory else (False, False)
+        memory_before = tracemalloc.get_traced_memory()[0] if self._trace_memory else 0
+        wall_time = cpu_time = 0.0
+        output_bytes = sections_out = sections_modified = 0
+        if isinstance(sections, list):  # The first stage of a list, which some stages handle without streaming.
+            stage_input = sections  # type: Iterable[str]
+            inputs.extend(sections)
+            totals["input_bytes"] = _sizeInBytes(sections)
+        else:
+            stage_input = pull()
+        self._measuring += 1
+        try:
+            output = execute_stream(stage_input)
+            while True:
+                wall_start = time.perf_counter()
+                cpu_start = time.process_time()
+                if profiler is not None:
+                    profiler.enable()
+                try:
+                    section = next(output)
+                except StopIteration:
+                    break
+                finally:
+                    if profiler is not None:
+                        profiler.disable()
+                    cpu_time += time.process_time() - cpu_start
+                    wall_time += time.perf_counter() - wall_start
+                before = inputs.popleft() if inputs else None
+                sections_modified += before is None or (before is not section and before != section)
+                sections_out += 1
+                output_bytes += len(section.encode("utf-8"))
+                yield section
+        finally:
+            self._measuring -= 1
+            peak_memory = _peakMemory(memory_before, peak_from_now) if self._trace_memory else 0
+            if start_tracing:
+                tracemalloc.stop()
+
+        statistics = {
+            "script": "+".join(script.getSettingData().get("key", type(script).__name__) for script in scripts),
+            "stack_id": "+".join(str(script.getStackId()) for script in scripts),
+            "streamed": True,
+            "wall_time": max(0.0, wall_time - totals["upstream_wall_time"]),
+            "cpu_time": max(0.0, cpu_time - totals["upstream_cpu_time"]),
+            "peak_memory": max(0, peak_memory),
+            "input_bytes": totals["input_bytes"],
+            "output_bytes": output_bytes,
+            "sections": sections_out,
+            "sections_modified": sections_modified + len(inputs)
+        }  # type: Dict[str, Any]
+        self._dumpProfile(profiler, statistics)
+        self._record(statistics)
+        for script in scripts:
+            script.executionProfiled.emit(script, statistics)
+
+    def _dumpProfile(self, profiler: Optional[cProfile.Profile], statistics: Dict[str, Any]) -> None:
+        if profiler is None:
+            return
+        os.makedirs(self._profile_directory, exist_ok = True)
+        profile_file = os.path.join(self._profile_directory, "{script}_{run}.prof".format(script = statistics["script"], run = len(self._statistics)))
+        profiler.dump_stats(profile_file)
+        statistics["profile_file"] = profile_file
+
+    def _record(self, statistics: Dict[str, Any]) -> None:
+        self._statistics.append(statistics)
+        Logger.log("i", "{script}: {wall_time:.3f} s wall, {cpu_time:.3f} s CPU, {peak_memory} bytes peak, {input_bytes} -> {output_bytes} bytes, {sections_modified}/{sections} sections modified".format(**statistics))
+        if self._log_file:
+            try:
+                with open(self._log_file, "a") as f:
+                    f.write(json.dumps(statistics) + "\n")
+            except OSError as e:
+                Logger.log("w", "Can't write the statistics of %s to %s: %s", statistics["script"], self._log_file, e)
+
+
+#   Starts tracing memory, or resets the peak of the tracing that is already running, so the peak is measured from now
+#   on. Returns whether tracing was started (and must be stopped again) and whether the peak is measured from now on.
+#   tracemalloc.reset_peak only exists since Python 3.9, before that the peak of a running tracing can't be reset.
+def _startTracing() -> Tuple[bool, bool]:
+    if not tracemalloc.is_tracing():
+        tracemalloc.start()
+        return True, True
+    if hasattr(tracemalloc, "reset_peak"):
+        tracemalloc.reset_peak()
+        return False, True
+    return False, False
+
+
+#   Peak memory allocated since memory_before was taken. If the peak couldn't be reset (see _startTracing), the peak
+#   can be from before that, so the growth of the traced memory is used instead.
+def _peakMemory(memory_before: int, peak_from_now: bool) -> int:
+    current, peak = tracemalloc.get_traced_memory()
+    return peak - memory_before if peak_from_now else max(0, current - memory_before)
@@ -0,0 +1,110 @@
+# Copyright (c) 2020 Louis Wouters
+# The PostProcessingPlugin is released under the terms of the AGPLv3 or higher.
+from typing import List, Optional
+
+
+#   Replaces the first line of a section of g-code.
+#   The first line is a prefix of the section, so replacing its first occurrence builds the new section in a single
+#   copy, without splitting the section into lines.
+def replaceFirstLine(section: str, line: str) -> str:
+    newline = section.find("\n")
+    if newline == -1:
+        return line
+    return section.replace(section[:newline], line, 1)
+
+
+#   Inserts text (one or more lines, without a trailing newline) after the first line of a section of g-code.
+def insertAfterFirstLine(section: str, text: str) -> str:
+    newline = section.find("\n")
+    if newline == -1:
+        return section + "\n" + text
+    first_line = section[:newline]
+    return section.replace(first_line, first_line + "\n" + text, 1)
+
+
+#   Adds text at the end of a section of g-code.
+def appendToSection(section: str, text: str) -> str:
+    return section + text
+
+
+#   Pending modifications of a section of g-code, applied all at once when the text is needed.
+#
+#   Scripts mostly replace the first line of a layer, insert lines after it or add lines at the end. Collecting these
+#   edits and applying them together costs one copy of the section, regardless of how many scripts edit it.
+#   The result is the same as applying the edits one after another: text that is inserted after the first line ends
+#   up before the text that was inserted by earlier edits.
+class SectionEdit:
+    __slots__ = ("_text", "_first_line", "_inserts", "_appends")
+
+    def __init__(self, text: str) -> None:
+        self._text = text
+        self._first_line = None  # type: Optional[str]
+        self._inserts = []  # type: List[str]
+        self._appends = []  # type: List[str]
+
+    def isModified(self) -> bool:
+        return self._first_line is not None or bool(self._inserts) or bool(self._appends)
+
+    #   Returns the text with all edits applied.
+    def getText(self) -> str:
+        if self.isModified():
+            self._apply()
+        return self._text
+
+    #   Replaces the whole text, e.g. for scripts that modify lines in the middle of the section.
+    def setText(self, text: str) -> None:
+        self._text = text
+        self._first_line = None
+        self._inserts = []
+        self._appends = []
+
+    def getFirstLine(self) -> str:
+        self._applyIfFirstLineMoved()
+        if self._first_line is not None:
+            return self._first_line
+        newline = self._text.find("\n")
+        return self._text if newline == -1 else self._text[:newline]
+
+    def replaceFirstLine(self, line: str) -> None:
+        self._applyIfFirstLineMoved()
+        self._first_line = line
+
+    #   Inserts text (one or more lines, without a trailing newline) after the first line.
+    def insertAfterFirstLine(self, text: str) -> None:
+        self._applyIfFirstLineMoved()
+        self._inserts.append(text)
+
+    #   Adds text at the end of the section.
+    def append(self, text: str) -> None:
+        self._appends.append(text)
+
+    #   Whether text may occur after the first line, e.g. "\n;LAYER:" for another layer comment, without applying the
+    #   edits. It never misses an occurrence, but pending edits that contain text without its leading newlines count as
+    #   an occurrence too.
+    def mayContainAfterFirstLine(self, text: str) -> bool:
+        newline = self._text.find("\n")
+        if newline != -1 and self._text.find(text, newline) != -1:
+            return True
+        stripped = text.lstrip("\n")
+        pending = self._inserts + self._appends + ([self._first_line.partition("\n")[2]] if self._first_line is not None else [])
+        return any(stripped in edit for edit in pending)
+
+    #   The pending edits must be applied before the first line is edited again if they change what the first line is:
+    #   when the first line was replaced by several lines, or when text was added at the end of a single line.
+    def _applyIfFirstLineMoved(self) -> None:
+        if (self._first_line is not None and "\n" in self._first_line) or (self._appends and "\n" not in self._text):
+            self._apply()
+
+    def _apply(self) -> None:
+        text = self._text
+        if self._first_line is not None or self._inserts:
+            if self._first_line is not None:
+                new_first_line = self._first_line
+            else:
+                newline = text.find("\n")
+                new_first_line = text if newline == -1 else text[:newline]
+            new_first_line += "".join("\n" + insert for insert in reversed(self._inserts))
+            text = replaceFirstLine(text, new_first_line)
+        if self._appends:
+            text = appendToSection(text, "".join(self._appends))
+        self.setText(text)
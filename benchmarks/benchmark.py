@@ -0,0 +1,179 @@
+# Copyright (c) 2020 Louis Wouters
+# The PostProcessingPlugin is released under the terms of the AGPLv3 or higher.
+
+# Times and memory-profiles the scripts on synthetic g-code and writes the results as JSON.
+# Runs without Cura: if Uranium isn't installed, the minimal UM package in headless/ is used.
+#
+# Usage: python benchmarks/benchmark.py [--layers N] [--lines N] [--header-lines N] [--repeat N]
+#                                       [--layer-workers N] [--output results.json] [--compare baseline.json]
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import timeit
+import tracemalloc
+from typing import Any, Callable, Dict, List
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(BENCHMARKS_DIR), "headless"))
+sys.path.insert(0, BENCHMARKS_DIR)
+import plugin_loader  # noqa: E402
+from gcode_generator import generateGCode  # noqa: E402
+
+# Worker processes of LayerRunner that are spawned import this module first, so they find the plugin package too.
+plugin_loader.loadPlugin()
+
+#   Settings that make every script modify the g-code.
+SCRIPT_SETTINGS = {
+    "ChangeTemperatureDuringPrint": {"bed_temperature": 50, "nozzle_temperature": 0}
+}
+
+LINES = ["G1 F1500 X104.512 Y87.331 E12.34567", "G0 F6000 X10 Y10 Z0.3", "G1 X-12.5 Y3 E-0.8 ; retract", "M104 S200"]
+
+
+#   Runs a function on a fresh copy of the data and returns the best wall time and the peak of traced allocations.
+def measure(function: Callable[[List[str]], Any], data: List[str], repeat: int) -> Dict[str, float]:
+    times = []
+    for _ in range(repeat):
+        copy = list(data)
+        start = time.perf_counter()
+        function(copy)
+        times.append(time.perf_counter() - start)
+
+    copy = list(data)
+    tracemalloc.start()
+    function(copy)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"seconds": min(times), "mean_seconds": sum(times) / len(times), "peak_bytes": peak}
+
+
+#   Times every script on its own and all scripts together, serially and with the layers of layer-local scripts
+#   spread over layer_workers processes. The peak memory of the parallel runs only includes the main process.
+def benchmarkScripts(data: List[str], repeat: int, layer_workers: int) -> Dict[str, Dict[str, float]]:
+    results = {}
+    scripts = []
+    layer_runner = plugin_loader.importPluginModule("LayerRunner").LayerRunner(layer_workers)
+    for name in plugin_loader.getScriptNames():
+        script = plugin_loader.createScript(name, SCRIPT_SETTINGS.get(name))
+        scripts.append(script)
+        results[name] = measure(script.execute, data, repeat)
+        if script.isLayerLocal():
+            results["LayerRunner({name})".format(name = name)] = measure(lambda copy: layer_runner.run(script, copy), data, repeat)
+
+    pipeline = plugin_loader.importPluginModule("ScriptPipeline").ScriptPipeline(scripts)
+    results["ScriptPipeline(all)"] = measure(pipeline.execute, data, repeat)
+    results["LayerRunner(all)"] = measure(lambda copy: layer_runner.runScripts(scripts, copy), data, repeat)
+    return results
+
+
+#   Times a rerun of all scripts after the bed temperature of ChangeTemperatureDuringPrint changed, as Cura does after
+#   every change of a setting, with and without the layer cache. The new temperature only changes a single layer, so
+#   with the cache the layer-local scripts after ChangeTemperatureDuringPrint only process that layer again.
+def benchmarkLayerCache(data: List[str], repeat: int) -> Dict[str, Dict[str, float]]:
+    script_class = plugin_loader.importPluginModule("Script").Script
+    layer_cache_class = plugin_loader.importPluginModule("LayerCache").LayerCache
+    scripts = [plugin_loader.createScript(name, SCRIPT_SETTINGS.get(name)) for name in plugin_loader.getScriptNames()]
+    pipeline = plugin_loader.importPluginModule("ScriptPipeline").ScriptPipeline(scripts)
+    change_temperature = [script for script in scripts if type(script).__name__ == "ChangeTemperatureDuringPrint"]
+
+    results = {}
+    for name, cached in (("ScriptPipeline(all, rerun)", False), ("ScriptPipeline(all, rerun, cached)", True)):
+        times = []
+        peak = 0
+        for run in range(repeat + 1):
+            script_class.setLayerCache(layer_cache_class() if cached else None)
+            for script in change_temperature:
+                script._instance.setProperty("bed_temperature", "value", 50)
+            pipeline.execute(list(data))
+            for script in change_temperature:
+                script._instance.setProperty("bed_temperature", "value", 51)
+            copy = list(data)
+            if run == repeat:  # Memory is traced in a run of its own, since tracing slows the run down.
+                tracemalloc.start()
+                pipeline.execute(copy)
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+                continue
+            start = time.perf_counter()
+            pipeline.execute(copy)
+            times.append(time.perf_counter() - start)
+        results[name] = {"seconds": min(times), "mean_seconds": sum(times) / len(times), "peak_bytes": peak}
+    script_class.setLayerCache(None)
+    return results
+
+
+#   Nanoseconds per call of the g-code line helpers of the Script class.
+def benchmarkLineHelpers(number: int) -> Dict[str, float]:
+    script = plugin_loader.createScript(plugin_loader.getScriptNames()[0])
+    calls = {
+        "getValue": lambda: [script.getValue(line, key) for line in LINES for key in "XYZEF"],
+        "getValues": lambda: [script.getValues(line, "XYZEF") for line in LINES],
+        "putValue": lambda: [script.putValue(line, E = 1.5) for line in LINES],
+    }
+    calls_per_loop = {"getValue": len(LINES) * 5, "getValues": len(LINES), "putValue": len(LINES)}
+    return {name: min(timeit.repeat(call, number = number, repeat = 3)) / (number * calls_per_loop[name]) * 1e9
+            for name, call in calls.items()}
+
+
+def gitRevision() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd = BENCHMARKS_DIR, stderr = subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def printComparison(results: Dict[str, Any], baseline: Dict[str, Any]) -> None:
+    print("\nCompared to " + baseline.get("revision", "baseline") + " (ratio < 1 is faster):")
+    for name, result in results["scripts"].items():
+        previous = baseline.get("scripts", {}).get(name)
+        if previous:
+            print("  {:<36} time {:5.2f}x  peak memory {:5.2f}x".format(name, result["seconds"] / previous["seconds"],
+                                                                        result["peak_bytes"] / max(1, previous["peak_bytes"])))
+    for name, nanoseconds in results["line_helpers"].items():
+        previous = baseline.get("line_helpers", {}).get(name)
+        if previous:
+            print("  {:<36} time {:5.2f}x".format(name, nanoseconds / previous))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description = "Benchmark of the post-processing scripts")
+    parser.add_argument("--layers", type = int, default = 500)
+    parser.add_argument("--lines", type = int, default = 500, help = "Lines per layer")
+    parser.add_argument("--header-lines", type = int, default = 20)
+    parser.add_argument("--repeat", type = int, default = 3)
+    parser.add_argument("--line-helper-loops", type = int, default = 5000)
+    parser.add_argument("--layer-workers", type = int, default = os.cpu_count() or 1, help = "Worker processes of the LayerRunner runs")
+    parser.add_argument("--output", help = "Write the results to this JSON file")
+    parser.add_argument("--compare", help = "JSON file with earlier results to compare with")
+    args = parser.parse_args()
+
+    data = generateGCode(args.layers, args.lines, args.header_lines)
+    results = {
+        "revision": gitRevision(),
+        "python": platform.python_version(),
+        "parameters": {"layers": args.layers, "lines_per_layer": args.lines, "header_lines": args.header_lines,
+                       "layer_workers": args.layer_workers, "input_bytes": sum(len(section) for section in data)},
+        "scripts": dict(benchmarkScripts(data, args.repeat, args.layer_workers), **benchmarkLayerCache(data, args.repeat)),
+        "line_helpers": benchmarkLineHelpers(args.line_helper_loops)
+    }
+
+    for name, result in results["scripts"].items():
+        print("{:<36} {:8.1f} ms  peak {:8.1f} MB".format(name, result["seconds"] * 1000, result["peak_bytes"] / 1e6))
+    for name, nanoseconds in results["line_helpers"].items():
+        print("{:<36} {:8.1f} ns/call".format(name, nanoseconds))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent = 2)
+    if args.compare:
+        with open(args.compare) as f:
+            printComparison(results, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+# Copyright (c) 2020 Louis Wouters
+# The PostProcessingPlugin is released under the terms of the AGPLv3 or higher.
+
+# Generates synthetic g-code in the shape of the data list that Cura hands to the post-processing scripts:
+# the header comments, the start code with ;LAYER_COUNT:, one section per layer that starts with ;LAYER:n and ends
+# with ;TIME_ELAPSED: and the end code. Raft layers are numbered from -raft_layers, like Cura does.
+
+import math
+import random
+from typing import List
+
+FEATURE_TYPES = ("WALL-OUTER", "WALL-INNER", "SKIN", "FILL", "SUPPORT")
+
+
+def generateGCode(layers: int = 200, lines_per_layer: int = 500, header_lines: int = 20,
+                  layer_height: float = 0.2, seconds_per_line: float = 0.08, seed: int = 0, raft_layers: int = 0) -> List[str]:
+    randomizer = random.Random(seed)
+    time_total = int(layers * lines_per_layer * seconds_per_line)
+
+    header = [";FLAVOR:Marlin", ";TIME:" + str(time_total), ";Filament used: 12.3456m", ";Layer height: " + str(layer_height),
+              ";MINX:20.5", ";MINY:20.5", ";MINZ:" + str(layer_height), ";MAXX:199.5", ";MAXY:199.5", ";MAXZ:" + str(round(layers * layer_height, 2))]
+    header += [";SETTING_" + str(number) + ":" + str(randomizer.random()) for number in range(max(0, header_lines - len(header)))]
+    header.append(";Generated with Cura_SteamEngine 4.6.1")
+    start_code = ["M140 S60", "M105", "M190 S60", "M104 S200", "M105", "M109 S200", "M82 ;absolute extrusion mode",
+                  "G28 ;Home", "G92 E0", "G1 Z2.0 F3000", "G1 X0.1 Y20 Z0.3 F5000.0", "G1 X0.1 Y200.0 Z0.3 F1500.0 E15",
+                  "G92 E0", "G1 Z2.0 F3000", "M107", ";LAYER_COUNT:" + str(layers)]
+    data = ["\n".join(header) + "\n", "\n".join(start_code) + "\n"]
+
+    extruded = 0.0
+    time_elapsed = 0.0
+    x, y = 100.0, 100.0
+    for layer_number in range(layers):
+        z = round((layer_number + 1) * layer_height, 3)
+        lines = [";LAYER:" + str(layer_number - raft_layers), "G0 F6000 X{:.3f} Y{:.3f} Z{}".format(x, y, z)]
+        for line_number in range(lines_per_layer):
+            if line_number % 100 == 0:
+                lines.append(";TYPE:" + FEATURE_TYPES[(line_number // 100) % len(FEATURE_TYPES)])
+            new_x = min(200.0, max(20.0, x + randomizer.uniform(-15, 15)))
+            new_y = min(200.0, max(20.0, y + randomizer.uniform(-15, 15)))
+            if line_number % 40 == 39:  # Travel with retraction.
+                lines.append("G1 F2700 E{:.5f}".format(extruded - 6.5))
+                lines.append("G0 F6000 X{:.3f} Y{:.3f}".format(new_x, new_y))
+                lines.append("G1 F2700 E{:.5f}".format(extruded))
+            else:
+                extruded += math.hypot(new_x - x, new_y - y) * 0.0332
+                lines.append("G1 F1500 X{:.3f} Y{:.3f} E{:.5f}".format(new_x, new_y, extruded))
+            x, y = new_x, new_y
+        time_elapsed += lines_per_layer * seconds_per_line * randomizer.uniform(0.5, 1.5)
+        lines.append(";TIME_ELAPSED:{:.6f}".format(time_elapsed))
+        data.append("\n".join(lines) + "\n")
+
+    data.append(";End of Gcode\nM140 S0\nM107\nG91\nG1 E-2 F2700\nG1 E-2 Z0.2 F2400\nG1 X5 Y5 F3000\nG1 Z10\nG90\nG1 X0 Y300\nM106 S0\nM104 S0\nM140 S0\nM84 X Y E\n")
+    return data
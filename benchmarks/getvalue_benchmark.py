@@ -0,0 +1,82 @@
+# Copyright (c) 2020 Louis Wouters
+# The PostProcessingPlugin is released under the terms of the AGPLv3 or higher.
+
+# Micro-benchmark of the g-code word parser against the original implementation of Script.getValue.
+# Usage: python benchmarks/getvalue_benchmark.py [--number N]
+
+import argparse
+import os
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import GCodeParser  # noqa: E402
+
+LINES = [
+    "G1 F1500 X104.512 Y87.331 E12.34567",
+    "G0 F6000 X10 Y10 Z0.3",
+    "G1 X-12.5 Y3 E-0.8 ; retract",
+    "M104 S200",
+    "G1 F2400 E-6.5",
+    ";TYPE:WALL-OUTER",
+    "M117 Layer 5/120 | ETA 1H05M",
+]
+KEYS = "XYZEF"
+
+
+#   The implementation of Script.getValue before the word parser.
+def legacyGetValue(line, key, default = None):
+    if key not in line or (';' in line and line.find(key) > line.find(';')):
+        return default
+    sub_part = line[line.find(key) + 1:]
+    m = re.search(r'^-?[0-9]+\.?[0-9]*', sub_part)
+    if m is None:
+        return default
+    try:
+        return int(m.group(0))
+    except ValueError:  # Not an integer.
+        try:
+            return float(m.group(0))
+        except ValueError:  # Not a number at all.
+            return default
+
+
+def legacyLoop():
+    for line in LINES:
+        for key in KEYS:
+            legacyGetValue(line, key)
+
+
+def getValueLoop():
+    for line in LINES:
+        for key in KEYS:
+            GCodeParser.getValue(line, key)
+
+
+def getValuesLoop():
+    for line in LINES:
+        GCodeParser.getValues(line, KEYS)
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "Benchmark of the g-code word parser")
+    parser.add_argument("--number", type = int, default = 20000, help = "Number of loops over the test lines")
+    args = parser.parse_args()
+
+    # The parsers only differ for letters inside words, which the test lines avoid.
+    for line in LINES[:5]:
+        for key in KEYS:
+            assert legacyGetValue(line, key) == GCodeParser.getValue(line, key), (line, key)
+        assert tuple(legacyGetValue(line, key) for key in KEYS) == GCodeParser.getValues(line, KEYS), line
+
+    queries = args.number * len(LINES) * len(KEYS)
+    baseline = None
+    for name, function in (("legacy getValue", legacyLoop), ("getValue", getValueLoop), ("getValues", getValuesLoop)):
+        seconds = min(timeit.repeat(function, number = args.number, repeat = 3))
+        baseline = baseline or seconds
+        print("{:<16} {:8.1f} ns/query  {:5.2f}x".format(name, seconds / queries * 1e9, baseline / seconds))
+
+
+if __name__ == "__main__":
+    main()
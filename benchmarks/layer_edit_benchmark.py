@@ -0,0 +1,76 @@
+# Copyright (c) 2020 Louis Wouters
+# The PostProcessingPlugin is released under the terms of the AGPLv3 or higher.
+
+# Compares the time and peak allocation of editing the first line of large layers by splitting them into lines (as
+# ShowProgress and StartLayerNumberingAt1 used to do) with the single-copy splice helpers of the Script class.
+# Usage: python benchmarks/layer_edit_benchmark.py [--layers N] [--lines N]
+
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+from typing import Callable, Dict, List
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARKS_DIR))
+sys.path.insert(0, BENCHMARKS_DIR)
+import SectionEdit  # noqa: E402
+from gcode_generator import generateGCode  # noqa: E402
+
+DISPLAY_TEXT = "M117 12/345 | ETA 1H05M"
+
+
+def insertBySplitting(layer: str) -> str:
+    lines = layer.split("\n")
+    lines[0] = lines[0] + "\n" + DISPLAY_TEXT
+    return "\n".join(lines)
+
+
+def insertBySplicing(layer: str) -> str:
+    return SectionEdit.insertAfterFirstLine(layer, DISPLAY_TEXT)
+
+
+def replaceBySlicing(layer: str) -> str:
+    layer = layer[layer.find("\n"):]
+    return ";LAYER:1" + layer
+
+
+def replaceBySplicing(layer: str) -> str:
+    return SectionEdit.replaceFirstLine(layer, ";LAYER:1")
+
+
+def measure(edit: Callable[[str], str], layers: List[str]) -> Dict[str, float]:
+    start = time.perf_counter()
+    for layer in layers:
+        edit(layer)
+    seconds = time.perf_counter() - start
+
+    tracemalloc.start()
+    for layer in layers:
+        edit(layer)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"seconds": seconds, "peak_bytes": peak}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description = "Benchmark of editing the first line of layers")
+    parser.add_argument("--layers", type = int, default = 20)
+    parser.add_argument("--lines", type = int, default = 50000, help = "Lines per layer")
+    args = parser.parse_args()
+
+    layers = generateGCode(args.layers, args.lines)[2:-1]
+    print("{} layers of {:.1f} MB".format(len(layers), sum(len(layer) for layer in layers) / len(layers) / 1e6))
+    for name, before, after in (("insert after first line", insertBySplitting, insertBySplicing),
+                                ("replace first line", replaceBySlicing, replaceBySplicing)):
+        assert all(before(layer) == after(layer) for layer in layers), name
+        before_result = measure(before, layers)
+        after_result = measure(after, layers)
+        print("{:<24} before {:7.1f} ms, peak {:6.1f} MB | after {:7.1f} ms, peak {:6.1f} MB".format(
+            name, before_result["seconds"] * 1000, before_result["peak_bytes"] / 1e6,
+            after_result["seconds"] * 1000, after_result["peak_bytes"] / 1e6))
+
+
+if __name__ == "__main__":
+    main()
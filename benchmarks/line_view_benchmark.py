@@ -0,0 +1,87 @@
+# Copyright (c) 2020 Louis Wouters
+# The PostProcessingPlugin is released under the terms of the AGPLv3 or higher.
+
+# Compares the time and peak allocation of reading a few lines of large layers by splitting them into lines with the
+# lazy LineView: the last ;TIME_ELAPSED: line, the first move with a Z and all tool changes.
+# Usage: python benchmarks/line_view_benchmark.py [--layers N] [--lines N]
+
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Optional
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARKS_DIR))
+sys.path.insert(0, BENCHMARKS_DIR)
+from LineView import LineView  # noqa: E402
+from gcode_generator import generateGCode  # noqa: E402
+
+
+def lastTimeElapsedBySplitting(layer: str) -> Optional[str]:
+    lines = [line for line in layer.split("\n") if line.startswith(";TIME_ELAPSED:")]
+    return lines[-1] if lines else None
+
+
+def lastTimeElapsedByView(layer: str) -> Optional[str]:
+    return LineView(layer).lastStartingWith(";TIME_ELAPSED:")
+
+
+def firstZBySplitting(layer: str) -> Optional[str]:
+    for line in layer.split("\n"):
+        if line.startswith(("G0 ", "G1 ")) and "Z" in line:
+            return line
+    return None
+
+
+def firstZByView(layer: str) -> Optional[str]:
+    for _, line in LineView(layer).startingWith("G"):
+        if line.startswith(("G0 ", "G1 ")) and "Z" in line:
+            return line
+    return None
+
+
+def toolChangesBySplitting(layer: str) -> List[str]:
+    return [line for line in layer.split("\n") if line.startswith("T")]
+
+
+def toolChangesByView(layer: str) -> List[str]:
+    return [line for _, line in LineView(layer).startingWith("T")]
+
+
+def measure(read: Callable[[str], object], layers: List[str]) -> Dict[str, float]:
+    start = time.perf_counter()
+    for layer in layers:
+        read(layer)
+    seconds = time.perf_counter() - start
+
+    tracemalloc.start()
+    for layer in layers:
+        read(layer)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"seconds": seconds, "peak_bytes": peak}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description = "Benchmark of reading a few lines of layers")
+    parser.add_argument("--layers", type = int, default = 20)
+    parser.add_argument("--lines", type = int, default = 50000, help = "Lines per layer")
+    args = parser.parse_args()
+
+    layers = generateGCode(args.layers, args.lines)[2:-1]
+    print("{} layers of {:.1f} MB".format(len(layers), sum(len(layer) for layer in layers) / len(layers) / 1e6))
+    for name, before, after in (("last ;TIME_ELAPSED:", lastTimeElapsedBySplitting, lastTimeElapsedByView),
+                                ("first move with Z", firstZBySplitting, firstZByView),
+                                ("tool changes", toolChangesBySplitting, toolChangesByView)):
+        assert all(before(layer) == after(layer) for layer in layers), name
+        before_result = measure(before, layers)
+        after_result = measure(after, layers)
+        print("{:<24} before {:7.1f} ms, peak {:6.1f} MB | after {:7.1f} ms, peak {:6.3f} MB".format(
+            name, before_result["seconds"] * 1000, before_result["peak_bytes"] / 1e6,
+            after_result["seconds"] * 1000, after_result["peak_bytes"] / 1e6))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,27 @@
+from typing import Any, Callable, Optional
+
+from .Settings.ContainerStack import ContainerStack
+
+
+#   Headless application without a global stack: there is no slicer to trigger.
+class Application:
+    _instance = None  # type: Optional[Application]
+
+    @classmethod
+    def getInstance(cls) -> "Application":
+        if cls._instance is None:
+            cls._instance = cls()
+        return cls._instance
+
+    def __init__(self) -> None:
+        self._global_container_stack = None  # type: Optional[ContainerStack]
+
+    def getGlobalContainerStack(self) -> Optional[ContainerStack]:
+        return self._global_container_stack
+
+    def setGlobalContainerStack(self, stack: Optional[ContainerStack]) -> None:
+        self._global_container_stack = stack
+
+    #   There is no event loop, so the function is called right away.
+    def callLater(self, func: Callable[..., Any], *args: Any, **kwargs: Any) -> None:
+        func(*args, **kwargs)
@@ -0,0 +1,14 @@
+import logging
+
+
+#   Forwards the log messages of Uranium's Logger to the logging module.
+class Logger:
+    _levels = {"d": logging.DEBUG, "i": logging.INFO, "w": logging.WARNING, "e": logging.ERROR, "c": logging.CRITICAL}
+
+    @classmethod
+    def log(cls, log_type: str, message: str, *args) -> None:
+        logging.getLogger("UM").log(cls._levels.get(log_type, logging.INFO), message, *args)
+
+    @classmethod
+    def logException(cls, log_type: str, message: str, *args) -> None:
+        logging.getLogger("UM").log(cls._levels.get(log_type, logging.ERROR), message, *args, exc_info = True)
@@ -0,0 +1,2 @@
+class ContainerFormatError(Exception):
+    pass
@@ -0,0 +1,27 @@
+from typing import Any, Dict, List, Optional
+
+from .DefinitionContainer import DefinitionContainer
+
+
+class ContainerRegistry:
+    _instance = None  # type: Optional[ContainerRegistry]
+
+    @classmethod
+    def getInstance(cls) -> "ContainerRegistry":
+        if cls._instance is None:
+            cls._instance = cls()
+        return cls._instance
+
+    def __init__(self) -> None:
+        self._containers = {}  # type: Dict[str, Any]
+
+    #   Only supports finding definitions by id.
+    def findDefinitionContainers(self, id: Optional[str] = None) -> List[DefinitionContainer]:
+        container = self._containers.get(id)
+        return [container] if isinstance(container, DefinitionContainer) else []
+
+    def addContainer(self, container: Any) -> None:
+        self._containers[container.getId()] = container
+
+    def removeContainer(self, container_id: str) -> None:
+        self._containers.pop(container_id, None)
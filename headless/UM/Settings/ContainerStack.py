@@ -0,0 +1,37 @@
+from typing import Any, List
+
+from ..Signal import Signal
+
+
+#   Stack of containers where the value of a setting comes from the top-most container that has it.
+class ContainerStack:
+    def __init__(self, stack_id: str) -> None:
+        self._id = stack_id
+        self._containers = []  # type: List[Any]
+        self._dirty = False
+        self.propertyChanged = Signal()
+
+    def getId(self) -> str:
+        return self._id
+
+    def setDirty(self, dirty: bool) -> None:
+        self._dirty = dirty
+
+    def addContainer(self, container: Any) -> None:
+        self._containers.insert(0, container)
+        property_changed = getattr(container, "propertyChanged", None)
+        if property_changed is not None:
+            property_changed.connect(self.propertyChanged.emit)
+
+    def getTop(self) -> Any:
+        return self._containers[0] if self._containers else None
+
+    def getBottom(self) -> Any:
+        return self._containers[-1] if self._containers else None
+
+    def getProperty(self, key: str, property_name: str) -> Any:
+        for container in self._containers:
+            value = container.getProperty(key, property_name)
+            if value is not None:
+                return value
+        return None
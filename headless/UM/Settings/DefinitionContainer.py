@@ -0,0 +1,35 @@
+import json
+from typing import Any, Dict
+
+from .ContainerFormatError import ContainerFormatError
+from .Interfaces import DefinitionContainerInterface
+
+
+#   Definition that only knows the default values of its settings.
+class DefinitionContainer(DefinitionContainerInterface):
+    def __init__(self, container_id: str) -> None:
+        self._id = container_id
+        self._default_values = {}  # type: Dict[str, Any]
+        self._metadata = {}  # type: Dict[str, Any]
+
+    def getId(self) -> str:
+        return self._id
+
+    def deserialize(self, serialized: str) -> str:
+        try:
+            parsed = json.loads(serialized)
+        except ValueError as e:
+            raise ContainerFormatError(str(e))
+        self._metadata = dict(parsed.get("metadata", {}))
+        self._metadata["setting_version"] = parsed.get("version", 0)
+        for key, setting in parsed.get("settings", {}).items():
+            self._default_values[key] = setting.get("default_value")
+        return serialized
+
+    def getMetaDataEntry(self, key: str, default: Any = None) -> Any:
+        return self._metadata.get(key, default)
+
+    def getProperty(self, key: str, property_name: str) -> Any:
+        if property_name == "value":
+            return self._default_values.get(key)
+        return None
@@ -0,0 +1,35 @@
+from typing import Any, Dict, Optional
+
+from ..Signal import Signal
+
+
+class InstanceContainer:
+    def __init__(self, container_id: str) -> None:
+        self._id = container_id
+        self._definition_id = None  # type: Optional[str]
+        self._values = {}  # type: Dict[str, Any]
+        self._metadata = {}  # type: Dict[str, Any]
+        self.propertyChanged = Signal()
+
+    def getId(self) -> str:
+        return self._id
+
+    def setDefinition(self, definition_id: str) -> None:
+        self._definition_id = definition_id
+
+    def setMetaDataEntry(self, key: str, value: Any) -> None:
+        self._metadata[key] = value
+
+    def getMetaDataEntry(self, key: str, default: Any = None) -> Any:
+        return self._metadata.get(key, default)
+
+    def setProperty(self, key: str, property_name: str, value: Any) -> None:
+        if property_name != "value" or self._values.get(key) == value:
+            return
+        self._values[key] = value
+        self.propertyChanged.emit(key, property_name)
+
+    def getProperty(self, key: str, property_name: str) -> Any:
+        if property_name == "value":
+            return self._values.get(key)
+        return None
@@ -0,0 +1,23 @@
+from typing import Any, Callable, List
+
+
+#   Synchronous replacement of UM.Signal.Signal: emit calls all connected slots directly.
+class Signal:
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        self._slots = []  # type: List[Callable[..., Any]]
+
+    def connect(self, slot: Callable[..., Any]) -> None:
+        if slot not in self._slots:
+            self._slots.append(slot)
+
+    def disconnect(self, slot: Callable[..., Any]) -> None:
+        if slot in self._slots:
+            self._slots.remove(slot)
+
+    def emit(self, *args: Any, **kwargs: Any) -> None:
+        for slot in list(self._slots):
+            slot(*args, **kwargs)
+
+
+def signalemitter(cls: type) -> type:
+    return cls
@@ -0,0 +1,2 @@
+# Minimal stand-in for the parts of Uranium that the PostProcessingPlugin uses, so the scripts can run without Cura.
+# It is only put on the path by the headless tools when the real Uranium can't be imported.
@@ -0,0 +1,12 @@
+from typing import Any, Optional
+
+
+class i18nCatalog:
+    def __init__(self, name: Optional[str] = None) -> None:
+        self._name = name
+
+    def i18n(self, text: str, *args: Any) -> str:
+        return text % args if args else text
+
+    def i18nc(self, context: str, text: str, *args: Any) -> str:
+        return text % args if args else text
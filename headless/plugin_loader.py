@@ -0,0 +1,52 @@
+# Copyright (c) 2020 Louis Wouters
+# The PostProcessingPlugin is released under the terms of the AGPLv3 or higher.
+
+# Loads the PostProcessingPlugin and its scripts outside of Cura.
+# If Uranium can't be imported, the minimal UM package next to this file is used instead.
+
+import glob
+import importlib
+import os
+import sys
+import types
+from typing import Any, Dict, List, Optional
+
+HEADLESS_DIR = os.path.dirname(os.path.abspath(__file__))
+PLUGIN_DIR = os.path.dirname(HEADLESS_DIR)
+PACKAGE_NAME = "PostProcessingPlugin"
+
+
+def loadPlugin() -> types.ModuleType:
+    if PACKAGE_NAME in sys.modules:
+        return sys.modules[PACKAGE_NAME]
+    try:
+        import UM  # noqa: F401
+    except ImportError:
+        sys.path.insert(0, HEADLESS_DIR)
+
+    # The scripts import the Script class with a relative import, so the plugin directory must be loaded as a package.
+    package = types.ModuleType(PACKAGE_NAME)
+    package.__path__ = [PLUGIN_DIR]
+    sys.modules[PACKAGE_NAME] = package
+    return package
+
+
+def importPluginModule(name: str) -> types.ModuleType:
+    loadPlugin()
+    return importlib.import_module(PACKAGE_NAME + "." + name)
+
+
+#   Names of the scripts in the scripts directory, which are also the names of their classes.
+def getScriptNames() -> List[str]:
+    paths = glob.glob(os.path.join(PLUGIN_DIR, "scripts", "*.py"))
+    return sorted(os.path.splitext(os.path.basename(path))[0] for path in paths)
+
+
+#   Creates and initializes a script, with the default values of its settings replaced by the given settings.
+def createScript(name: str, settings: Optional[Dict[str, Any]] = None) -> Any:
+    module = importPluginModule("scripts." + name)
+    script = getattr(module, name)()
+    script.initialize()
+    for key, value in (settings or {}).items():
+        script._instance.setProperty(key, "value", value)
+    return script
@@ -0,0 +1,278 @@
+# Copyright (c) 2020 Louis Wouters
+# The PostProcessingPlugin is released under the terms of the AGPLv3 or higher.
+
+# Post-processes .gcode and .gcode.gz files with the scripts of the plugin, without Cura.
+#
+# The settings of the scripts start at the defaults from their setting data and can be changed with a JSON file
+# and/or on the command line. The files are split into the sections Cura hands to the scripts (the start code, one
+# section per ;LAYER: and the end code) while reading, and streamed through the scripts to the output file. Scripts
+# that need all layers up front, such as ShowProgress with the remaining time estimated from the moves, get the
+# complete file in memory instead.
+#
+# Usage: python headless/post_process.py [--config scripts.json] [--script NAME ...] [--set NAME.key=value ...]
+#                                        [--output-dir DIR] [--jobs N] [--layer-workers N]
+#                                        [--encode FORMAT [--no-compress]] [--profile LOG [--cprofile-dir DIR]]
+#                                        FILE_OR_DIRECTORY ...
+#
+# With --layer-workers the layers of layer-local scripts are processed by a pool of worker processes (see LayerRunner).
+# The whole file is then read into memory instead of being streamed.
+#
+# With --profile the cost of every script (every stage of the streaming pipeline, see ScriptProfiler) is appended to
+# LOG as JSON lines, and with --cprofile-dir a cProfile dump of every script is written as well.
+#
+# With --encode the result is written in a compact format of GCodeEncoder instead of as text: "meatpack" (.meatpack),
+# "blocks" or "blocks-meatpack" (.gcb, compressed with zlib unless --no-compress is given).
+#
+# The JSON file lists the scripts in the order they are run:
+#   {"scripts": [{"name": "ShowProgress", "settings": {"speed_factor": 0.9}}, {"name": "StartLayerNumberingAt1"}]}
+
+import argparse
+import glob
+import gzip
+import json
+import mmap
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, BinaryIO, Dict, Iterable, Iterator, List, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import plugin_loader  # noqa: E402
+
+# Worker processes that are spawned import this module first, so they find the plugin package like this process.
+plugin_loader.loadPlugin()
+
+LAYER_MARKER = b"\n;LAYER:"
+TIME_ELAPSED_MARKER = "\n;TIME_ELAPSED:"
+CHUNK_SIZE = 1 << 20
+
+#   (script name, settings) in the order the scripts are run.
+ScriptConfiguration = List[Tuple[str, Dict[str, Any]]]
+
+
+#   Splits a memory-mapped file into sections at the start of every ;LAYER: line.
+def _readMapped(path: str) -> Iterator[bytes]:
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ) as mapped:
+            start = 0
+            while True:
+                boundary = mapped.find(LAYER_MARKER, start)
+                if boundary == -1:
+                    break
+                yield mapped[start:boundary + 1]
+                start = boundary + 1
+            yield mapped[start:]
+
+
+#   Splits a file that is read in chunks into sections at the start of every ;LAYER: line.
+def _readChunked(f: BinaryIO) -> Iterator[bytes]:
+    pending = bytearray()
+    search_from = 0
+    while True:
+        chunk = f.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        pending += chunk
+        start = 0
+        while True:
+            boundary = pending.find(LAYER_MARKER, search_from)
+            if boundary == -1:
+                break
+            yield bytes(pending[start:boundary + 1])
+            start = search_from = boundary + 1
+        del pending[:start]
+        search_from = max(0, len(pending) - len(LAYER_MARKER) + 1)
+    if pending:
+        yield bytes(pending)
+
+
+#   Reads the sections of a .gcode or .gcode.gz file.
+#   The end code is split off the last layer after its ;TIME_ELAPSED: line, like Cura does.
+def readSections(path: str) -> Iterator[str]:
+    if path.endswith(".gz"):
+        with gzip.open(path, "rb") as f:
+            yield from _splitEndCode(section.decode("utf-8") for section in _readChunked(f))
+    else:
+        yield from _splitEndCode(section.decode("utf-8") for section in _readMapped(path))
+
+
+def _splitEndCode(sections: Iterable[str]) -> Iterator[str]:
+    last_section = None
+    for section in sections:
+        if last_section is not None:
+            yield last_section
+        last_section = section
+    if last_section is None:
+        return
+
+    time_elapsed_position = last_section.rfind(TIME_ELAPSED_MARKER) if last_section.startswith(";LAYER:") else -1
+    end_of_layer = last_section.find("\n", time_elapsed_position + 1) + 1 if time_elapsed_position != -1 else 0
+    if 0 < end_of_layer < len(last_section):
+        yield last_section[:end_of_layer]
+        yield last_section[end_of_layer:]
+    else:
+        yield last_section
+
+
+#   Converts a setting value from the command line to the type of the setting.
+def convertSettingValue(setting_type: str, text: str) -> Any:
+    if setting_type == "int":
+        return int(text)
+    if setting_type == "float":
+        return float(text)
+    if setting_type == "bool":
+        if text.lower() not in ("true", "false", "1", "0", "yes", "no"):
+            raise ValueError("not a bool: " + text)
+        return text.lower() in ("true", "1", "yes")
+    return text
+
+
+#   Checks the settings against the setting data of the scripts and converts values given as text.
+def validateConfiguration(configuration: ScriptConfiguration) -> None:
+    available_scripts = plugin_loader.getScriptNames()
+    for name, settings in configuration:
+        if name not in available_scripts:
+            raise ValueError("Unknown script {name}, available scripts are {scripts}".format(name = name, scripts = ", ".join(available_scripts)))
+        setting_definitions = plugin_loader.createScript(name).getSettingData()["settings"]
+        for key, value in list(settings.items()):
+            if key not in setting_definitions:
+                raise ValueError("Unknown setting {name}.{key}, available settings are {keys}".format(name = name, key = key, keys = ", ".join(setting_definitions)))
+            if isinstance(value, str):
+                settings[key] = convertSettingValue(setting_definitions[key].get("type", "str"), value)
+
+
+def outputPath(path: str, output_dir: str, output_format: str = "") -> str:
+    directory, file_name = os.path.split(path)
+    compressed = file_name.endswith(".gz")
+    stem = file_name[:-len(".gcode.gz")] if compressed else os.path.splitext(file_name)[0]
+    if output_format:
+        extension = ".meatpack" if output_format == "meatpack" else ".gcb"
+    else:
+        extension = ".gcode" + (".gz" if compressed else "")
+    return os.path.join(output_dir or directory, stem + "_processed" + extension)
+
+
+#   Processes a single file and returns the statistics that are printed for it.
+#   \param output_format Format of GCodeEncoder to write the result in, or "" for text.
+#   \param layer_workers Number of worker processes for the layers of layer-local scripts, 1 to stream the file
+#   through the scripts instead.
+#   \param profile File to append the statistics of ScriptProfiler to, or "" to not profile the scripts.
+#   \param cprofile_dir Directory for the cProfile dumps of ScriptProfiler, or "" for none.
+def processFile(path: str, output_dir: str, configuration: ScriptConfiguration, output_format: str = "", compress: bool = True,
+                layer_workers: int = 1, profile: str = "", cprofile_dir: str = "") -> Dict[str, Any]:
+    start = time.perf_counter()
+    if profile:
+        profiler = plugin_loader.importPluginModule("ScriptProfiler").ScriptProfiler(profile, cprofile_dir or None)
+        plugin_loader.importPluginModule("Script").Script.setProfiler(profiler)
+    scripts = [plugin_loader.createScript(name, settings) for name, settings in configuration]
+    if layer_workers > 1:
+        layer_runner = plugin_loader.importPluginModule("LayerRunner").LayerRunner(layer_workers)
+        processed = iter(layer_runner.runScripts(scripts, list(readSections(path))))  # type: Iterator[str]
+    else:
+        processed = plugin_loader.importPluginModule("ScriptPipeline").ScriptPipeline(scripts).executeStream(readSections(path))
+    encoder = plugin_loader.importPluginModule("GCodeEncoder").createEncoder(output_format, compress) if output_format else None
+
+    output = outputPath(path, output_dir, output_format)
+    sections = 0
+    output_bytes = 0
+    open_output = gzip.open if output.endswith(".gz") else open
+    with open_output(output, "wb") as f:
+        for section in processed:
+            encoded = encoder.encode(section) if encoder is not None else section.encode("utf-8")
+            f.write(encoded)
+            sections += 1
+            output_bytes += len(encoded)
+        if encoder is not None:
+            encoded = encoder.finish()
+            f.write(encoded)
+            output_bytes += len(encoded)
+    return {"input": path, "output": output, "sections": sections, "input_bytes": os.path.getsize(path),
+            "output_bytes": output_bytes, "seconds": time.perf_counter() - start}
+
+
+def findInputFiles(paths: List[str]) -> List[str]:
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files += sorted(glob.glob(os.path.join(path, "*.gcode")) + glob.glob(os.path.join(path, "*.gcode.gz")))
+        else:
+            files.append(path)
+    return [path for path in files if "_processed.gcode" not in os.path.basename(path)]
+
+
+def parseConfiguration(args: argparse.Namespace) -> ScriptConfiguration:
+    configuration = []  # type: ScriptConfiguration
+    if args.config:
+        with open(args.config) as f:
+            for entry in json.load(f)["scripts"]:
+                configuration.append((entry["name"], dict(entry.get("settings", {}))))
+    configuration += [(name, {}) for name in args.script]
+
+    for assignment in args.set:
+        key, separator, value = assignment.partition("=")
+        name, _, key = key.partition(".")
+        if not separator or not key:
+            raise ValueError("Settings are set as NAME.key=value, not " + assignment)
+        matching = [settings for script_name, settings in configuration if script_name == name]
+        if not matching:
+            raise ValueError("Script {name} is not in the list of scripts to run".format(name = name))
+        for settings in matching:
+            settings[key] = value
+    return configuration
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description = "Post-process g-code files with the PostProcessingPlugin scripts")
+    parser.add_argument("inputs", nargs = "+", help = ".gcode or .gcode.gz files, or directories with them")
+    parser.add_argument("--config", help = "JSON file with the scripts to run and their settings")
+    parser.add_argument("--script", action = "append", default = [], help = "Script to run with its default settings")
+    parser.add_argument("--set", action = "append", default = [], metavar = "NAME.key=value", help = "Change a setting of a script")
+    parser.add_argument("--output-dir", default = "", help = "Directory for the processed files, by default next to the input")
+    parser.add_argument("--jobs", type = int, default = 1, help = "Number of files to process concurrently")
+    parser.add_argument("--layer-workers", type = int, default = 1, help = "Number of processes for the layers of layer-local scripts, which reads every file into memory")
+    parser.add_argument("--encode", default = "", choices = ["meatpack", "blocks", "blocks-meatpack"], help = "Write the result in a compact format instead of as text")
+    parser.add_argument("--no-compress", action = "store_true", help = "Don't compress the blocks of the block formats")
+    parser.add_argument("--profile", default = "", metavar = "LOG", help = "Append the time and memory every script takes to this file as JSON lines")
+    parser.add_argument("--cprofile-dir", default = "", metavar = "DIR", help = "Write a cProfile dump of every script to this directory, with --profile")
+    args = parser.parse_args()
+
+    try:
+        configuration = parseConfiguration(args)
+        validateConfiguration(configuration)
+    except (ValueError, KeyError, OSError) as e:
+        parser.error(str(e))
+    if not configuration:
+        parser.error("No scripts to run, use --script or --config")
+    if args.jobs > 1 and args.layer_workers > 1:
+        parser.error("--jobs and --layer-workers can't be combined")
+    if args.cprofile_dir and not args.profile:
+        parser.error("--cprofile-dir requires --profile")
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok = True)
+
+    files = findInputFiles(args.inputs)
+    start = time.perf_counter()
+    if args.jobs > 1:
+        with ProcessPoolExecutor(max_workers = args.jobs) as pool:
+            results = pool.map(processFile, files, [args.output_dir] * len(files), [configuration] * len(files),
+                               [args.encode] * len(files), [not args.no_compress] * len(files), [1] * len(files),
+                               [args.profile] * len(files), [args.cprofile_dir] * len(files))
+            for result in results:
+                printResult(result)
+    else:
+        for path in files:
+            printResult(processFile(path, args.output_dir, configuration, args.encode, not args.no_compress, args.layer_workers,
+                                    args.profile, args.cprofile_dir))
+    print("Processed {count} file(s) in {seconds:.2f} s".format(count = len(files), seconds = time.perf_counter() - start))
+
+
+def printResult(result: Dict[str, Any]) -> None:
+    print("{input} -> {output}: {sections} sections, {input_mb:.1f} MB in, {output_mb:.1f} MB out, {seconds:.2f} s".format(
+        input_mb = result["input_bytes"] / 1e6, output_mb = result["output_bytes"] / 1e6, **result))
+
+
+if __name__ == "__main__":
+    main()
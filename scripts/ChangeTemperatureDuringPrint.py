@@ -3,13 +3,35 @@
 # Date:     06-06-2020
 
 # Description:  This plugin will change the temperature of the heated bed and/or nozzle at specified timestamps/layers
+#               Additionally a schedule of any number of temperature changes after a layer, after a time or at a height
+#               can be given.
 
+import re
+from bisect import bisect_left
+
+from UM.Logger import Logger
+
+from ..LineView import LineView
 from ..Script import Script
 
+# a schedule entry, e.g. "layer 10: M140 50", "minutes 90: M140 0" or "z 20.5: M109 195"
+SCHEDULE_ENTRY = re.compile(r"^\s*(layer|minutes|z)\s+(-?[0-9]+\.?[0-9]*)\s*:\s*(M140|M104|M109)\s+S?([0-9]+)\s*$", re.IGNORECASE)
+
 
 class ChangeTemperatureDuringPrint(Script):
     def __init__(self):
         super().__init__()
+        # state of the current pass over the layers
+        self._insert_gcode = ""
+        self._change_temperature_after_layer = 0
+        self._minimum_minutes_after_first_layer = 0
+        self._first_layer_duration_seconds = 0
+        self._minutes_after_first_layer = 0
+        self._searching = False
+        self._turn_off_after_layer = None
+        self._schedule = {}
+        self._schedule_positions = {}
+        self._layer_z = 0.0
 
     def getSettingDataString(self):
         return """{
@@ -50,76 +72,159 @@ class ChangeTemperatureDuringPrint(Script):
                     "type": "int",
                     "unit": "minutes",
                     "default_value": 0
+                },
+                "temperature_schedule":
+                {
+                    "label": "Temperature schedule",
+                    "description": "More temperature changes, separated by commas. Each change starts with 'layer N' (after N layers), 'minutes M' (M minutes after the first layer) or 'z H' (from height H mm), followed by ':' and M140 (bed), M104 (nozzle) or M109 (nozzle, wait until heated) with the temperature. For example: layer 10: M140 50, minutes 90: M140 0, z 20: M104 195",
+                    "type": "str",
+                    "default_value": ""
                 }
             }
         }"""
 
-    def execute(self, data):
-
-        # Search for the number of layers and the total time from the start code
-        first_layer_index = 0
-        time_total = 0
-        number_of_layers = 0
-        for index in range(len(data)):
-            data_section = data[index]
-            if data_section.startswith(";LAYER:"):  # we have everything we need
-                first_layer_index = index           # ...save the index of the first layer
-                break                               # ......and exit the loop
-            else:
-                for line in data_section.split("\n"):  # Separate into lines
-                    if line.startswith(";LAYER_COUNT:"):
-                        number_of_layers = int(line.split(":")[1])  # Save total layers in a variable
-                    elif line.startswith(";TIME:"):
-                        time_total = int(line.split(":")[1])  # Save total time in a variable
-
-        # Check if adjustments to the G-code are necessary
-        change_temperature_after_layer = self.getSettingValueByKey("change_temperature_after_layer")
-        minimum_minutes_after_first_layer = self.getSettingValueByKey("minimum_minutes_after_first_layer")
-        if number_of_layers <= change_temperature_after_layer or time_total / 60 < minimum_minutes_after_first_layer:
-            return data  # No adjustment needed, let the end G-code turn of the bed and the nozzle
+    #  G-code of a single temperature change
+    @staticmethod
+    def _temperatureGCode(command, temperature):
+        heater = "bed" if command == "M140" else "nozzle"
+        if temperature == 0:
+            return command + " S0 ; Turn off " + heater + "\n"
+        wait = " and wait" if command == "M109" else ""
+        return command + " S" + str(temperature) + " ; Set " + heater + " to " + str(temperature) + "°C" + wait + "\n"
 
-        #  determine after which layer enough time has passed
-        first_layer_duration_seconds = 0
-        minutes_after_first_layer = 0
-        minimum_layer = 0
-        for layer_counter in range(number_of_layers):
-            if layer_counter + 1 == number_of_layers:
-                return data  # No adjustment needed, let the end G-code turn of the bed and the nozzle
-
-            #  create a list where each element is a single line of code within the layer
-            lines = data[first_layer_index + layer_counter].split("\n")
-
-            # search for TIME_ELAPSED at the end of the layer
-            for line_index in range(len(lines) - 1, -1, -1):
-                line = lines[line_index]  # store the line as a string
-                if line.startswith(";TIME_ELAPSED:"):
-                    time_elapsed = float(line.split(":")[1])
-                    if layer_counter == 0:
-                        first_layer_duration_seconds = time_elapsed
-                    else:
-                        minutes_after_first_layer = (time_elapsed - first_layer_duration_seconds) / 60
-                    break
-
-            if minutes_after_first_layer >= minimum_minutes_after_first_layer:
-                minimum_layer = layer_counter + 1
-                break
+    #  Parses the schedule into a list of (threshold, order, G-code) per trigger, sorted by threshold
+    @classmethod
+    def _parseSchedule(cls, schedule_text):
+        schedule = {"layer": [], "minutes": [], "z": []}
+        for order, entry in enumerate((schedule_text or "").split(",")):
+            if not entry.strip():
+                continue
+            match = SCHEDULE_ENTRY.match(entry)
+            if match is None:
+                Logger.log("w", "Ignoring temperature schedule entry '%s'", entry.strip())
+                continue
+            trigger, threshold, command, temperature = match.groups()
+            schedule[trigger.lower()].append((float(threshold), order, cls._temperatureGCode(command.upper(), int(temperature))))
+        for events in schedule.values():
+            events.sort()
+        return {trigger: events for trigger, events in schedule.items() if events}
+
+    def onHeader(self, sections, index):
 
         #  construct the G-code that needs to be inserted
         insert_gcode = ""
         bed_temperature = self.getSettingValueByKey("bed_temperature")
         nozzle_temperature = self.getSettingValueByKey("nozzle_temperature")
-        if bed_temperature > 0:
-            insert_gcode += "M140 S"+str(bed_temperature)+" ; Set bed to "+str(bed_temperature)+"°C\n"
-        elif bed_temperature == 0:
-            insert_gcode += "M140 S0 ; Turn off bed\n"
-        if nozzle_temperature > 0:
-            insert_gcode += "M104 S"+str(nozzle_temperature)+" ; Set nozzle to "+str(nozzle_temperature)+"°C\n"
-        elif nozzle_temperature == 0:
-            insert_gcode += "M104 S0 ; Turn off nozzle\n"
-
-        #  add the constructed G-dode at the end of the layer
-        turn_off_after_layer = max(minimum_layer, change_temperature_after_layer)
-        layer_index = first_layer_index + turn_off_after_layer - 1  # index of the layer where the code is inserted
-        data[layer_index] += insert_gcode
-
-        return data
+        if bed_temperature >= 0:
+            insert_gcode += self._temperatureGCode("M140", bed_temperature)
+        if nozzle_temperature >= 0:
+            insert_gcode += self._temperatureGCode("M104", nozzle_temperature)
+        self._insert_gcode = insert_gcode
+
+        #  the schedule is resolved in the same pass over the layers, every trigger has a queue sorted by threshold
+        self._schedule = self._parseSchedule(self.getSettingValueByKey("temperature_schedule"))
+        self._schedule_positions = {trigger: 0 for trigger in self._schedule}
+        self._layer_z = 0.0
+
+        self._change_temperature_after_layer = self.getSettingValueByKey("change_temperature_after_layer")
+        self._minimum_minutes_after_first_layer = self.getSettingValueByKey("minimum_minutes_after_first_layer")
+        self._first_layer_duration_seconds = 0
+        self._minutes_after_first_layer = 0
+        self._turn_off_after_layer = None
+
+        # Check if adjustments to the G-code are necessary (the number of layers and the total time come from the start code)
+        self._searching = index.layer_count > self._change_temperature_after_layer and index.time_total / 60 >= self._minimum_minutes_after_first_layer
+
+        # When all layers are known, look up after which layer enough time has passed right away
+        if self._searching and index.isComplete():
+            self._searching = False
+            minimum_layer = self._findMinimumLayer(index)
+            if minimum_layer is not None:
+                self._turn_off_after_layer = max(minimum_layer, self._change_temperature_after_layer)
+
+    #  Finds the first layer after which enough time has passed with a binary search in the cumulative time table.
+    #  Returns None if that is the last layer or later, then the end G-code turns off the bed and the nozzle.
+    def _findMinimumLayer(self, index):
+        time_elapsed = index.time_elapsed
+        last_layer_counter = min(index.layer_count, len(time_elapsed)) - 1
+        minimum_minutes = self._minimum_minutes_after_first_layer
+        if last_layer_counter <= 0:
+            return None
+        if minimum_minutes <= 0:
+            return 1  # the first layer already counts as 0 minutes after the first layer
+
+        first_layer_duration_seconds = time_elapsed[0]
+        layer_counter = bisect_left(time_elapsed, first_layer_duration_seconds + minimum_minutes * 60, 1, last_layer_counter)
+        # correct for rounding, so the result is the same as comparing the minutes layer by layer
+        while layer_counter > 1 and (time_elapsed[layer_counter - 1] - first_layer_duration_seconds) / 60 >= minimum_minutes:
+            layer_counter -= 1
+        while layer_counter < last_layer_counter and (time_elapsed[layer_counter] - first_layer_duration_seconds) / 60 < minimum_minutes:
+            layer_counter += 1
+        if layer_counter >= last_layer_counter:
+            return None
+        return layer_counter + 1
+
+    def onLayer(self, layer_counter, layer, index):
+
+        #  determine after which layer enough time has passed
+        if self._searching:
+            if layer_counter + 1 >= index.layer_count:
+                self._searching = False  # No adjustment needed, let the end G-code turn of the bed and the nozzle
+            else:
+                # TIME_ELAPSED at the end of the layer
+                time_elapsed = index.time_elapsed[layer_counter]
+                if layer_counter == 0:
+                    self._first_layer_duration_seconds = time_elapsed
+                else:
+                    self._minutes_after_first_layer = (time_elapsed - self._first_layer_duration_seconds) / 60
+
+                if self._minutes_after_first_layer >= self._minimum_minutes_after_first_layer:
+                    minimum_layer = layer_counter + 1
+                    self._turn_off_after_layer = max(minimum_layer, self._change_temperature_after_layer)
+                    self._searching = False
+
+        #  add the constructed G-code at the end of the layer
+        if layer_counter + 1 == self._turn_off_after_layer:
+            layer.append(self._insert_gcode)
+
+        if self._schedule:
+            self._applySchedule(layer_counter, layer, index)
+
+    #  Inserts the scheduled changes of this layer: changes at a height at the start of the first layer at or above
+    #  that height, changes after a number of layers or minutes at the end of the layer where they are due
+    def _applySchedule(self, layer_counter, layer, index):
+        if "z" in self._schedule:
+            layer_z = self._findLayerZ(layer.getText())
+            if layer_z is not None:
+                self._layer_z = layer_z
+            due_events = self._popDueEvents("z", self._layer_z)
+            if due_events:  # a single insert, later inserts would come before earlier ones
+                layer.insertAfterFirstLine("".join(gcode for _, _, gcode in sorted(due_events, key = lambda event: event[1])).rstrip("\n"))
+
+        due_events = self._popDueEvents("layer", layer_counter + 1)
+        if "minutes" in self._schedule:
+            time_elapsed = index.time_elapsed
+            minutes_after_first_layer = (time_elapsed[layer_counter] - time_elapsed[0]) / 60 if layer_counter > 0 else 0
+            due_events += self._popDueEvents("minutes", minutes_after_first_layer)
+        for _, _, gcode in sorted(due_events, key = lambda event: event[1]):  # in the order of the schedule
+            layer.append(gcode)
+
+    #  Finds the Z of the first move of a layer that has one, reading only the moves up to that one
+    def _findLayerZ(self, layer_text):
+        for _, line in LineView(layer_text).startingWith("G"):
+            if line.startswith(("G0 ", "G1 ")):
+                z = self.getValue(line, "Z")
+                if z is not None:
+                    return float(z)
+        return None
+
+    #  Removes the events of a trigger with a threshold up to the given value from its queue
+    def _popDueEvents(self, trigger, value):
+        events = self._schedule.get(trigger)
+        if not events:
+            return []
+        start = position = self._schedule_positions[trigger]
+        while position < len(events) and events[position][0] <= value:
+            position += 1
+        self._schedule_positions[trigger] = position
+        return events[start:position]
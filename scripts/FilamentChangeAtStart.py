@@ -2,12 +2,87 @@
 # Author:   Louis Wouters
 # Date:     06-06-2020
 
+# Description:  This plugin pauses the print at the start to change the filament and cleans the nozzle with purge lines.
+#               Additionally it can change the filament of every other extruder when it is used for the first time
+#               (with purge lines on the first layer, with M600 on later layers) and change the filament with M600 at
+#               the start of any layer.
+
+import math
+import re
+from functools import lru_cache
+
+from UM.Application import Application
+from UM.Logger import Logger
+
+from ..LineView import LineView
 from ..Script import Script
 
+# a tool change, e.g. "T1"
+TOOL_CHANGE = re.compile(r"^T([0-9]+)", re.MULTILINE)
+
+# machine settings that the purge lines are computed from when they aren't known, e.g. without Cura
+DEFAULT_MACHINE_SETTINGS = {"machine_width": 220.0, "machine_depth": 220.0, "machine_nozzle_size": 0.4, "material_diameter": 1.75}
+
+# the cleaning lines of a tool that is first used on the first layer must stay this far from the print, in mm
+PRINT_CLEARANCE = 5.0
+
+# distance between the original cleaning lines of consecutive tools, in mm
+FIXED_PURGE_GAP = 5.0
+
+
+#  The original cleaning lines: from X0.1 Y20 (or further right for other tools), 180 mm long
+@lru_cache(maxsize = 32)
+def fixedPurgeLines(number_of_cleaning_lines, start_x = 0.1):
+    return "".join([
+        "M117 Cleaning nozzle\nG1 X{x} Y20 Z0.3 F5000.0 ; Move to start position\nG91\n".format(x = start_x),
+        "G1 Y180 F1500 E15 ; Up\nG1 X0.3 F5000 ; Right\nG1 Y-180 F1500.0 E15 ; Down\nG1 X0.3 F5000 ; Right\n" * number_of_cleaning_lines,
+        "G1 Z1.7 F3000 ; Move Z Axis up little to prevent scratching of Heat Bed\nG1 X5  Z-1.7 F5000 ; Move over to prevent blob squish\nG90\nG92 E0 ; Reset Extruder\n"
+    ])
+
+
+#  Purge lines along the Y axis, back and forth, starting at (start_x, start_y) in absolute coordinates
+@lru_cache(maxsize = 32)
+def purgeLines(start_x, start_y, length, spacing, height, extrusion, number_of_cleaning_lines):
+    line_pair = "G1 Y{length:.3f} F1500 E{extrusion:.5f} ; Up\nG1 X{spacing:.3f} F5000 ; Right\n" \
+                "G1 Y-{length:.3f} F1500 E{extrusion:.5f} ; Down\nG1 X{spacing:.3f} F5000 ; Right\n".format(length = length, extrusion = extrusion, spacing = spacing)
+    return "".join([
+        "M117 Cleaning nozzle\nG1 X{x:.3f} Y{y:.3f} Z{z:.3f} F5000 ; Move to start position\nG91\n".format(x = start_x, y = start_y, z = height),
+        line_pair * number_of_cleaning_lines,
+        "G1 Z1.7 F3000 ; Move Z Axis up little to prevent scratching of Heat Bed\nG1 X5 Z-1.7 F5000 ; Move over to prevent blob squish\nG90\nG92 E0 ; Reset Extruder\n"
+    ])
+
+
+#  Filament change of a tool (None for the tool the print starts with) followed by purge lines
+@lru_cache(maxsize = 32)
+def changeSequence(tool, purge_lines):
+    if tool is None:
+        change = "G1 Z2.0 F3000 ; Move Z Axis up little to prevent scratching of Heat Bed\nM0 ; wait for user input\nG28 ; home\nG29 ; auto bed level\n"
+    else:  # on the first layer, after the tool change
+        change = "G91\nG1 Z2.0 F3000 ; Move Z Axis up little to prevent scratching of the first layer\nG90\n" \
+                 "M117 Change filament T{tool}\nM0 ; wait for user input\n".format(tool = tool)
+    return change + purge_lines
+
+
+#  Moves back to where the layer was before a filament change within the layer, above the parts that are printed already
+@lru_cache(maxsize = 32)
+def returnSequence(x, y, z, feedrate):
+    sequence = "G91\nG1 Z2.0 F3000 ; Move Z Axis up little to prevent scratching of the first layer\nG90\n"
+    if x is not None or y is not None:
+        sequence += "G0 F5000" + (" X{x}".format(x = x) if x is not None else "") + (" Y{y}".format(y = y) if y is not None else "") + " ; Move back to the layer\n"
+    if z is not None:
+        sequence += "G0 F3000 Z{z}\n".format(z = z)
+    if feedrate is not None:
+        sequence += "G1 F{feedrate}\n".format(feedrate = feedrate)
+    return sequence
+
 
 class FilamentChangeAtStart(Script):
     def __init__(self):
         super().__init__()
+        self._initial_tool = 0
+        self._used_tools = set()
+        self._change_layers = set()
+        self._print_min_x = None
 
     def getSettingDataString(self):
         return """{
@@ -20,7 +95,7 @@ class FilamentChangeAtStart(Script):
                 "enabled":
                 {
                     "label": "Enabled",
-                    "description": "If checked, filament change will be done at the start of the print",
+                    "description": "If checked, filament change will be done at the start of the print. If unchecked, the script leaves the g-code unmodified.",
                     "type": "bool",
                     "default_value": true
                 },
@@ -31,34 +106,186 @@ class FilamentChangeAtStart(Script):
                     "type": "int",
                     "unit": "lines",
                     "default_value": 3
+                },
+                "purge_geometry":
+                {
+                    "label": "Cleaning lines",
+                    "description": "Print the cleaning lines at the original fixed position (X0.1 Y20, 180 mm long), or along the left side of the bed, computed from the size of the bed, the nozzle size and the filament diameter.",
+                    "type": "enum",
+                    "options": {"fixed": "Fixed position", "bed": "From bed and nozzle"},
+                    "default_value": "fixed"
+                },
+                "purge_margin":
+                {
+                    "label": "Cleaning lines margin",
+                    "description": "Distance between the cleaning lines and the edges of the bed.",
+                    "type": "float",
+                    "unit": "mm",
+                    "default_value": 10,
+                    "minimum_value": "0",
+                    "enabled": "purge_geometry == 'bed'"
+                },
+                "purge_flow":
+                {
+                    "label": "Cleaning lines flow",
+                    "description": "Amount of filament extruded for the cleaning lines, relative to a line as wide as the nozzle.",
+                    "type": "float",
+                    "unit": "%",
+                    "default_value": 150,
+                    "minimum_value": "0",
+                    "enabled": "purge_geometry == 'bed'"
+                },
+                "purge_tool_changes":
+                {
+                    "label": "Change filament of other extruders",
+                    "description": "Also change the filament when another extruder is used for the first time: with cleaning lines next to the print on the first layer, if they fit, and with M600 otherwise.",
+                    "type": "bool",
+                    "default_value": false
+                },
+                "filament_change_layers":
+                {
+                    "label": "Filament change layers",
+                    "description": "Change the filament with M600 at the start of these layers, separated by commas, e.g. 10, 25.",
+                    "type": "str",
+                    "default_value": ""
                 }
             }
         }"""
 
-    def execute(self, data):
+    #  Value of a setting of the printer, or its default when there is no printer (e.g. without Cura)
+    @staticmethod
+    def _getMachineSetting(key):
+        global_container_stack = Application.getInstance().getGlobalContainerStack()
+        value = global_container_stack.getProperty(key, "value") if global_container_stack is not None else None
+        return value if value is not None else DEFAULT_MACHINE_SETTINGS[key]
+
+    #  Start and end X of the purge lines of the slot-th tool that is purged, from 0 for the tool the print starts with;
+    #  every tool gets its own lines next to those of the previous tool
+    def _purgeExtent(self, slot):
+        number_of_cleaning_lines = self.getSettingValueByKey("number_of_cleaning_lines")
+        if self.getSettingValueByKey("purge_geometry") != "bed":
+            width = 2 * number_of_cleaning_lines * 0.3 + 5  # including the move over at the end
+            start_x = 0.1 + slot * (width + FIXED_PURGE_GAP)
+            return round(start_x, 3), start_x + width
+        margin = self.getSettingValueByKey("purge_margin")
+        width = 2 * number_of_cleaning_lines * 2 * self._getMachineSetting("machine_nozzle_size") + 5
+        start_x = min(margin + slot * (width + margin), self._getMachineSetting("machine_width") - width)
+        return round(start_x, 3), start_x + width
+
+    #  Purge lines along the side of the bed, computed from the bed, the nozzle and the filament
+    def _purgeLines(self, start_x):
+        number_of_cleaning_lines = self.getSettingValueByKey("number_of_cleaning_lines")
+        margin = self.getSettingValueByKey("purge_margin")
+        nozzle_size = self._getMachineSetting("machine_nozzle_size")
+        spacing = 2 * nozzle_size
+        height = round(0.75 * nozzle_size, 3)
+        length = max(10.0, self._getMachineSetting("machine_depth") - 2 * margin)
+        filament_area = math.pi * (self._getMachineSetting("material_diameter") / 2) ** 2
+        extrusion = length * nozzle_size * height / filament_area * self.getSettingValueByKey("purge_flow") / 100
+        return purgeLines(start_x, round(margin, 3), round(length, 3), round(spacing, 3), height, round(extrusion, 5), number_of_cleaning_lines)
+
+    #  Filament change and purge lines of a tool, None for the tool the print starts with
+    def _changeSequence(self, tool, slot):
+        start_x, _ = self._purgeExtent(slot)
+        if self.getSettingValueByKey("purge_geometry") == "bed":
+            purge_lines = self._purgeLines(start_x)
+        else:
+            purge_lines = fixedPurgeLines(self.getSettingValueByKey("number_of_cleaning_lines"), start_x)
+        return changeSequence(tool, purge_lines)
 
+    #  Whether the purge lines of a tool fit on the bed to the left of the print, so they don't cross the parts that
+    #  are printed on the first layer already
+    def _purgeFitsBesidePrint(self, slot):
+        _, end_x = self._purgeExtent(slot)
+        return self._print_min_x is not None and end_x + PRINT_CLEARANCE <= self._print_min_x
+
+    def onHeader(self, sections, index):
+        self._change_layers = set()
         # if the feature is not enabled, return the original g-code file without modification
-        if not self.getSettingValueByKey("enabled"):
-            return data
+        if not self.getSettingValueByKey("enabled") or not sections:
+            return
 
-        # Search for first layer
-        first_layer_index = 0
+        for layer_number in self.getSettingValueByKey("filament_change_layers").split(","):
+            try:
+                self._change_layers.add(int(layer_number))
+            except ValueError:
+                if layer_number.strip():
+                    Logger.log("w", "Ignoring filament change layer '%s'", layer_number.strip())
 
-        for index in range(len(data)):
-            data_section = data[index]
-            if data_section.startswith(";LAYER:"):
-                first_layer_index = index           # ...save the index of the first layer
-                break                               # ......and exit the loop
+        #  the tool that is selected last in the start code is the one the print starts with, and the header holds
+        #  the left edge of the print
+        self._initial_tool = 0
+        self._print_min_x = None
+        for section in sections:
+            lines = LineView(section.getText())
+            for _, line in lines.startingWith("T"):
+                match = TOOL_CHANGE.match(line)
+                if match is not None:
+                    self._initial_tool = int(match.group(1))
+            min_x_line = lines.lastStartingWith(";MINX:")
+            if min_x_line is not None:
+                try:
+                    self._print_min_x = float(min_x_line.split(":")[1])
+                except ValueError:
+                    pass
+        self._used_tools = {self._initial_tool}
 
-        number_of_cleaning_lines = self.getSettingValueByKey("number_of_cleaning_lines")
-        insert_gcode = "G1 Z2.0 F3000 ; Move Z Axis up little to prevent scratching of Heat Bed\n"
-        insert_gcode += "M0 ; wait for user input\nG28 ; home\nG29 ; auto bed level\n"
-        insert_gcode += "M117 Cleaning nozzle\nG1 X0.1 Y20 Z0.3 F5000.0 ; Move to start position\nG91\n"
-        insert_gcode += "G1 Y180 F1500 E15 ; Up\nG1 X0.3 F5000 ; Right\nG1 Y-180 F1500.0 E15 ; Down\nG1 X0.3 F5000 ; Right\n" * number_of_cleaning_lines
-        insert_gcode += "G1 Z1.7 F3000 ; Move Z Axis up little to prevent scratching of Heat Bed\nG1 X5  Z-1.7 F5000 ; Move over to prevent blob squish\nG90\nG92 E0 ; Reset Extruder\n"
+        #  add the constructed G-code at the end of the section before the first layer
+        sections[-1].append(self._changeSequence(None, 0))
+
+    def onLayer(self, layer_counter, layer, index):
+        if not self.getSettingValueByKey("enabled"):
+            return
+        if self.getSettingValueByKey("purge_tool_changes"):
+            self._insertToolChanges(layer_counter, layer)
+
+        #  layers are numbered from 1, like in Cura's layer view
+        if layer_counter + 1 in self._change_layers:
+            layer.insertAfterFirstLine("M600 ; Change filament")
 
-        #  add the constructed G-code at the end of the layer
-        layer_index = first_layer_index - 1  # index of the layer where the code is inserted
-        data[layer_index] += insert_gcode
+    #  Inserts a filament change after the first tool change to every tool that wasn't used yet, in a single copy.
+    #  Purge lines can only be printed on the bed on the first layer, next to the print, after which the print head
+    #  returns to where the layer was. Otherwise the firmware purges with M600.
+    def _insertToolChanges(self, layer_counter, layer):
+        if not layer.mayContainAfterFirstLine("\nT"):
+            return
+        lines = LineView(layer.getText())
+        text = lines.getText()
+        pieces = []
+        start = 0
+        for line_start, line in lines.startingWith("T"):
+            match = TOOL_CHANGE.match(line)
+            if match is None or int(match.group(1)) in self._used_tools:
+                continue
+            tool = int(match.group(1))
+            slot = len(self._used_tools)
+            self._used_tools.add(tool)
+            end_of_line = lines.getNextLineStart(line_start)
+            pieces.append(text[start:end_of_line])
+            if end_of_line == len(text) and not text.endswith("\n"):
+                pieces.append("\n")
+            if layer_counter == 0 and self._purgeFitsBesidePrint(slot):
+                pieces.append(self._changeSequence(tool, slot) + returnSequence(*self._positionBefore(lines, line_start)))
+            else:
+                if layer_counter == 0:
+                    Logger.log("w", "No room for the cleaning lines of T%d next to the print, changing its filament with M600", tool)
+                pieces.append("M600 T{tool} ; Change filament\n".format(tool = tool))
+            start = end_of_line
+        if pieces:
+            pieces.append(text[start:])
+            layer.setText("".join(pieces))
 
-        return data
+    #  X, Y, Z and feedrate of the print head at an offset in the layer, as far as the moves before it set them
+    def _positionBefore(self, lines, end):
+        x = y = z = feedrate = None
+        for line_start, line in lines.startingWith("G"):
+            if line_start >= end:
+                break
+            code, new_x, new_y, new_z, new_feedrate = self.getValues(line, "GXYZF")
+            if code not in (0, 1):
+                continue
+            x = new_x if new_x is not None else x
+            y = new_y if new_y is not None else y
+            z = new_z if new_z is not None else z
+            feedrate = new_feedrate if new_feedrate is not None else feedrate
+        return x, y, z, feedrate
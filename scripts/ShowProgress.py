@@ -5,7 +5,15 @@
 
 # Description:  This plugin shows the current printing layer on your printers' LCD
 #               Additionally it can show the total layers and/or the remaining printing time.
+#               The remaining time is either Cura's estimate or estimated from the moves of the layers themselves.
+#               Optionally M73 progress commands are added, also within layers, for firmware that shows a progress bar.
 
+from array import array
+
+from UM.Logger import Logger
+
+from ..EtaModel import EtaModel
+from ..LineView import LineView
 from ..Script import Script
 
 
@@ -40,86 +48,206 @@ class ShowProgress(Script):
                     "label": "Speed factor",
                     "description": "Tweak this value to get better estimates. [Cura estimate]/[actual print time]. Usually this value is less than 1, since Cura tends to be too optimistic.",
                     "type": "float",
-                    "default_value": 1
+                    "default_value": 1,
+                    "enabled": "eta_mode == 'cura'"
+                },
+                "eta_mode":
+                {
+                    "label": "Remaining time estimate",
+                    "description": "Use Cura's estimate corrected by the speed factor, or estimate the time of every layer from its moves with the acceleration and correction factors of the printer.",
+                    "type": "enum",
+                    "options": {"cura": "Cura estimate", "model": "Estimate from moves"},
+                    "default_value": "cura",
+                    "enabled": "display_remaining_time or emit_progress"
+                },
+                "calibration_file":
+                {
+                    "label": "Calibration file",
+                    "description": "JSON file with the calibration coefficients of the printer: acceleration, travel_acceleration, print_factor, travel_factor, layer_overhead and feedrate. Leave empty for the defaults.",
+                    "type": "str",
+                    "default_value": "",
+                    "enabled": "(display_remaining_time or emit_progress) and eta_mode == 'model'"
+                },
+                "emit_progress":
+                {
+                    "label": "Add M73 progress",
+                    "description": "Also set the progress and the remaining time with M73 P<percent> R<minutes>, at the start of every layer and within layers at the interval below.",
+                    "type": "bool",
+                    "default_value": false
+                },
+                "progress_interval":
+                {
+                    "label": "M73 interval",
+                    "description": "Printing time between M73 commands within a layer.",
+                    "unit": "s",
+                    "type": "float",
+                    "default_value": 60,
+                    "minimum_value": "1",
+                    "enabled": "emit_progress"
                 }
             }
         }"""
 
-    def execute(self, data):
-        # get settings
-        display_total_layers = self.getSettingValueByKey("display_total_layers")
-        display_remaining_time = self.getSettingValueByKey("display_remaining_time")
-        speed_factor = self.getSettingValueByKey("speed_factor")
-
-        # initialize global variables
-        first_layer_index = 0
-        time_total = 0
-        number_of_layers = 0
-        time_elapsed = 0
+    #   The remaining time estimated from the moves depends on all layers after the current one.
+    def requiresCompleteData(self):
+        return (self.getSettingValueByKey("display_remaining_time") or self.getSettingValueByKey("emit_progress")) \
+            and self.getSettingValueByKey("eta_mode") == "model"
+
+    def getLayerContext(self, index):
+        context = {
+            "display_total_layers": self.getSettingValueByKey("display_total_layers"),
+            "display_remaining_time": self.getSettingValueByKey("display_remaining_time"),
+            "speed_factor": self.getSettingValueByKey("speed_factor"),
+            "number_of_layers": index.layer_count,
+            "time_total": index.time_total,
+            "time_elapsed": index.time_elapsed,
+            "emit_progress": self.getSettingValueByKey("emit_progress"),
+            "progress_interval": self.getSettingValueByKey("progress_interval")
+        }
+        model = None
+        if self.requiresCompleteData():
+            model = self._loadModel()
+            time_remaining = self._estimateTimeRemaining(index, model) if model is not None else None
+            if time_remaining is not None:
+                context["time_remaining"] = time_remaining
+        if context["emit_progress"]:  # the moves within a layer are timed with the model, calibrated or not
+            context["eta_coefficients"] = (model if model is not None else EtaModel()).getCoefficients()
+        return context
+
+    #   The model with the coefficients of the calibration file, or None if the file can't be loaded.
+    def _loadModel(self):
+        calibration_file = self.getSettingValueByKey("calibration_file")
+        try:
+            return EtaModel.load(calibration_file) if calibration_file else EtaModel()
+        except (OSError, ValueError, TypeError, AttributeError) as e:
+            Logger.log("w", "Can't load calibration file %s, using Cura's estimate: %s", calibration_file, e)
+            return None
+
+    #   Estimates the remaining time at the start of every layer from the moves of that layer and all layers after it.
+    #   Returns None if that isn't possible, in which case Cura's estimate is used.
+    def _estimateTimeRemaining(self, index, model):
+        if not index.isComplete():  # The layers after the current one aren't known, see requiresCompleteData.
+            Logger.log("w", "The remaining time can't be estimated from the moves while streaming, using Cura's estimate")
+            return None
+
+        layer_times = model.estimateLayers(index.getLayers())
+        time_remaining = array("d", bytes(8 * len(layer_times)))
+        remaining = 0.0
+        for layer_counter in range(len(layer_times) - 1, -1, -1):
+            remaining += layer_times[layer_counter]
+            time_remaining[layer_counter] = remaining
+        return time_remaining
+
+    @staticmethod
+    def processLayer(layer_counter, layer, context):
+        display_total_layers = context["display_total_layers"]
+        display_remaining_time = context["display_remaining_time"]
+        number_of_layers = context["number_of_layers"]
 
         # if at least one of the settings is disabled, there is enough room on the display to display "layer"
         if not display_total_layers or not display_remaining_time:
-            base_display_text = "layer "
+            display_text = "layer "
         else:
-            base_display_text = ""
-
-        # Search for the number of layers and the total time from the start code
-        for index in range(len(data)):
-            data_section = data[index]
-            if data_section.startswith(";LAYER:"):  # We have everything we need, save the index of the first layer and exit the loop
-                first_layer_index = index
-                break
+            display_text = ""
+
+        current_layer = layer_counter + 1
+        display_text += str(current_layer)
+
+        # add the total number of layers if this option is checked
+        if display_total_layers:
+            display_text += "/" + str(number_of_layers)
+
+        # if display_remaining_time is checked, it is calculated here
+        if display_remaining_time:
+            # time_elapsed at the end of the previous layer
+            time_elapsed = int(context["time_elapsed"][layer_counter - 1]) if layer_counter > 0 else 0
+
+            time_remaining_display = " | ETA "  # initialize the time display
+            if "time_remaining" in context:  # estimated from the moves, already calibrated
+                m = context["time_remaining"][layer_counter] // 60 if layer_counter < len(context["time_remaining"]) else 0
             else:
-                for line in data_section.split("\n"):  # Seperate into lines
-                    if line.startswith(";LAYER_COUNT:"):
-                        number_of_layers = int(line.split(":")[1])  # Save total layers in a variable
-                    elif line.startswith(";TIME:"):
-                        time_total = int(line.split(":")[1])  # Save total time in a variable
-
-        # for all layers...
-        for layer_counter in range(number_of_layers):
-            current_layer = layer_counter + 1
-            layer_index = first_layer_index + layer_counter
-            display_text = base_display_text
-            display_text += str(current_layer)
-
-            # create a list where each element is a single line of code within the layer
-            lines = data[layer_index].split("\n")
-
-            # add the total number of layers if this option is checked
-            if display_total_layers:
-                display_text += "/" + str(number_of_layers)
-
-            # if display_remaining_time is checked, it is calculated in this loop
-            if display_remaining_time:
-                time_remaining_display = " | ETA "  # initialize the time display
-                m = (time_total - time_elapsed) // 60  # estimated time in minutes
-                m /= speed_factor  # correct for printing time
-                m = int(m)  # convert to integer
-                h, m = divmod(m, 60)  # convert to hours and minutes
-
-                # add the time remaining to the display_text
-                if h > 0:  # if it's more than 1 hour left, display format = xHxxM
-                    time_remaining_display += str(h) + "H"
-                    if m < 10:  # add trailing zero if necessary
-                        time_remaining_display += "0"
-                    time_remaining_display += str(m) + "M"
-                else:  # otherwise, show just the number of minutes
-                    time_remaining_display += str(m) + "M"
-                display_text += time_remaining_display
-
-                # find time_elapsed at the end of the layer (used to calculate the remaining time of the next layer)
-                if not current_layer == number_of_layers:  # We don't need to this if this is the last layer
-                    for line_index in range(len(lines) - 1, -1, -1):
-                        line = lines[line_index]  # store the line as a string
-                        if line.startswith(";TIME_ELAPSED:"):
-                            # update time_elapsed for the NEXT layer and exit the loop
-                            time_elapsed = int(float(line.split(":")[1]))
-                            break
-
-            # insert the text AFTER the first line of the layer (in case other scripts use ";LAYER:")
-            lines[0] = lines[0] + "\nM117 " + display_text
-            # overwrite the layer with the modified layer
-            data[layer_index] = "\n".join(lines)
-
-        return data
+                m = (context["time_total"] - time_elapsed) // 60  # estimated time in minutes
+                m /= context["speed_factor"]  # correct for printing time
+            m = int(m)  # convert to integer
+            h, m = divmod(m, 60)  # convert to hours and minutes
+
+            # add the time remaining to the display_text
+            if h > 0:  # if it's more than 1 hour left, display format = xHxxM
+                time_remaining_display += str(h) + "H"
+                if m < 10:  # add trailing zero if necessary
+                    time_remaining_display += "0"
+                time_remaining_display += str(m) + "M"
+            else:  # otherwise, show just the number of minutes
+                time_remaining_display += str(m) + "M"
+            display_text += time_remaining_display
+
+        insert_text = "M117 " + display_text
+        if context["emit_progress"]:
+            ShowProgress._insertProgressWithinLayer(layer_counter, layer, context)
+            insert_text += "\n" + ShowProgress._progressCommand(layer_counter, 0.0, context)
+
+        # insert the text AFTER the first line of the layer (in case other scripts use ";LAYER:")
+        layer.insertAfterFirstLine(insert_text)
+
+    #   M73 command with the progress and the remaining time at a fraction of the printing time of a layer
+    @staticmethod
+    def _progressCommand(layer_counter, fraction, context):
+        time_elapsed = context["time_elapsed"]
+        layer_start = time_elapsed[layer_counter - 1] if layer_counter > 0 else 0.0
+        layer_end = time_elapsed[layer_counter] if layer_counter < len(time_elapsed) else layer_start
+        now = layer_start + fraction * (layer_end - layer_start)
+
+        if "time_remaining" in context:  # interpolate the estimate from the moves within the layer
+            time_remaining = context["time_remaining"]
+            start_remaining = time_remaining[layer_counter] if layer_counter < len(time_remaining) else 0.0
+            end_remaining = time_remaining[layer_counter + 1] if layer_counter + 1 < len(time_remaining) else 0.0
+            remaining = start_remaining + fraction * (end_remaining - start_remaining)
+            total = time_remaining[0] if time_remaining else 0.0
+            percent = 100 * (1 - remaining / total) if total > 0 else 100
+        else:
+            remaining = max(0.0, context["time_total"] - now) / context["speed_factor"]
+            percent = 100 * now / context["time_total"] if context["time_total"] > 0 else 100
+        return "M73 P" + str(min(100, max(0, int(percent)))) + " R" + str(int(remaining // 60))
+
+    #   Adds M73 commands within the layer whenever another interval of printing time has passed.
+    #   The time of every move is estimated with the model and scaled to the time Cura gives the layer, and the
+    #   commands are inserted after the moves where the cumulative time crosses an interval. The moves are found in a
+    #   single forward scan and the layer is copied once. The position before the layer isn't known to a single layer,
+    #   so the first move, which comes from the previous layer, is not counted.
+    @staticmethod
+    def _insertProgressWithinLayer(layer_counter, layer, context):
+        time_elapsed = context["time_elapsed"]
+        interval = context["progress_interval"]
+        if interval <= 0 or layer_counter >= len(time_elapsed):
+            return
+        layer_start = time_elapsed[layer_counter - 1] if layer_counter > 0 else 0.0
+        layer_duration = time_elapsed[layer_counter] - layer_start
+        if layer_duration <= interval:
+            return
+
+        model = EtaModel(context["eta_coefficients"])
+        lines = LineView(layer.getText())
+        text = lines.getText()
+        move_ends, move_times = model.estimateMoves(text, model.createState())
+        moves_duration = sum(move_times[1:])
+        if moves_duration <= 0:
+            return
+        scale = layer_duration / moves_duration
+
+        pieces = []
+        start = 0
+        now = 0.0
+        next_progress = interval
+        for move_end, move_time in zip(move_ends[1:-1], move_times[1:-1]):  # after the last move the next layer starts
+            now += move_time * scale
+            if now < next_progress:
+                continue
+            while next_progress <= now:  # several intervals in one move, only the last one matters
+                next_progress += interval
+            position = lines.getNextLineStart(move_end)
+            pieces.append(text[start:position])
+            pieces.append(ShowProgress._progressCommand(layer_counter, min(1.0, now / layer_duration), context) + "\n")
+            start = position
+        if pieces:
+            pieces.append(text[start:])
+            layer.setText("".join(pieces))
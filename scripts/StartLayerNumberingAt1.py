@@ -3,9 +3,21 @@
 # Date:     06-06-2020
 
 # Description:  This plugin will increase all the layernumbers in the gcode comments by 1 to match the layercounter in Cura's preview
+#               Instead of numbering the layers from 1, it can also add an offset to the layer numbers or map them to
+#               other numbers. Other ;LAYER: comments in a layer, e.g. written by other scripts, are renumbered too.
+#               The layer numbers of M117 texts (like those of ShowProgress) follow the position of the layer and are
+#               left alone, so the script can run before or after ShowProgress.
 
+import re
+
+from UM.Logger import Logger
+
+from ..LineView import LineView
 from ..Script import Script
 
+# a layer comment with its number, e.g. ";LAYER:-3" for a raft layer
+LAYER_REFERENCE = re.compile(r"^;LAYER:(-?[0-9]+)", re.MULTILINE)
+
 
 class StartLayerNumberingAt1(Script):
     def __init__(self):
@@ -17,32 +29,87 @@ class StartLayerNumberingAt1(Script):
             "key": "StartLayerNumberingAt1",
             "metadata": {},
             "version": 2,
-            "settings":{}
+            "settings":
+            {
+                "numbering":
+                {
+                    "label": "Numbering",
+                    "description": "Number the layers from 1 in the order they are printed (raft layers included), like the layer view of Cura; add an offset to the numbers Cura gave them (raft layers keep their negative numbers if the offset is small enough); or map numbers to other numbers.",
+                    "type": "enum",
+                    "options": {"from_1": "From 1", "offset": "Offset", "mapping": "Mapping"},
+                    "default_value": "from_1"
+                },
+                "offset":
+                {
+                    "label": "Offset",
+                    "description": "Number that is added to every layer number.",
+                    "type": "int",
+                    "default_value": 1,
+                    "enabled": "numbering == 'offset'"
+                },
+                "layer_mapping":
+                {
+                    "label": "Layer mapping",
+                    "description": "Pairs of an old and a new layer number, separated by commas, e.g. -1:0, 0:1. Layers that aren't mapped keep their number.",
+                    "type": "str",
+                    "default_value": "",
+                    "enabled": "numbering == 'mapping'"
+                }
+            }
         }"""
 
-    def execute(self, data):
-
-        # initialize global variables
-        first_layer_index = 0
-        number_of_layers = 0
-
-        # Search for the number of layers from the start code
-        for index in range(len(data)):
-            data_section = data[index]
-            if data_section.startswith(";LAYER:"):  # we have everything we need
-                first_layer_index = index           # ...save the index of the first layer
-                break                               # ......and exit the loop
-            else:
-                for line in data_section.split("\n"):  # Separate into lines
-                    if line.startswith(";LAYER_COUNT:"):
-                        number_of_layers = int(line.split(":")[1])  # Save total layers in a variable
-
-        #  for each layer
-        for layer_counter in range(number_of_layers):
-            layer_index = first_layer_index + layer_counter
-            layer = data[layer_index]  # get the current layer
-            layer = layer[layer.find("\n"):]  # remove the first line
-            layer = ";LAYER:" + str(layer_counter + 1) + layer  # insert the correct line in the layer
-            data[layer_index] = layer  # overwrite the layer in the data
-
-        return data
+    #  The layer index doesn't depend on the numbers of the layers, so it stays valid after renumbering.
+    def getLayerContext(self, index):
+        mapping = {}
+        numbering = self.getSettingValueByKey("numbering")
+        if numbering == "mapping":
+            for pair in self.getSettingValueByKey("layer_mapping").split(","):
+                old_number, separator, new_number = pair.partition(":")
+                try:
+                    mapping[int(old_number)] = int(new_number)
+                except ValueError:
+                    if pair.strip():
+                        Logger.log("w", "Ignoring layer mapping '%s'", pair.strip())
+        return {"numbering": numbering, "offset": self.getSettingValueByKey("offset"), "mapping": mapping}
+
+    @staticmethod
+    def processLayer(layer_counter, layer, context):
+        numbering = context["numbering"]
+        match = LAYER_REFERENCE.match(layer.getFirstLine())
+        number = int(match.group(1)) if match is not None else None
+
+        if numbering == "offset":
+            delta = context["offset"]
+        elif numbering == "mapping":
+            delta = None
+        else:  # from 1: the position of the layer, the other layer comments move along with it
+            delta = layer_counter + 1 - number if number is not None else 0
+
+        #  other layer comments in the layer, in a single pass over the layer
+        if layer.mayContainAfterFirstLine("\n;LAYER:"):
+            StartLayerNumberingAt1._renumberReferences(layer, delta, context["mapping"])
+
+        if numbering == "from_1":
+            layer.replaceFirstLine(";LAYER:" + str(layer_counter + 1))  # replace the first line with the correct one
+        elif number is not None:
+            new_number = number + delta if delta is not None else context["mapping"].get(number, number)
+            layer.replaceFirstLine(";LAYER:" + str(new_number) + layer.getFirstLine()[match.end():])
+
+    #  Renumbers the layer comments after the first line, copying the layer once
+    @staticmethod
+    def _renumberReferences(layer, delta, mapping):
+        lines = LineView(layer.getText())
+        text = lines.getText()
+        pieces = []
+        start = 0
+        for line_start, line in lines.startingWith(";LAYER:", lines.getNextLineStart(0)):
+            match = LAYER_REFERENCE.match(line)
+            if match is None:
+                continue
+            number = int(match.group(1))
+            pieces.append(text[start:line_start])
+            pieces.append(";LAYER:" + str(number + delta if delta is not None else mapping.get(number, number)))
+            start = line_start + match.end()
+        if pieces:
+            pieces.append(text[start:])
+            layer.setText("".join(pieces))
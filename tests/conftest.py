@@ -0,0 +1,40 @@
+# Copyright (c) 2020 Louis Wouters
+# The PostProcessingPlugin is released under the terms of the AGPLv3 or higher.
+
+# The tests load the plugin with the headless loader and generate their g-code with the benchmark generator.
+
+import os
+import random
+import re
+import sys
+from typing import List, Sequence
+
+REPOSITORY_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for directory in ("headless", "benchmarks"):
+    sys.path.insert(0, os.path.join(REPOSITORY_DIR, directory))
+from gcode_generator import generateGCode  # noqa: E402
+
+
+#   A print whose ;TIME_ELAPSED: comments are irregular: missing in some layers, layers that take no time, times on
+#   whole minutes and a ;LAYER_COUNT: that may be off by one of layer_count_changes.
+def createTimedPrint(seed: int, layers: int = 30, layer_count_changes: Sequence[int] = (0, 0, -5, 5)) -> List[str]:
+    randomizer = random.Random(seed)
+    data = generateGCode(layers = layers, lines_per_layer = 10, raft_layers = randomizer.choice((0, 0, 3)), seed = seed)
+    time_elapsed = 0.0
+    for layer_index in range(2, len(data) - 1):
+        layer, _, _ = data[layer_index].rpartition(";TIME_ELAPSED:")
+        kind = randomizer.random()
+        if kind < 0.15:
+            data[layer_index] = layer  # no ;TIME_ELAPSED:
+            continue
+        if kind < 0.3:
+            pass  # takes no time
+        elif kind < 0.5:
+            time_elapsed = (int(time_elapsed / 60) + randomizer.randint(1, 3)) * 60.0  # on a whole minute
+        else:
+            time_elapsed += randomizer.uniform(1, 120)
+        data[layer_index] = layer + ";TIME_ELAPSED:{:f}\n".format(time_elapsed)
+    layer_count = layers + randomizer.choice(layer_count_changes)
+    data[1] = data[1].replace(";LAYER_COUNT:" + str(layers), ";LAYER_COUNT:" + str(layer_count))
+    data[0] = re.sub(";TIME:[0-9]+", ";TIME:" + str(int(time_elapsed)), data[0])
+    return data
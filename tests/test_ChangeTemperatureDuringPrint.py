@@ -0,0 +1,100 @@
+# Copyright (c) 2020 Louis Wouters
+# The PostProcessingPlugin is released under the terms of the AGPLv3 or higher.
+
+# The temperature change after a number of layers and minutes is inserted where the original script inserted it, which
+# searched the layers one by one, and the temperature schedule inserts its changes in the order of the schedule.
+
+import pytest
+from conftest import createTimedPrint
+from gcode_generator import generateGCode
+from plugin_loader import createScript
+
+
+def runSchedule(schedule):
+    script = createScript("ChangeTemperatureDuringPrint", {"temperature_schedule": schedule})
+    return script.execute(generateGCode(layers = 10, lines_per_layer = 20))
+
+
+def getTemperatureLines(section):
+    return [line.split(" ;")[0] for line in section.split("\n") if line.startswith(("M140", "M104", "M109"))]
+
+
+def test_eventsAtTheSameHeight():
+    data = runSchedule("z 1: M140 50, z 1: M104 190")
+    layer = data[2 + 4]  # the fifth layer is the first one at 1 mm
+    assert layer.split("\n")[:3] == [";LAYER:4", "M140 S50 ; Set bed to 50°C", "M104 S190 ; Set nozzle to 190°C"]
+
+    data = runSchedule("z 1: M104 190, z 1: M140 50")
+    assert getTemperatureLines(data[2 + 4]) == ["M104 S190", "M140 S50"]
+
+
+def test_eventsThatBecomeDueInTheSameLayer():
+    #  both heights are first reached by the fourth layer at 0.8 mm
+    data = runSchedule("z 0.75: M104 190, z 0.7: M140 50, layer 3: M140 40, layer 2: M104 180")
+    assert getTemperatureLines(data[2 + 3]) == ["M104 S190", "M140 S50"]
+    assert getTemperatureLines(data[2 + 2]) == ["M140 S40"]
+    assert getTemperatureLines(data[2 + 1]) == ["M104 S180"]
+
+
+def test_withoutScheduleNothingIsInserted():
+    data = runSchedule("")
+    assert all(getTemperatureLines(layer) == [] for layer in data[2:-1])
+
+
+#   The original script: finds the layer after which enough time has passed layer by layer, from the end of every layer.
+def legacyChangeTemperature(data, bed_temperature, change_temperature_after_layer, minimum_minutes_after_first_layer):
+    first_layer_index = 0
+    time_total = 0
+    number_of_layers = 0
+    for index in range(len(data)):
+        data_section = data[index]
+        if data_section.startswith(";LAYER:"):
+            first_layer_index = index
+            break
+        for line in data_section.split("\n"):
+            if line.startswith(";LAYER_COUNT:"):
+                number_of_layers = int(line.split(":")[1])
+            elif line.startswith(";TIME:"):
+                time_total = int(line.split(":")[1])
+
+    if number_of_layers <= change_temperature_after_layer or time_total / 60 < minimum_minutes_after_first_layer:
+        return data
+
+    first_layer_duration_seconds = 0
+    minutes_after_first_layer = 0
+    minimum_layer = 0
+    for layer_counter in range(number_of_layers):
+        if layer_counter + 1 == number_of_layers:
+            return data
+        lines = data[first_layer_index + layer_counter].split("\n")
+        for line_index in range(len(lines) - 1, -1, -1):
+            line = lines[line_index]
+            if line.startswith(";TIME_ELAPSED:"):
+                time_elapsed = float(line.split(":")[1])
+                if layer_counter == 0:
+                    first_layer_duration_seconds = time_elapsed
+                else:
+                    minutes_after_first_layer = (time_elapsed - first_layer_duration_seconds) / 60
+                break
+        if minutes_after_first_layer >= minimum_minutes_after_first_layer:
+            minimum_layer = layer_counter + 1
+            break
+
+    turn_off_after_layer = max(minimum_layer, change_temperature_after_layer)
+    data[first_layer_index + turn_off_after_layer - 1] += "M140 S" + str(bed_temperature) + " ; Set bed to " + str(bed_temperature) + "°C\n"
+    return data
+
+
+@pytest.mark.parametrize("seed", range(12))
+@pytest.mark.parametrize("change_temperature_after_layer", [0, 1, 7])
+@pytest.mark.parametrize("minimum_minutes_after_first_layer", [0, 1, 2, 3, 5, 10, 25])
+def test_changeMatchesLegacySearch(seed, change_temperature_after_layer, minimum_minutes_after_first_layer):
+    #  the original script ran past the layers if the layer count was too high
+    data = createTimedPrint(seed, layer_count_changes = (0, -5))
+    settings = {"bed_temperature": 45, "change_temperature_after_layer": change_temperature_after_layer,
+                "minimum_minutes_after_first_layer": minimum_minutes_after_first_layer}
+    expected = legacyChangeTemperature(list(data), 45, change_temperature_after_layer, minimum_minutes_after_first_layer)
+
+    #  with all layers the layer is found with a binary search, while streaming layer by layer
+    assert createScript("ChangeTemperatureDuringPrint", settings).execute(list(data)) == expected
+    assert list(createScript("ChangeTemperatureDuringPrint", settings).executeStream(iter(data))) == expected
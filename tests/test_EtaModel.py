@@ -0,0 +1,129 @@
+# Copyright (c) 2020 Louis Wouters
+# The PostProcessingPlugin is released under the terms of the AGPLv3 or higher.
+
+# The estimate of EtaModel, in plain Python and with NumPy, matches a straightforward estimate of every move, one line
+# at a time.
+
+import math
+import random
+
+import pytest
+from gcode_generator import generateGCode
+from plugin_loader import importPluginModule
+
+EtaModelModule = importPluginModule("EtaModel")
+EtaModel = EtaModelModule.EtaModel
+
+COEFFICIENTS = {"acceleration": 1200, "travel_acceleration": 3000, "print_factor": 1.1, "travel_factor": 0.9, "layer_overhead": 2.5, "feedrate": 1800}
+
+
+#   Estimates every layer line by line, the way the model is described.
+def referenceEstimate(layers, coefficients):
+    position = {"X": 0.0, "Y": 0.0, "Z": 0.0}
+    feedrate = coefficients["feedrate"]
+    relative = False
+    layer_times = []
+    for layer in layers:
+        total = 0.0
+        for line in layer.split("\n"):
+            code = line.split(";")[0].split()
+            if not code or code[0] not in ("G0", "G1", "G90", "G91", "G92"):
+                continue
+            if code[0] in ("G90", "G91"):
+                relative = code[0] == "G91"
+                continue
+            words = {word[0]: float(word[1:]) for word in code[1:] if len(word) > 1}
+            if code[0] != "G92" and words.get("F", 0) > 0:
+                feedrate = words["F"]
+            new_position = dict(position)
+            for axis in "XYZ":
+                if axis in words:
+                    new_position[axis] = position[axis] + words[axis] if relative and code[0] != "G92" else words[axis]
+            distance = math.sqrt(sum((new_position[axis] - position[axis]) ** 2 for axis in "XYZ"))
+            position = new_position
+            if code[0] == "G92" or distance <= 0:
+                continue
+            extrudes = code[0] == "G1" and "E" in words
+            acceleration = coefficients["acceleration"] if extrudes else coefficients["travel_acceleration"]
+            speed = feedrate / 60
+            if distance >= speed * speed / acceleration:
+                time = distance / speed + speed / acceleration
+            else:
+                time = 2 * math.sqrt(distance / acceleration)
+            total += time * (coefficients["print_factor"] if extrudes else coefficients["travel_factor"])
+        layer_times.append(total + coefficients["layer_overhead"])
+    return layer_times
+
+
+#   Layers with absolute and relative moves, G92, moves without some axes, feedrates, comments and moves that only
+#   extrude or don't move at all.
+def createLayers(seed, count = 8):
+    randomizer = random.Random(seed)
+    layers = []
+    for _ in range(count):
+        lines = [";LAYER:0"]
+        for _ in range(randomizer.randint(0, 80)):
+            kind = randomizer.random()
+            if kind < 0.05:
+                lines.append(randomizer.choice(("G90", "G91", "G91 ; relative", "G90\t")))
+            elif kind < 0.08:
+                lines.append("G92 " + " ".join(axis + "{:.2f}".format(randomizer.uniform(-5, 5)) for axis in randomizer.sample("XYZE", randomizer.randint(1, 3))))
+            elif kind < 0.12:
+                lines.append("G1 F2700 E{:.4f}".format(randomizer.uniform(-2, 2)))
+            elif kind < 0.14:
+                lines.append("G1 X0 Y0 Z0")
+            else:
+                words = [randomizer.choice(("G0", "G1"))]
+                if randomizer.random() < 0.3:
+                    words.append("F" + str(randomizer.choice((600, 1500, 6000, 9000))))
+                for axis in randomizer.sample("XYZ", randomizer.randint(1, 3)):
+                    words.append(axis + "{:.3f}".format(randomizer.uniform(-20, 20)))
+                if randomizer.random() < 0.6:
+                    words.append("E{:.5f}".format(randomizer.uniform(0, 1)))
+                lines.append(" ".join(words) + (" ; move" if randomizer.random() < 0.1 else ""))
+        layers.append("\n".join(lines) + "\n")
+    return layers
+
+
+def getLayerSets():
+    return [createLayers(seed) for seed in range(15)] + [generateGCode(layers = 6, lines_per_layer = 100)[2:-1]]
+
+
+@pytest.fixture(params = ["python", "numpy"])
+def numpy_path(request, monkeypatch):
+    if request.param == "numpy":
+        pytest.importorskip("numpy")
+    else:
+        monkeypatch.setattr(EtaModelModule, "numpy", None)
+    return request.param
+
+
+def test_matchesReference(numpy_path):
+    model = EtaModel(COEFFICIENTS)
+    for layers in getLayerSets():
+        assert list(model.estimateLayers(layers)) == pytest.approx(referenceEstimate(layers, model.getCoefficients()), rel = 1e-9, abs = 1e-9)
+
+
+def test_pathsAgree():
+    numpy = pytest.importorskip("numpy")
+    model = EtaModel(COEFFICIENTS)
+    for layers in getLayerSets():
+        python_state, numpy_state = model.createState(), model.createState()
+        for layer in layers:
+            EtaModelModule.numpy = None
+            try:
+                python_ends, python_times = model.estimateMoves(layer, python_state)
+            finally:
+                EtaModelModule.numpy = numpy
+            numpy_ends, numpy_times = model.estimateMoves(layer, numpy_state)
+            assert numpy_ends == python_ends
+            assert list(numpy_times) == pytest.approx(python_times, rel = 1e-12, abs = 1e-12)
+            for attribute in ("x", "y", "z", "feedrate", "relative"):
+                assert getattr(numpy_state, attribute) == pytest.approx(getattr(python_state, attribute), rel = 1e-12, abs = 1e-12)
+
+
+def test_movesEndAtTheirLines(numpy_path):
+    layer = "G1 F600 X10 E1\nG92 X0\nG91\nG1 X5 ; relative\nG1 E-1\nG90\nG0 X5\nG0 X20 Y0\n"
+    ends, times = EtaModel().estimateMoves(layer, EtaModel().createState())
+    assert [layer[:end].rsplit("\n", 1)[-1] for end in ends] == ["G1 F600 X10 E1", "G1 X5 ", "G0 X20 Y0"]
+    assert len(times) == 3
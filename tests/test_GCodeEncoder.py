@@ -0,0 +1,79 @@
+# Copyright (c) 2020 Louis Wouters
+# The PostProcessingPlugin is released under the terms of the AGPLv3 or higher.
+
+# Round trips of the output formats of GCodeEncoder, with the g-code split into sections at arbitrary positions,
+# mostly in the middle of lines, like the sections of the streaming pipeline can be.
+
+import random
+
+import pytest
+from plugin_loader import importPluginModule
+
+GCodeEncoder = importPluginModule("GCodeEncoder")
+
+
+#   Random g-code with moves, comments, blank lines, indented and non-ASCII text.
+def createGCode(seed: int, line_count: int = 2000, trailing_newline: bool = True) -> str:
+    generator = random.Random(seed)
+    lines = [";FLAVOR:Marlin", ";LAYER_COUNT:3", "M117 Dürchgang ½ ✓", "G92 E0"]
+    for index in range(line_count):
+        kind = generator.random()
+        if kind < 0.6:
+            lines.append("G1 X{x:.3f} Y{y:.3f} E{e:.5f}".format(x = generator.uniform(0, 220), y = generator.uniform(0, 220), e = generator.uniform(0, 50)))
+        elif kind < 0.75:
+            lines.append("G0 F{f} X{x:.2f} Y{y:.2f}  ; travel".format(f = generator.choice((1500, 9000)), x = generator.uniform(0, 220), y = generator.uniform(0, 220)))
+        elif kind < 0.85:
+            lines.append(";LAYER:{number}".format(number = index // 700))
+        elif kind < 0.9:
+            lines.append("")
+        elif kind < 0.95:
+            lines.append("   M106 S255\t")
+        else:
+            lines.append(";TYPE:WALL-OUTER größe")
+    text = "\n".join(lines)
+    return text + "\n" if trailing_newline else text
+
+
+#   Splits a text into sections at random positions, so most sections end in the middle of a line.
+def splitRandomly(text: str, seed: int, section_count: int = 40) -> list:
+    generator = random.Random(seed)
+    positions = sorted(generator.sample(range(1, len(text)), section_count - 1))
+    return [text[start:end] for start, end in zip([0] + positions, positions + [len(text)])]
+
+
+def encode(encoder, sections) -> bytes:
+    return b"".join(encoder.encodeStream(sections))
+
+
+@pytest.mark.parametrize("output_format", GCodeEncoder.FORMATS)
+@pytest.mark.parametrize("compress", [True, False])
+@pytest.mark.parametrize("trailing_newline", [True, False])
+@pytest.mark.parametrize("seed", [1, 2, 3])
+def test_roundTrip(output_format, compress, trailing_newline, seed):
+    text = createGCode(seed, trailing_newline = trailing_newline)
+    encoder = GCodeEncoder.createEncoder(output_format, compress = compress, block_size = 1024)
+    decoded = GCodeEncoder.decode(encode(encoder, splitRandomly(text, seed)))
+
+    #  MeatPack only keeps the code, so it comes back minified.
+    assert decoded == (text if output_format == "blocks" else GCodeEncoder.minify(text))
+
+
+@pytest.mark.parametrize("output_format", GCodeEncoder.FORMATS)
+def test_splitDoesNotChangeOutput(output_format):
+    text = createGCode(4)
+    whole = encode(GCodeEncoder.createEncoder(output_format, block_size = 1024), [text])
+    split = encode(GCodeEncoder.createEncoder(output_format, block_size = 1024), splitRandomly(text, 4, section_count = 300))
+    assert GCodeEncoder.decode(split) == GCodeEncoder.decode(whole)
+
+
+@pytest.mark.parametrize("output_format", GCodeEncoder.FORMATS)
+def test_emptyInput(output_format):
+    encoder = GCodeEncoder.createEncoder(output_format)
+    assert GCodeEncoder.decode(encode(encoder, [])) == ""
+    assert GCodeEncoder.decode(encode(GCodeEncoder.createEncoder(output_format), ["", "", ""])) == ""
+
+
+def test_blocksAreNotBinaryGCode():
+    data = encode(GCodeEncoder.createEncoder("blocks"), [createGCode(5, line_count = 10)])
+    assert data.startswith(GCodeEncoder.BLOCK_MAGIC)
+    assert not data.startswith(b"GCDE")
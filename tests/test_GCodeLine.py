@@ -0,0 +1,86 @@
+# Copyright (c) 2020 Louis Wouters
+# The PostProcessingPlugin is released under the terms of the AGPLv3 or higher.
+
+# Script.putValue, which delegates to GCodeLine, writes the same lines as the original implementation.
+
+import random
+
+import pytest
+from gcode_generator import generateGCode
+from plugin_loader import createScript, importPluginModule
+
+GCodeLine = importPluginModule("GCodeLine").GCodeLine
+
+
+#   The implementation of Script.putValue before GCodeLine.
+def legacyPutValue(line = "", **kwargs):
+    # Strip the comment.
+    comment = ""
+    if ";" in line:
+        comment = line[line.find(";"):]
+        line = line[:line.find(";")]  # Strip the comment.
+
+    # Parse the original g-code line and add them to kwargs.
+    for part in line.split(" "):
+        if part == "":
+            continue
+        parameter = part[0]
+        if parameter not in kwargs:
+            value = part[1:]
+            kwargs[parameter] = value
+
+    # Start writing the new g-code line.
+    line_parts = list()
+    # First add these parameters in order
+    for parameter in ["G", "M", "T", "S", "F", "X", "Y", "Z", "E"]:
+        if parameter in kwargs:
+            line_parts.append(parameter + str(kwargs.pop(parameter)))
+    # Then add the rest of the parameters
+    for parameter, value in kwargs.items():
+        line_parts.append(parameter + str(value))
+
+    # If there was a comment, put it back in.
+    if comment != "":
+        line_parts.append(comment)
+
+    # Construct the new line
+    return " ".join(line_parts)
+
+
+EDGE_CASES = ["", ";", "; only a comment", "G1", "G1 X", "  G1  X1  ", "G1 X1 X2", "E5 G1 X1", "G1 X1;comment", "G1 X1 ; a;b",
+              "M117 Layer 5/120", "G1 x1 X2", "T0", "G1\tX1", "P5 G4", "G1 X1 Y2 Z3 E4 F5 S6 T7 M8 Q9"]
+
+
+def createKeywords(randomizer):
+    values = (0, -1, 12, 1.5, -0.25, 1e-7, 123456789.125, "7", "", True, None)
+    return {key: randomizer.choice(values) for key in randomizer.sample("GMTSFXYZEPQR", randomizer.randint(0, 4))}
+
+
+def getLines():
+    data = generateGCode(layers = 3, lines_per_layer = 100)
+    return EDGE_CASES + [line for section in data for line in section.split("\n")]
+
+
+@pytest.mark.parametrize("seed", [1, 2, 3])
+def test_putValueMatchesOriginal(seed):
+    randomizer = random.Random(seed)
+    script = createScript("ShowProgress")
+    for line in getLines():
+        for _ in range(5):
+            keywords = createKeywords(randomizer)
+            assert script.putValue(line, **keywords) == legacyPutValue(line, **keywords), (line, keywords)
+    assert script.putValue() == legacyPutValue() == ""
+    assert script.putValue(G = 1, X = 100) == legacyPutValue(G = 1, X = 100) == "G1 X100"
+
+
+def test_modifyAndSerializeOnce():
+    line = GCodeLine.parse("G1 F1500 X10.5 E0.12345 ; wall", decimals = {"E": 5})
+    assert line.get("X") == 10.5 and line.get("E") == 0.12345 and line.get("Y", 0) == 0
+    line.set("E", line.get("E") * 2)
+    line.set("Y", 3)
+    line.remove("F")
+    assert line.serialize() == "G1 X10.5 Y3 E0.24690 ; wall"
+    assert "Y" in line and "F" not in line
+
+    #  words that are not modified keep their text
+    assert GCodeLine.parse("G1 X010.50 E.5").serialize() == "G1 X010.50 E.5"
@@ -0,0 +1,76 @@
+# Copyright (c) 2020 Louis Wouters
+# The PostProcessingPlugin is released under the terms of the AGPLv3 or higher.
+
+# The word parser gives the same values as the original Script.getValue (legacyGetValue of the benchmark), except for
+# letters inside longer words, which the original matched too.
+
+import random
+
+import pytest
+from gcode_generator import generateGCode
+from getvalue_benchmark import legacyGetValue
+from plugin_loader import createScript, importPluginModule
+
+GCodeParser = importPluginModule("GCodeParser")
+
+KEYS = "GMTSFXYZEP"
+
+EDGE_CASES = [
+    "", ";", "G1", "G1 X", "G1 X Y", "G1 X-", "G1 X.5", "G1 X1.", "G1 X-0.0", "G1 X007", "G1 X1.2.3", "G1 X1e3",
+    "G1 X10 X20", "G1 E-6.5 ; retract", "G1 X5;Y6", "G1 X5 ; X6 Y7", ";LAYER:-3", ";TIME_ELAPSED:12.5", "M104 S200 T1",
+    "T0", "  G0   F6000  X10  ", "G1\tX1\tY2", "M140 S0 ; Turn off bed", "G28 ;Home", "M106 S255.0"
+]
+
+
+#   Random lines of the words the scripts read, with comments, signs, decimals and odd spacing.
+def createLines(count, seed):
+    randomizer = random.Random(seed)
+    lines = []
+    for _ in range(count):
+        words = [randomizer.choice(("G0", "G1", "G92", "M104", "M140", "M109", "T1"))]
+        for key in randomizer.sample("FXYZES", randomizer.randint(0, 4)):
+            number = randomizer.choice((str(randomizer.randint(-500, 500)), "{:.{}f}".format(randomizer.uniform(-500, 500), randomizer.randint(0, 6)), "0", "-0"))
+            words.append(key + number)
+        line = randomizer.choice((" ", "  ")).join(words)
+        if randomizer.random() < 0.3:
+            line += " ;" + randomizer.choice((" comment", "X9 Y8", "TYPE:FILL", ""))
+        lines.append(line)
+    return lines
+
+
+def getLines():
+    data = generateGCode(layers = 5, lines_per_layer = 200)
+    return EDGE_CASES + createLines(3000, seed = 7) + [line for section in data for line in section.split("\n")]
+
+
+@pytest.mark.parametrize("default", [None, -1, "missing"])
+def test_getValueMatchesOriginal(default):
+    for line in getLines():
+        for key in KEYS:
+            assert GCodeParser.getValue(line, key, default) == legacyGetValue(line, key, default), (line, key)
+            assert type(GCodeParser.getValue(line, key, default)) is type(legacyGetValue(line, key, default)), (line, key)
+
+
+def test_getValuesMatchesGetValue():
+    for line in getLines():
+        assert GCodeParser.getValues(line, KEYS) == tuple(GCodeParser.getValue(line, key) for key in KEYS), line
+        assert GCodeParser.getValues(line, "XY", 0) == (GCodeParser.getValue(line, "X", 0), GCodeParser.getValue(line, "Y", 0)), line
+
+
+def test_scriptGetValue():
+    script = createScript("ShowProgress")
+    for line in EDGE_CASES:
+        for key in KEYS:
+            assert script.getValue(line, key) == legacyGetValue(line, key), (line, key)
+
+
+#  The original matched a letter anywhere in the code, also inside a longer word, and only looked at the first
+#  occurrence of the letter, also if no number followed it.
+def test_differencesWithOriginal():
+    assert legacyGetValue("M117 Print10", "t") == 10
+    assert GCodeParser.getValue("M117 Print10", "t") is None
+    assert GCodeParser.getValues("M117 Layer 5/120", "ry") == (None, None)
+    assert legacyGetValue("G1 XY10", "Y") == 10
+    assert GCodeParser.getValue("G1 XY10", "Y") is None
+    assert legacyGetValue("G1 X Y10 X5", "X") is None
+    assert GCodeParser.getValue("G1 X Y10 X5", "X") == 5
@@ -0,0 +1,70 @@
+# Copyright (c) 2020 Louis Wouters
+# The PostProcessingPlugin is released under the terms of the AGPLv3 or higher.
+
+# The layer index holds the same values the scripts used to look up for themselves, splitting every section into lines.
+
+import pytest
+from conftest import createTimedPrint
+from plugin_loader import importPluginModule
+
+LayerIndex = importPluginModule("LayerIndex").LayerIndex
+
+
+#   The lookups of the original scripts: the start code up to the first layer, and every layer from the end.
+def legacyIndex(data):
+    first_layer_index = 0
+    time_total = 0
+    number_of_layers = 0
+    for index in range(len(data)):
+        data_section = data[index]
+        if data_section.startswith(";LAYER:"):
+            first_layer_index = index
+            break
+        for line in data_section.split("\n"):
+            if line.startswith(";LAYER_COUNT:"):
+                number_of_layers = int(line.split(":")[1])
+            elif line.startswith(";TIME:"):
+                time_total = int(line.split(":")[1])
+
+    time_elapsed = []
+    previous = 0.0
+    for section in data[first_layer_index:]:
+        if not section.startswith(";LAYER:"):
+            continue
+        lines = section.split("\n")
+        for line_index in range(len(lines) - 1, -1, -1):
+            if lines[line_index].startswith(";TIME_ELAPSED:"):
+                previous = float(lines[line_index].split(":")[1])
+                break
+        time_elapsed.append(previous)
+    return first_layer_index, number_of_layers, time_total, time_elapsed
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_indexMatchesLegacyLookups(seed):
+    data = createTimedPrint(seed)
+    index = LayerIndex.build(data)
+    first_layer_index, number_of_layers, time_total, time_elapsed = legacyIndex(data)
+    assert index.first_layer_index == first_layer_index
+    assert index.layer_count == number_of_layers
+    assert index.time_total == time_total
+    assert list(index.time_elapsed) == time_elapsed
+    assert list(index.time_elapsed) == sorted(index.time_elapsed)  # so it can be searched with bisect
+    assert [data[offset].split("\n")[0] for offset in index.layer_offsets] == [section.split("\n")[0] for section in data if section.startswith(";LAYER:")]
+
+    #  observing the sections one at a time while streaming gives the same index
+    streamed = LayerIndex()
+    for section in data:
+        streamed.observe(section)
+    assert (streamed.first_layer_index, streamed.layer_count, streamed.time_total) == (first_layer_index, number_of_layers, time_total)
+    assert streamed.layer_offsets == index.layer_offsets and streamed.time_elapsed == index.time_elapsed
+    assert index.isComplete() and not streamed.isComplete()
+
+
+def test_describes():
+    data = createTimedPrint(1)
+    index = LayerIndex.build(data)
+    assert index.describes(data)
+    assert not index.describes(list(data))
+    data.append(";End")
+    assert not index.describes(data)
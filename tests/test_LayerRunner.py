@@ -0,0 +1,56 @@
+# Copyright (c) 2020 Louis Wouters
+# The PostProcessingPlugin is released under the terms of the AGPLv3 or higher.
+
+# LayerRunner gives the same result as running the scripts one by one, with forked and with spawned workers.
+
+import os
+import subprocess
+import sys
+import textwrap
+
+from conftest import REPOSITORY_DIR
+from gcode_generator import generateGCode
+from plugin_loader import createScript, importPluginModule
+
+LayerRunner = importPluginModule("LayerRunner").LayerRunner
+
+
+def createScripts():
+    return [createScript("ShowProgress"), createScript("StartLayerNumberingAt1", {"numbering": "offset", "offset": 3}),
+            createScript("ChangeTemperatureDuringPrint", {"bed_temperature": 45})]
+
+
+def runOneByOne(scripts, data):
+    for script in scripts:
+        data = script.execute(data)
+    return data
+
+
+def test_runScriptsMatchesOneByOne():
+    data = generateGCode(layers = 60, lines_per_layer = 20, raft_layers = 2)
+    expected = runOneByOne(createScripts(), list(data))
+    assert LayerRunner(workers = 2, chunk_size = 8).runScripts(createScripts(), list(data)) == expected
+
+
+def test_spawnedWorkers(tmp_path):
+    #  a spawned worker imports the main module of the program first, which loads the plugin package
+    program = tmp_path / "spawn_layers.py"
+    program.write_text(textwrap.dedent("""
+        import sys
+        sys.path[:0] = [{headless!r}, {benchmarks!r}]
+        import plugin_loader
+        plugin_loader.loadPlugin()
+
+        if __name__ == "__main__":
+            from gcode_generator import generateGCode
+            LayerRunner = plugin_loader.importPluginModule("LayerRunner").LayerRunner
+            data = generateGCode(layers = 40, lines_per_layer = 10)
+            expected = plugin_loader.createScript("ShowProgress").execute(list(data))
+            layer_runner = LayerRunner(workers = 2, chunk_size = 8, start_method = "spawn")
+            result = layer_runner.run(plugin_loader.createScript("ShowProgress"), list(data))
+            print("identical" if result == expected else "different")
+    """).format(headless = os.path.join(REPOSITORY_DIR, "headless"), benchmarks = os.path.join(REPOSITORY_DIR, "benchmarks")))
+    completed = subprocess.run([sys.executable, str(program)], stdout = subprocess.PIPE, stderr = subprocess.PIPE, universal_newlines = True, timeout = 120)
+    assert completed.stdout.strip() == "identical"
+    assert "Can't process the layers" not in completed.stderr + completed.stdout
+    assert "Traceback" not in completed.stderr
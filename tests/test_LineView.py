@@ -0,0 +1,72 @@
+# Copyright (c) 2020 Louis Wouters
+# The PostProcessingPlugin is released under the terms of the AGPLv3 or higher.
+
+# LineView gives the same lines as splitting the section, however it is read.
+
+import random
+
+import pytest
+from gcode_generator import generateGCode
+from plugin_loader import importPluginModule
+
+LineView = importPluginModule("LineView").LineView
+
+PREFIXES = (";", ";LAYER:", ";TIME_ELAPSED:", "G", "G1 ", "T", "M117 ", "")
+
+
+def createTexts():
+    texts = ["", "\n", "\n\n", "G1", "G1\n", "\nG1", ";LAYER:0", ";LAYER:0\n;LAYER:1", "G1 X1\n\n;TIME_ELAPSED:1\n",
+             "T0\nT1\n", "  G1\n;\n"]
+    randomizer = random.Random(5)
+    lines = ["G1 X1 Y2", "G0 F6000", ";TYPE:FILL", ";LAYER:3", ";TIME_ELAPSED:12.5", "T1", "M117 layer 3", "", " G1", "GX"]
+    for _ in range(200):
+        texts.append("\n".join(randomizer.choice(lines) for _ in range(randomizer.randint(0, 12))))
+    return texts + generateGCode(layers = 3, lines_per_layer = 50)
+
+
+def expectedStartingWith(text, prefix, start = 0):
+    result = []
+    position = 0
+    for line in text.split("\n"):
+        if position >= start and line.startswith(prefix):
+            result.append((position, line))
+        position += len(line) + 1
+    return result
+
+
+@pytest.mark.parametrize("text", createTexts())
+def test_linesMatchSplit(text):
+    lines = text.split("\n")
+    view = LineView(text)
+    assert len(view) == len(lines)
+    assert list(view) == lines
+    assert list(reversed(view)) == lines[::-1]
+    for index in range(-len(lines), len(lines)):
+        assert view[index] == lines[index]
+    for index in (len(lines), -len(lines) - 1):
+        with pytest.raises(IndexError):
+            view[index]  # noqa: B018
+    assert view[1:] == lines[1:] and view[::-2] == lines[::-2] and view[-3:-1] == lines[-3:-1]
+
+    #  indexing backwards after indexing forwards uses the remembered line starts
+    fresh = LineView(text)
+    assert [fresh[index] for index in reversed(range(len(lines)))] == lines[::-1]
+
+
+@pytest.mark.parametrize("text", createTexts())
+def test_searchesMatchSplit(text):
+    view = LineView(text)
+    for prefix in PREFIXES:
+        matches = expectedStartingWith(text, prefix)
+        assert list(view.startingWith(prefix)) == matches
+        assert view.firstStartingWith(prefix) == (matches[0][1] if matches else None)
+        assert view.lastStartingWith(prefix) == (matches[-1][1] if matches else None)
+        #  from the start of a later line on
+        for line_start in (view.getNextLineStart(0), view.getNextLineStart(len(text) // 2)):
+            assert list(view.startingWith(prefix, line_start)) == expectedStartingWith(text, prefix, line_start)
+
+
+def test_nextLineStart():
+    text = "G1\n\nG0 X1"
+    view = LineView(text)
+    assert [view.getNextLineStart(position) for position in range(len(text))] == [3, 3, 3, 4, 9, 9, 9, 9, 9]
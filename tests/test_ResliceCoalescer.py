@@ -0,0 +1,111 @@
+# Copyright (c) 2020 Louis Wouters
+# The PostProcessingPlugin is released under the terms of the AGPLv3 or higher.
+
+# A burst of setting changes triggers a single reslice from one reusable timer on the event loop.
+
+import pytest
+from plugin_loader import importPluginModule
+
+ResliceCoalescerModule = importPluginModule("ResliceCoalescer")
+ResliceCoalescer = ResliceCoalescerModule.ResliceCoalescer
+
+
+#   Stands in for the QTimer of the event loop, which the test runs out by hand.
+class FakeTimer:
+    created = []
+
+    def __init__(self):
+        self.single_shot = False
+        self.interval = None
+        self.active = False
+        self.starts = 0
+        self._callbacks = []
+        self.timeout = self
+        FakeTimer.created.append(self)
+
+    def setSingleShot(self, single_shot):
+        self.single_shot = single_shot
+
+    def connect(self, callback):
+        self._callbacks.append(callback)
+
+    def start(self, interval):
+        self.interval = interval
+        self.active = True
+        self.starts += 1
+
+    def stop(self):
+        self.active = False
+
+    def runOut(self):
+        assert self.active
+        self.active = False
+        for callback in self._callbacks:
+            callback()
+
+
+class FakeCoreApplication:
+    @staticmethod
+    def instance():
+        return FakeCoreApplication
+
+
+@pytest.fixture
+def event_loop(monkeypatch):
+    FakeTimer.created = []
+    monkeypatch.setattr(ResliceCoalescerModule, "QTimer", FakeTimer)
+    monkeypatch.setattr(ResliceCoalescerModule, "QCoreApplication", FakeCoreApplication)
+    return FakeTimer.created
+
+
+def test_burstTriggersOnce(event_loop):
+    triggers = []
+    coalescer = ResliceCoalescer(triggers.append, window = 0.25)
+    coalescer.setAppliedValues({"speed_factor": 100})
+    for value in range(101, 121):
+        coalescer.valueChanged("speed_factor", value)
+    assert triggers == []
+    assert len(event_loop) == 1 and event_loop[0].single_shot and event_loop[0].interval == 250
+    assert event_loop[0].starts == 20
+
+    event_loop[0].runOut()
+    assert triggers == ["speed_factor"]
+    assert (coalescer.getEmittedCount(), coalescer.getSuppressedCount()) == (1, 19)
+
+    #  the next burst reuses the timer, and a burst that ends at the applied values triggers nothing
+    coalescer.valueChanged("speed_factor", 125)
+    coalescer.valueChanged("speed_factor", 120)
+    event_loop[0].runOut()
+    assert len(event_loop) == 1
+    assert triggers == ["speed_factor"]
+    assert (coalescer.getEmittedCount(), coalescer.getSuppressedCount()) == (1, 21)
+
+
+def test_flushEndsTheBurst(event_loop):
+    triggers = []
+    coalescer = ResliceCoalescer(triggers.append)
+    coalescer.valueChanged("bed_temperature", 50)
+    coalescer.valueChanged("nozzle_temperature", 190)
+    coalescer.flush()
+    assert triggers == ["nozzle_temperature"]
+    assert not event_loop[0].active
+
+
+def test_withoutEventLoopEveryChangeTriggers(monkeypatch):
+    monkeypatch.setattr(ResliceCoalescerModule, "QTimer", None)
+    monkeypatch.setattr(ResliceCoalescerModule, "QCoreApplication", None)
+    triggers = []
+    coalescer = ResliceCoalescer(triggers.append)
+    coalescer.setAppliedValues({"offset": 1})
+    for value in (2, 2, 1, 3):
+        coalescer.valueChanged("offset", value)
+    assert triggers == ["offset", "offset", "offset"]
+    assert (coalescer.getEmittedCount(), coalescer.getSuppressedCount()) == (3, 1)
+
+
+def test_zeroWindowTriggersRightAway(event_loop):
+    triggers = []
+    coalescer = ResliceCoalescer(triggers.append, window = 0)
+    coalescer.valueChanged("offset", 2)
+    assert triggers == ["offset"]
+    assert event_loop == []
@@ -0,0 +1,104 @@
+# Copyright (c) 2020 Louis Wouters
+# The PostProcessingPlugin is released under the terms of the AGPLv3 or higher.
+
+# Fusing the scripts into a ScriptPipeline, streaming the sections and the headless runner give the same result as
+# running the scripts one by one over the data list, the way Cura always did, for random chains of scripts.
+
+import os
+import random
+
+import pytest
+from gcode_generator import generateGCode
+from plugin_loader import createScript, getScriptNames, importPluginModule
+
+import post_process
+
+ScriptPipeline = importPluginModule("ScriptPipeline").ScriptPipeline
+
+#   Values to pick the settings of a script from. Settings that are left out keep their default value.
+SETTING_CHOICES = {
+    "ShowProgress": {
+        "display_total_layers": [True, False],
+        "display_remaining_time": [True, False],
+        "speed_factor": [1.0, 0.8],
+        "eta_mode": ["cura", "model"],
+        "emit_progress": [True, False],
+        "progress_interval": [0.1, 0.5]
+    },
+    "StartLayerNumberingAt1": {
+        "numbering": ["from_1", "offset", "mapping"],
+        "offset": [1, -3, 10],
+        "layer_mapping": ["5:2", "-2:0, -1:1, 3:10", "0:100, 1:0"]
+    },
+    "ChangeTemperatureDuringPrint": {
+        "bed_temperature": [-1, 0, 45],
+        "nozzle_temperature": [-1, 190],
+        "change_temperature_after_layer": [0, 3, 10],
+        "minimum_minutes_after_first_layer": [0, 1, 5],
+        "temperature_schedule": ["", "z 1: M140 50, z 1: M104 190, layer 4: M109 200, minutes 2: M140 0"]
+    },
+    "FilamentChangeAtStart": {
+        "enabled": [True, False],
+        "number_of_cleaning_lines": [1, 3],
+        "purge_geometry": ["fixed", "bed"],
+        "filament_change_layers": ["", "3", "2, 6"]
+    }
+}
+
+
+def test_allScriptsAreCovered():
+    assert sorted(SETTING_CHOICES) == getScriptNames()
+
+
+#   A random chain of scripts with random settings, as (name, settings) pairs. Scripts can occur more than once.
+def createChain(seed):
+    randomizer = random.Random(seed)
+    chain = []
+    for _ in range(randomizer.randint(1, 5)):
+        name = randomizer.choice(sorted(SETTING_CHOICES))
+        choices = SETTING_CHOICES[name]
+        chain.append((name, {key: randomizer.choice(values) for key, values in choices.items() if randomizer.random() < 0.7}))
+    return chain
+
+
+def createPrint(seed):
+    return generateGCode(layers = 12, lines_per_layer = 40, raft_layers = seed % 3, seed = seed)
+
+
+def createScripts(chain):
+    return [createScript(name, settings) for name, settings in chain]
+
+
+def runOneByOne(chain, data):
+    for script in createScripts(chain):
+        data = script.execute(data)
+    return data
+
+
+@pytest.mark.parametrize("seed", range(60))
+def test_pipelineMatchesOneByOne(seed):
+    chain = createChain(seed)
+    expected = runOneByOne(chain, createPrint(seed))
+
+    assert ScriptPipeline(createScripts(chain)).execute(createPrint(seed)) == expected, chain
+    assert list(ScriptPipeline(createScripts(chain)).executeStream(iter(createPrint(seed)))) == expected, chain
+
+    #  every script streaming on its own, chained as generators
+    stream = iter(createPrint(seed))
+    for script in createScripts(chain):
+        stream = script.executeStream(stream)
+    assert list(stream) == expected, chain
+
+
+@pytest.mark.parametrize("seed", range(0, 60, 6))
+def test_headlessRunnerMatchesOneByOne(seed, tmp_path):
+    chain = createChain(seed)
+    path = str(tmp_path / "print.gcode")
+    with open(path, "w", encoding = "utf-8") as f:
+        f.write("".join(createPrint(seed)))
+    expected = "".join(runOneByOne(chain, list(post_process.readSections(path))))
+
+    result = post_process.processFile(path, str(tmp_path), chain)
+    with open(result["output"], encoding = "utf-8") as f:
+        assert f.read() == expected, chain
+    os.remove(result["output"])
@@ -0,0 +1,50 @@
+# Copyright (c) 2020 Louis Wouters
+# The PostProcessingPlugin is released under the terms of the AGPLv3 or higher.
+
+# The profiler measures every execute and every streamed stage, also while memory is already traced and on Pythons
+# without tracemalloc.reset_peak (before 3.9).
+
+import tracemalloc
+
+import pytest
+from gcode_generator import generateGCode
+from plugin_loader import createScript, importPluginModule
+
+Script = importPluginModule("Script").Script
+ScriptPipeline = importPluginModule("ScriptPipeline").ScriptPipeline
+ScriptProfiler = importPluginModule("ScriptProfiler").ScriptProfiler
+
+
+@pytest.fixture
+def profiler():
+    yield ScriptProfiler()
+    Script.setProfiler(None)
+
+
+def runProfiled(profiler):
+    data = generateGCode(layers = 20, lines_per_layer = 20)
+    expected = createScript("ShowProgress").execute(list(data))  # not profiled
+    Script.setProfiler(profiler)
+    assert createScript("ShowProgress").execute(list(data)) == expected
+    scripts = [createScript("ShowProgress"), createScript("StartLayerNumberingAt1")]
+    assert len(list(ScriptPipeline(scripts).executeStream(iter(data)))) == len(data)
+    return profiler.getStatistics()
+
+
+@pytest.mark.parametrize("already_tracing", [False, True])
+@pytest.mark.parametrize("reset_peak", [True, False])
+def test_profile(profiler, monkeypatch, already_tracing, reset_peak):
+    if not reset_peak:
+        monkeypatch.delattr(tracemalloc, "reset_peak", raising = False)
+    if already_tracing:
+        tracemalloc.start()
+    try:
+        statistics = runProfiled(profiler)
+        assert tracemalloc.is_tracing() == already_tracing
+    finally:
+        if already_tracing:
+            tracemalloc.stop()
+
+    assert [run["script"] for run in statistics] == ["ShowProgress", "ShowProgress+StartLayerNumberingAt1"]
+    assert [run["streamed"] for run in statistics] == [False, True]
+    assert all(run["peak_memory"] >= 0 for run in statistics)
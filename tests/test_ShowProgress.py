@@ -0,0 +1,73 @@
+# Copyright (c) 2020 Louis Wouters
+# The PostProcessingPlugin is released under the terms of the AGPLv3 or higher.
+
+# With Cura's estimate, ShowProgress writes the same texts as the original script, which looked up the elapsed time at
+# the end of every layer itself.
+
+import pytest
+from conftest import createTimedPrint
+from plugin_loader import createScript
+
+
+#   The original script.
+def legacyShowProgress(data, display_total_layers, display_remaining_time, speed_factor):
+    first_layer_index = 0
+    time_total = 0
+    number_of_layers = 0
+    time_elapsed = 0
+    base_display_text = "layer " if not display_total_layers or not display_remaining_time else ""
+    for index in range(len(data)):
+        data_section = data[index]
+        if data_section.startswith(";LAYER:"):
+            first_layer_index = index
+            break
+        for line in data_section.split("\n"):
+            if line.startswith(";LAYER_COUNT:"):
+                number_of_layers = int(line.split(":")[1])
+            elif line.startswith(";TIME:"):
+                time_total = int(line.split(":")[1])
+
+    for layer_counter in range(number_of_layers):
+        current_layer = layer_counter + 1
+        layer_index = first_layer_index + layer_counter
+        display_text = base_display_text + str(current_layer)
+        lines = data[layer_index].split("\n")
+        if display_total_layers:
+            display_text += "/" + str(number_of_layers)
+        if display_remaining_time:
+            time_remaining_display = " | ETA "
+            m = (time_total - time_elapsed) // 60
+            m /= speed_factor
+            m = int(m)
+            h, m = divmod(m, 60)
+            if h > 0:
+                time_remaining_display += str(h) + "H"
+                if m < 10:
+                    time_remaining_display += "0"
+                time_remaining_display += str(m) + "M"
+            else:
+                time_remaining_display += str(m) + "M"
+            display_text += time_remaining_display
+            if not current_layer == number_of_layers:
+                for line_index in range(len(lines) - 1, -1, -1):
+                    line = lines[line_index]
+                    if line.startswith(";TIME_ELAPSED:"):
+                        time_elapsed = int(float(line.split(":")[1]))
+                        break
+        lines[0] = lines[0] + "\nM117 " + display_text
+        data[layer_index] = "\n".join(lines)
+    return data
+
+
+@pytest.mark.parametrize("seed", range(10))
+@pytest.mark.parametrize("display_total_layers", [True, False])
+@pytest.mark.parametrize("display_remaining_time", [True, False])
+@pytest.mark.parametrize("speed_factor", [1.0, 0.7])
+def test_matchesLegacyScript(seed, display_total_layers, display_remaining_time, speed_factor):
+    #  the original script ran past the layers if the layer count was too high
+    data = createTimedPrint(seed, layer_count_changes = (0, -5))
+    settings = {"display_total_layers": display_total_layers, "display_remaining_time": display_remaining_time, "speed_factor": speed_factor}
+    expected = legacyShowProgress(list(data), display_total_layers, display_remaining_time, speed_factor)
+
+    assert createScript("ShowProgress", settings).execute(list(data)) == expected
+    assert list(createScript("ShowProgress", settings).executeStream(iter(data))) == expected
@@ -0,0 +1,70 @@
+# Copyright (c) 2020 Louis Wouters
+# The PostProcessingPlugin is released under the terms of the AGPLv3 or higher.
+
+# StartLayerNumberingAt1 must give the same result before and after ShowProgress, fused or not, and must not change
+# the layer count, whatever the numbering.
+
+import pytest
+from gcode_generator import generateGCode
+from plugin_loader import createScript, importPluginModule
+
+ScriptPipeline = importPluginModule("ScriptPipeline").ScriptPipeline
+
+NUMBERINGS = [
+    {"numbering": "from_1"},
+    {"numbering": "offset", "offset": 1},
+    {"numbering": "offset", "offset": -5},
+    {"numbering": "mapping", "layer_mapping": "5:2"},
+    {"numbering": "mapping", "layer_mapping": "-2:0, -1:1, 3:10"}
+]
+
+
+def createPrint():
+    return generateGCode(layers = 8, lines_per_layer = 30, raft_layers = 2, seed = 3)
+
+
+def createScripts(numbering, renumber_first):
+    scripts = [createScript("ShowProgress"), createScript("StartLayerNumberingAt1", numbering)]
+    return scripts[::-1] if renumber_first else scripts
+
+
+def runOneByOne(scripts, data):
+    for script in scripts:
+        data = script.execute(data)
+    return data
+
+
+@pytest.mark.parametrize("numbering", NUMBERINGS)
+def test_orderDoesNotMatter(numbering):
+    after_show_progress = runOneByOne(createScripts(numbering, renumber_first = False), createPrint())
+    before_show_progress = runOneByOne(createScripts(numbering, renumber_first = True), createPrint())
+    assert before_show_progress == after_show_progress
+
+
+@pytest.mark.parametrize("numbering", NUMBERINGS)
+@pytest.mark.parametrize("renumber_first", [True, False])
+def test_pipelineMatchesOneByOne(numbering, renumber_first):
+    one_by_one = runOneByOne(createScripts(numbering, renumber_first), createPrint())
+    fused = ScriptPipeline(createScripts(numbering, renumber_first)).execute(createPrint())
+    streamed = list(ScriptPipeline(createScripts(numbering, renumber_first)).executeStream(iter(createPrint())))
+    assert fused == one_by_one
+    assert streamed == one_by_one
+
+
+@pytest.mark.parametrize("numbering", NUMBERINGS)
+def test_layerCountAndProgressTexts(numbering):
+    data = runOneByOne(createScripts(numbering, renumber_first = True), createPrint())
+    assert ";LAYER_COUNT:8\n" in data[1]
+    #  the M117 texts follow the position of the layer, whatever its number
+    progress_texts = [layer.split("\n")[1].split(" | ")[0] for layer in data[2:-1]]
+    assert progress_texts == ["M117 {number}/8".format(number = number) for number in range(1, 9)]
+
+
+def test_numbers():
+    numbering = {"numbering": "offset", "offset": 1}
+    data = runOneByOne([createScript("StartLayerNumberingAt1", numbering)], createPrint())
+    assert [layer.split("\n")[0] for layer in data[2:-1]] == [";LAYER:" + str(number) for number in range(-1, 7)]
+
+    numbering = {"numbering": "mapping", "layer_mapping": "-2:0, -1:1, 3:10"}
+    data = runOneByOne([createScript("StartLayerNumberingAt1", numbering)], createPrint())
+    assert [layer.split("\n")[0] for layer in data[2:-1]] == [";LAYER:" + str(number) for number in (0, 1, 0, 1, 2, 10, 4, 5)]